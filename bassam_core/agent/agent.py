@@ -1,82 +1,313 @@
 # bassam_core/agent/agent.py
 # وكيل تنفيذ الأوامر الآمن لبسام الذكي
 
-import os, asyncio, json, subprocess, sys, time
+import os, asyncio, codecs, json, random, shutil, signal, subprocess, sys, time
 import websockets
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
+try:
+    from .codec import Codec, CodecError, available, offer
+except ImportError:  # تشغيل مباشر: python agent/agent.py
+    from codec import Codec, CodecError, available, offer
 
 # 🧩 إعدادات من البيئة (Environment Variables)
 SERVER_WS = os.getenv("SERVER_WS", "wss://your-render-domain.onrender.com/ws/device")
 DEVICE_ID = os.getenv("DEVICE_ID", "device1")
 DEVICE_TOKEN = os.getenv("DEVICE_TOKEN", "device-token-here")
-FERNET_KEY = os.getenv("FERNET_KEY", "")  # نفس المفتاح المستخدم في الخادم
+FERNET_KEY = os.getenv("FERNET_KEY", "")  # نفس المفتاح المستخدم في الخادم (أو قائمة مفصولة بفواصل، الأول أساسي)
+FERNET_OLD_KEYS = os.getenv("FERNET_OLD_KEYS", "")  # مفاتيح سابقة: للفك فقط أثناء تدوير المفاتيح
+DEVICE_TAGS = [t.strip() for t in os.getenv("DEVICE_TAGS", "").split(",") if t.strip()]  # لاختيار الدفعات
+CHUNK_BYTES = int(os.getenv("AGENT_CHUNK_BYTES", "4096"))              # حجم مقطع المخرجات المرسل
+STREAM_MAX_BYTES = int(os.getenv("AGENT_STREAM_MAX", str(1024 * 1024)))  # بعده نصرّف بلا إرسال
+RESULT_TAIL_CHARS = 2000                                                # ذيل المخرجات في رسالة النتيجة
+MAX_CONCURRENCY = int(os.getenv("AGENT_MAX_CONCURRENCY", "4"))         # أوامر تعمل معاً
+CANCEL_GRACE_SEC = float(os.getenv("AGENT_CANCEL_GRACE_SEC", "3"))      # SIGTERM ثم SIGKILL بعدها
+COMMAND_TIMEOUT = int(os.getenv("AGENT_COMMAND_TIMEOUT", "60"))
+SEAL = os.getenv("AGENT_SEAL", "1") == "1"            # ختم الرسائل بـ Fernet إن وُجد المفتاح
+WS_DEFLATE = os.getenv("AGENT_WS_DEFLATE", "1") == "1"  # permessage-deflate
+# إعادة الاتصال: تراجع أسّي مع ارتعاش كامل كي لا يعود الأسطول كله في نفس اللحظة
+BACKOFF_BASE = float(os.getenv("AGENT_BACKOFF_BASE", "1"))
+BACKOFF_MAX = float(os.getenv("AGENT_BACKOFF_MAX", "120"))
+STABLE_SEC = float(os.getenv("AGENT_STABLE_SEC", "30"))   # اتصال عاش أكثر من هذا → يُصفَّر التراجع
+# نبض التطبيق: ping كل PING_SEC؛ خادم صامت لأكثر من DEAD_SEC يُعدّ ميتاً
+PING_SEC = float(os.getenv("AGENT_PING_SEC", "20"))
+DEAD_SEC = float(os.getenv("AGENT_DEAD_SEC", str(PING_SEC * 3)))
+TELEMETRY_SEC = float(os.getenv("AGENT_TELEMETRY_SEC", "15"))   # 0 = بلا قياسات
 
-# ⚙️ تهيئة Fernet للتشفير (اختياري حاليًا)
+# ⚙️ تهيئة Fernet لختم الرسائل (اختياري؛ يُتفاوض عليه عند التسجيل)
 def _get_fernet():
-    if not FERNET_KEY:
+    # نفس ترتيب الخادم (utils/crypto): الأساسي يختم، والقديمة تفك فقط
+    keys = [k.strip() for k in (FERNET_KEY + "," + FERNET_OLD_KEYS).split(",") if k.strip()]
+    if not keys:
         return None
     try:
-        return Fernet(FERNET_KEY)
+        return MultiFernet([Fernet(k) for k in dict.fromkeys(keys)])
     except Exception as e:
         print("⚠️ Fernet key error:", e)
         return None
 
-# 🚀 تنفيذ الأوامر داخل النظام المحلي
-async def run_command(cmd: str, timeout: int = 30):
+# 📤 الإرسال: عدة أوامر تعمل معاً وتكتب على نفس الاتصال → قفل واحد للإطارات
+_send_lock = asyncio.Lock()
+_codec = Codec()          # JSON حتى يرد الخادم بما اتُّفق عليه
+
+async def send_msg(ws, obj):
+    frame = _codec.encode(obj)
+    async with _send_lock:
+        await ws.send(frame)
+
+# 🧮 حالة التنفيذ: cmd_id -> المهمة / العملية
+_tasks = {}
+_procs = {}
+_cancelled = set()
+_sem = None
+
+async def _kill_group(proc, grace: float = CANCEL_GRACE_SEC):
+    """SIGTERM لمجموعة العمليات ثم SIGKILL إن لم تنتهِ خلال grace ثانية"""
+    if proc.returncode is not None:
+        return
+    for sig in ((signal.SIGTERM,) if grace > 0 else ()) + (signal.SIGKILL,):
+        try:
+            if os.name == "posix":
+                os.killpg(proc.pid, sig)
+            else:
+                proc.kill()
+        except ProcessLookupError:
+            return
+        try:
+            await asyncio.wait_for(proc.wait(), timeout=grace or None)
+            return
+        except asyncio.TimeoutError:
+            continue
+
+def _load():
+    running = len(_procs)
+    return {"type": "status", "running": running, "queued": len(_tasks) - running,
+            "max": MAX_CONCURRENCY, "ts": int(time.time())}
+
+# 🚀 تنفيذ الأوامر داخل النظام المحلي مع بث المخرجات أثناء التشغيل
+async def run_command_stream(ws, cmd_id: str, cmd: str, timeout: int = 30):
+    """يقرأ المخرجات على مقاطع ويرسل كلاً منها {"type":"chunk", seq} فور وصوله.
+    الضغط العكسي: لا نقرأ المقطع التالي قبل اكتمال ws.send السابق، فإن تباطأ
+    الخادم امتلأ أنبوب العملية وتوقفت هي عن الكتابة بدل أن تتكدس المخرجات في الذاكرة."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    tail, seq, sent = "", 0, 0
+    status = "ok"
+
+    async def emit(text: str):
+        nonlocal tail, seq, sent
+        if not text:
+            return
+        tail = (tail + text)[-RESULT_TAIL_CHARS:]
+        if sent >= STREAM_MAX_BYTES:
+            return                      # تجاوزنا الحد: نكمل التصريف فقط
+        seq += 1
+        sent += len(text.encode("utf-8"))
+        # نفس الترميز/الختم المتفق عليه ونفس قفل الإطارات كبقية الرسائل
+        await send_msg(ws, {"type": "chunk", "cmd_id": cmd_id, "seq": seq, "data": text})
+
     try:
+        # جلسة جديدة = مجموعة عمليات خاصة: الإلغاء يقتل الصدفة وكل أبنائها
         proc = await asyncio.create_subprocess_shell(
-            cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+            cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+            start_new_session=(os.name == "posix"),
         )
-        try:
-            out, _ = await asyncio.wait_for(proc.communicate(), timeout=timeout)
-            text = out.decode(errors="replace")
-            return {"status": "ok", "output": text}
-        except asyncio.TimeoutError:
-            proc.kill()
-            return {"status": "timeout", "output": "Execution timeout"}
     except Exception as e:
-        return {"status": "error", "output": str(e)}
+        return {"status": "error", "output": str(e), "chunks": 0, "bytes": 0}
+    _procs[cmd_id] = proc
 
-# 💡 حلقة التشغيل الرئيسية
-async def agent_loop():
-    print(f"🔗 Connecting to {SERVER_WS} as {DEVICE_ID}...")
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise asyncio.TimeoutError
+            block = await asyncio.wait_for(proc.stdout.read(CHUNK_BYTES), timeout=left)
+            if not block:
+                break
+            await emit(decoder.decode(block))
+        await emit(decoder.decode(b"", final=True))
+        await asyncio.wait_for(proc.wait(), timeout=max(0.1, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        await _kill_group(proc, grace=0)
+        status = "timeout"
+        await emit("\n[Execution timeout]\n")
+    finally:
+        # خروج بخطأ (انقطع ws.send مثلاً): لا نترك العملية معلقة على أنبوب ممتلئ
+        if proc.returncode is None:
+            await _kill_group(proc, grace=0)
+        _procs.pop(cmd_id, None)
+    if cmd_id in _cancelled:
+        status = "cancelled"
+        await emit("\n[Cancelled]\n")
+    return {"status": status, "output": tail, "exit_code": proc.returncode,
+            "chunks": seq, "bytes": sent, "truncated": sent >= STREAM_MAX_BYTES}
+
+async def execute(ws, cmd_id: str, command: str):
+    """مهمة أمر واحد: ينتظر مقعداً (queued) ثم يعمل (running) ثم يرسل النتيجة"""
+    try:
+        await send_msg(ws, {"type": "state", "cmd_id": cmd_id, "state": "queued"})
+        await send_msg(ws, _load())
+        async with _sem:
+            if cmd_id in _cancelled:
+                raise asyncio.CancelledError
+            await send_msg(ws, {"type": "state", "cmd_id": cmd_id, "state": "running"})
+            print(f"🧭 Executing command from server: {command}")
+            result = await run_command_stream(ws, cmd_id, command, timeout=COMMAND_TIMEOUT)
+    except asyncio.CancelledError:
+        # أُلغي وهو في الطابور (أو أثناء الإغلاق)
+        result = {"status": "cancelled", "output": "[Cancelled before start]", "chunks": 0, "bytes": 0}
+    except Exception as e:
+        # فشل البث (الاتصال انقطع غالباً)؛ العملية قُتلت في run_command_stream
+        print("⚠️ Command stream failed:", cmd_id, e)
+        result = {"status": "error", "output": f"[Stream failed: {e}]", "chunks": 0, "bytes": 0}
+    finally:
+        _tasks.pop(cmd_id, None)
+        _cancelled.discard(cmd_id)
+    try:
+        # إرسال النتيجة للخادم: الذيل فقط، والمخرجات الكاملة وصلت مقاطعَ
+        await send_msg(ws, {"type": "result", "cmd_id": cmd_id, "streamed": True, **result})
+        await send_msg(ws, _load())
+    except Exception as e:
+        print("⚠️ Could not report result:", cmd_id, e)
+
+def cancel(cmd_id: str) -> bool:
+    """إلغاء أمر: في الطابور → إلغاء المهمة، قيد التشغيل → قتل مجموعة العمليات"""
+    task = _tasks.get(cmd_id)
+    if not task:
+        return False
+    _cancelled.add(cmd_id)
+    proc = _procs.get(cmd_id)
+    if proc is not None:
+        # القتل قد ينتظر مهلة SIGTERM؛ لا نوقف حلقة الاستقبال لأجله
+        asyncio.create_task(_kill_group(proc))
+    else:
+        task.cancel()
+    return True
+
+# 💓 نبض التطبيق واكتشاف الطرف الميت
+async def _heartbeat(ws, state):
+    while True:
+        await asyncio.sleep(PING_SEC)
+        silent = time.monotonic() - state["last_rx"]
+        if silent > DEAD_SEC:
+            # لا رد (ولا حتى pong) → الاتصال معلّق (NAT، بروكسي) حتى لو لم تُغلقه النواة
+            print(f"💀 Server silent for {silent:.0f}s — dropping connection")
+            await ws.close()
+            return
+        await send_msg(ws, {"type": "ping", "ts": time.time()})
+
+# 📈 قياسات خفيفة دورية (بلا اعتماديات: /proc و os فقط)
+def _mem_pct():
+    try:
+        info = {}
+        with open("/proc/meminfo") as f:
+            for line in f:
+                k, v = line.split(":", 1)
+                info[k] = int(v.split()[0])
+        return round(100.0 * (1 - info["MemAvailable"] / info["MemTotal"]), 2)
+    except (OSError, KeyError, ValueError, ZeroDivisionError):
+        return None
+
+def telemetry_sample():
+    try:
+        load1 = round(os.getloadavg()[0], 3)
+    except (OSError, AttributeError):
+        load1 = None
     try:
-        async with websockets.connect(SERVER_WS) as ws:
-            # إرسال بيانات التسجيل
-            await ws.send(json.dumps({"device_id": DEVICE_ID, "token": DEVICE_TOKEN}))
-            reg_reply = await ws.recv()
-            print("✅ Registration reply:", reg_reply)
-
-            while True:
-                msg = await ws.recv()
+        du = shutil.disk_usage("/")
+        disk = round(100.0 * du.used / du.total, 2)
+    except OSError:
+        disk = None
+    running = len(_procs)
+    return {"type": "telemetry", "ts": time.time(), "load1": load1, "mem_pct": _mem_pct(),
+            "disk_pct": disk, "running": running, "queued": len(_tasks) - running}
+
+async def _telemetry(ws):
+    while True:
+        await send_msg(ws, telemetry_sample())
+        await asyncio.sleep(TELEMETRY_SEC)
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX) -> float:
+    """Full jitter: انتظار عشوائي منتظم بين 0 و min(cap, base·2^attempt)"""
+    # الأس محدود: 2**1024 لا يتحول لـ float (OverflowError) بعد انقطاع طويل للخادم
+    return random.uniform(0, min(cap, base * (2 ** min(max(attempt, 0), 30))))
+
+# 🔌 اتصال واحد: تسجيل ثم استقبال حتى ينقطع
+async def session(state):
+    global _codec
+    print(f"🔗 Connecting to {SERVER_WS} as {DEVICE_ID}...")
+    async with websockets.connect(SERVER_WS, compression="deflate" if WS_DEFLATE else None) as ws:
+        # إرسال بيانات التسجيل (JSON دائماً) مع ما ندعمه من ترميز وفترة النبض
+        fernet = _get_fernet()
+        seal = SEAL and fernet is not None
+        # إثبات المفتاح: الخادم يختم لنا بنفس مفتاحنا الأساسي ولو كان قد دوّر مفتاحه
+        proof = fernet.encrypt(DEVICE_ID.encode()).decode() if seal else None
+        await ws.send(json.dumps({"device_id": DEVICE_ID, "token": DEVICE_TOKEN, "tags": DEVICE_TAGS,
+                                  "heartbeat": PING_SEC, **offer(seal=seal, proof=proof)}))
+        reg_reply = await ws.recv()
+        print("✅ Registration reply:", reg_reply)
+        reply = json.loads(reg_reply)
+        if not reply.get("ok"):
+            raise RuntimeError(f"registration refused: {reply}")
+        state["registered_at"] = time.monotonic()
+        state["last_rx"] = time.monotonic()
+        # خادم قديم لا يذكر codec → نبقى على JSON
+        kind = reply.get("codec") if reply.get("codec") in available() else "json"
+        if seal and not reply.get("seal"):
+            print("⚠️ Server declined sealing (key mismatch?) — channel is not sealed")
+        _codec = Codec(kind, fernet if reply.get("seal") else None)
+        await send_msg(ws, _load())
+
+        beat = asyncio.create_task(_heartbeat(ws, state))
+        tele = asyncio.create_task(_telemetry(ws)) if TELEMETRY_SEC > 0 else None
+        try:
+            async for msg in ws:
+                state["last_rx"] = time.monotonic()
                 try:
-                    obj = json.loads(msg)
-                except Exception:
-                    print("⚠️ Received invalid message:", msg)
+                    obj = _codec.decode(msg)
+                except CodecError as e:
+                    print("⚠️ Received invalid message:", e)
                     continue
 
-                if obj.get("type") == "execute":
+                kind = obj.get("type")
+                if kind == "execute":
+                    # مهمة مستقلة: نواصل استقبال الرسائل (إلغاء، أوامر أخرى) أثناء التنفيذ
                     cmd_id = obj.get("cmd_id")
-                    command = obj.get("command")
-                    print(f"🧭 Executing command from server: {command}")
-                    result = await run_command(command, timeout=60)
-
-                    # إرسال النتيجة للخادم
-                    payload = {
-                        "type": "result",
-                        "cmd_id": cmd_id,
-                        "status": result["status"],
-                        "output": result["output"][:2000],  # تقليم المخرجات الطويلة
-                    }
-                    await ws.send(json.dumps(payload))
-    except Exception as e:
-        print("❌ Connection error:", e)
-        print("🔁 Retrying in 15s...")
-        await asyncio.sleep(15)
-        await agent_loop()
+                    if cmd_id in _tasks:
+                        continue
+                    _tasks[cmd_id] = asyncio.create_task(execute(ws, cmd_id, obj.get("command")))
+                elif kind == "cancel":
+                    cmd_id = obj.get("cmd_id")
+                    print(f"✋ Cancel requested: {cmd_id}")
+                    if not cancel(cmd_id):
+                        await send_msg(ws, {"type": "state", "cmd_id": cmd_id, "state": "unknown"})
+        finally:
+            beat.cancel()
+            if tele:
+                tele.cancel()
+
+# 💡 حلقة التشغيل الرئيسية: تكرارية (لا تنمو المكدس مع كل إعادة اتصال)
+async def agent_loop():
+    global _sem
+    _sem = _sem or asyncio.Semaphore(MAX_CONCURRENCY)
+    attempt = 0
+    while True:
+        state = {"registered_at": None}
+        try:
+            await session(state)
+            reason = "connection closed"
+        except Exception as e:
+            reason = f"connection error: {e or type(e).__name__}"
+        # لا يمكن تسليم نتائج ما يعمل الآن → نوقفه بدل تركه يتيماً
+        for cmd_id in list(_tasks):
+            cancel(cmd_id)
+        lived = state["registered_at"] and time.monotonic() - state["registered_at"] >= STABLE_SEC
+        attempt = 0 if lived else attempt + 1
+        delay = backoff_delay(attempt)
+        print(f"❌ {reason} — retrying in {delay:.1f}s (attempt {attempt})")
+        await asyncio.sleep(delay)
 
 if __name__ == "__main__":
     try:
-        asyncio.get_event_loop().run_until_complete(agent_loop())
+        asyncio.run(agent_loop())
     except KeyboardInterrupt:
         print("🛑 Agent stopped manually.")
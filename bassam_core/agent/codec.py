@@ -0,0 +1,106 @@
+# bassam_core/agent/codec.py
+# ترميز رسائل قناة الأجهزة (مشترك بين الوكيل والخادم)
+# - JSON نصي: الافتراضي القديم، ويبقى بديلاً دائماً
+# - إطار ثنائي: بايت الإصدار + بايت الأعلام ثم الجسم (msgpack أو JSON)
+#   اختيارياً: ضغط zlib ثم ختم Fernet (الضغط قبل التشفير؛ بعده لا يُضغط شيء)
+# - التفاوض: الوكيل يعرض ما يدعمه في رسالة التسجيل والخادم يختار في الرد
+import json, zlib
+from typing import Any, Dict, List, Optional, Union
+
+try:
+    import msgpack
+except ImportError:  # الوكيل على جهاز بلا msgpack → JSON
+    msgpack = None
+
+VERSION = 1
+F_MSGPACK = 0x01
+F_ZLIB = 0x02
+F_SEALED = 0x04
+ZLIB_MIN_BYTES = 512     # الرسائل الأصغر لا يفيدها الضغط
+
+Frame = Union[str, bytes]
+
+class CodecError(ValueError):
+    """إطار لا يمكن فكّه (إصدار غير معروف، ختم غير صالح، جسم تالف)"""
+
+def available() -> List[str]:
+    return ["msgpack", "json"] if msgpack is not None else ["json"]
+
+class Codec:
+    def __init__(self, kind: str = "json", fernet: Any = None):
+        if kind == "msgpack" and msgpack is None:
+            raise CodecError("msgpack not installed")
+        self.kind = kind
+        self.fernet = fernet
+
+    @property
+    def sealed(self) -> bool:
+        return self.fernet is not None
+
+    def encode(self, obj: Dict[str, Any]) -> Frame:
+        # JSON بلا ختم = إطار نصي كما كان (متوافق مع الوكلاء القدامى)
+        if self.kind == "json" and not self.sealed:
+            return json.dumps(obj, ensure_ascii=False)
+        flags = 0
+        if self.kind == "msgpack":
+            body = msgpack.packb(obj, use_bin_type=True)
+            flags |= F_MSGPACK
+        else:
+            body = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if self.sealed:
+            # permessage-deflate لا يضغط نصاً مشفراً → نضغط نحن قبل الختم
+            if len(body) >= ZLIB_MIN_BYTES:
+                body = zlib.compress(body, 6)
+                flags |= F_ZLIB
+            body = self.fernet.encrypt(body)
+            flags |= F_SEALED
+        return bytes((VERSION, flags)) + body
+
+    def decode(self, frame: Frame) -> Dict[str, Any]:
+        # قناة مختومة: لا نثق ببايت الأعلام؛ أي إطار غير مختوم (نصي أو ثنائي) مرفوض
+        # وإلا حقن طرف بلا مفتاح رسائل execute/result
+        if self.sealed and (isinstance(frame, str) or len(frame) < 2 or not frame[1] & F_SEALED):
+            raise CodecError("unsealed frame on a sealed channel")
+        if isinstance(frame, str):
+            try:
+                return json.loads(frame)
+            except ValueError as e:
+                raise CodecError(f"bad json frame: {e}") from e
+        if len(frame) < 2 or frame[0] != VERSION:
+            raise CodecError(f"unsupported frame version {frame[0] if frame else None}")
+        flags, body = frame[1], frame[2:]
+        try:
+            if flags & F_SEALED:
+                if not self.fernet:
+                    raise CodecError("sealed frame but no key")
+                body = self.fernet.decrypt(body)
+            if flags & F_ZLIB:
+                body = zlib.decompress(body)
+            if flags & F_MSGPACK:
+                if msgpack is None:
+                    raise CodecError("msgpack frame but msgpack not installed")
+                return msgpack.unpackb(body, raw=False)
+            return json.loads(body)
+        except CodecError:
+            raise
+        except Exception as e:
+            raise CodecError(f"bad frame: {type(e).__name__}: {e}") from e
+
+def offer(seal: bool = False, proof: Optional[str] = None) -> Dict[str, Any]:
+    """ما يضيفه الوكيل لرسالة التسجيل؛ proof = device_id مختوماً بمفتاحه الأساسي
+    كي يختم الخادم رسائله بنفس المفتاح (أثناء تدوير المفاتيح)"""
+    out: Dict[str, Any] = {"codecs": available(), "seal": bool(seal)}
+    if seal and proof:
+        out["seal_proof"] = proof
+    return out
+
+def negotiate(hello: Dict[str, Any], fernet: Any = None) -> Codec:
+    """اختيار الخادم: أول ترميز يدعمه الطرفان، والختم إن طلبه الوكيل وتوفر المفتاح"""
+    offered = hello.get("codecs") or ["json"]
+    kind = next((k for k in offered if k in available()), "json")
+    return Codec(kind, fernet if hello.get("seal") and fernet is not None else None)
+
+def describe(codec: Optional[Codec]) -> Dict[str, Any]:
+    """ما يضيفه الخادم لرد التسجيل كي يعرف الوكيل ما اتُّفق عليه"""
+    codec = codec or Codec()
+    return {"codec": codec.kind, "seal": codec.sealed, "version": VERSION}
@@ -1,5 +1,5 @@
 from typing import Optional
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, Request
 from fastapi.responses import JSONResponse
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
@@ -7,6 +7,8 @@ from pydantic import BaseModel
 # استيراد الأدوات الداخلية
 from .storage import get_state, set_state, recent_summaries, enqueue_query
 from workers.run_cycle import run_once
+from workers.jobs import JobsBusy, submit
+from .app.admission import Ticket, admit
 
 templates = Jinja2Templates(directory="bassam_core/templates")
 router = APIRouter()
@@ -56,10 +58,19 @@ def api_queue(q: str):
     return {"ok": True, "queued": q}
 
 
+def _busy(e: JobsBusy):
+    return JSONResponse({"ok": False, "error": "الخادم مشغول، حاول بعد قليل", "detail": str(e)},
+                        status_code=429, headers={"Retry-After": "5"})
+
+
 @router.post("/learn/once")
 def api_learn_once(q: Optional[str] = None):
-    info = run_once(q or None)
-    return {"ok": True, **info}
+    # دورة كاملة قد تستغرق عشرات الثواني → مهمة خلفية؛ التقدّم عبر /api/jobs/{id}
+    try:
+        job = submit("learn_once", run_once, q or None, params={"q": q})
+    except JobsBusy as e:
+        return _busy(e)
+    return {"ok": True, "job_id": job.id, "status": job.status}
 
 
 # ============================================================
@@ -105,7 +116,7 @@ async def api_search(payload: SearchRequest):
 # ============================================================
 
 @router.post("/news")
-async def api_news(payload: NewsRequest):
+async def api_news(payload: NewsRequest, ticket: Ticket = Depends(admit("learn"))):
     query = payload.query.strip()
     engine = payload.engine
     mode = payload.mode
@@ -122,15 +133,23 @@ async def api_news(payload: NewsRequest):
             "result": f"تم وضع '{query}' في الطابور بدون تشغيل دورة التعلم."
         }
 
-    # --- بحث + تلخيص + تعلم (فوري) ---
-    info = run_once(query)
+    # --- بحث + تلخيص + تعلم (مهمة خلفية: الرد فوري والنتيجة عبر /api/jobs/{id}) ---
+    # مقعد القبول يبقى محجوزاً حتى تنتهي المهمة
+    release = ticket.detach()
+    try:
+        job = submit("news", run_once, query, on_done=release,
+                     params={"query": query, "engine": engine, "mode": mode})
+    except JobsBusy as e:
+        release()
+        return _busy(e)
 
     return {
         "ok": True,
         "mode": mode,
         "engine": engine,
-        "result": info.get("summary") if isinstance(info, dict) else str(info),
-        "raw": info
+        "job_id": job.id,
+        "status": job.status,
+        "result": f"تم بدء البحث والتعلم عن '{query}'…"
     }
 
 
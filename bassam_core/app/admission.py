@@ -0,0 +1,209 @@
+# bassam_core/app/admission.py
+# التحكم بالقبول للمسارات التي تولّد بحثاً/جلباً خارجياً
+# - دلو رموز لكل عميل (معدل + دفعة) لكل فئة مسارات
+# - ميزانية تزامن لكل فئة (عدد الأعمال الجارية معاً)
+# - طابور انتظار محدود؛ ما زاد عنه أو انتظر أكثر من المهلة يُرفض بـ 429 + Retry-After
+import os, math, time, asyncio, threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict
+
+from fastapi import HTTPException, Request
+
+ADMIT_TRUST_PROXY = os.getenv("ADMIT_TRUST_PROXY", "0") == "1"   # خلف بروكسي موثوق (Render…)
+ADMIT_MAX_CLIENTS = int(os.getenv("ADMIT_MAX_CLIENTS", "10000"))
+
+def _cfg(cls: str, key: str, default: str) -> float:
+    return float(os.getenv(f"ADMIT_{cls.upper()}_{key}", default))
+
+# الفئة: (معدل رموز/ثانية، الدفعة، التزامن، طول الطابور، مهلة الانتظار بالثواني)
+CLASSES: Dict[str, Dict[str, float]] = {
+    cls: {"rate": _cfg(cls, "RATE", r), "burst": _cfg(cls, "BURST", b),
+          "concurrency": _cfg(cls, "CONCURRENCY", c), "queue": _cfg(cls, "QUEUE", q),
+          "wait": _cfg(cls, "WAIT", w)}
+    for cls, (r, b, c, q, w) in {
+        "learn": ("0.2", "3", "2", "8", "10"),   # بحث + جلب + تلخيص (مهام خلفية)
+        "chat": ("1", "5", "4", "16", "10"),     # بحث + تلخيص داخل الطلب
+    }.items()
+}
+
+class Shed(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+# ==== دلو الرموز لكل عميل ====
+class TokenBuckets:
+    def __init__(self, rate: float, burst: float, max_clients: int = ADMIT_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()   # client -> [tokens, last]
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    def take(self, client: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            b = self._buckets.pop(client, None) or [self.burst, now]
+            b[0] = min(self.burst, b[0] + (now - b[1]) * self.rate)
+            b[1] = now
+            self._buckets[client] = b          # الأحدث في النهاية (LRU)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            if b[0] < 1:
+                self.limited += 1
+                raise Shed("rate_limited", (1 - b[0]) / self.rate if self.rate > 0 else 60)
+            b[0] -= 1
+
+    def refund(self, client: str) -> None:
+        with self._lock:
+            b = self._buckets.get(client)
+            if b:
+                b[0] = min(self.burst, b[0] + 1)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+# ==== ميزانية التزامن + طابور الانتظار ====
+class Gate:
+    def __init__(self, limit: int, max_queue: int, wait: float):
+        self.limit = max(1, int(limit))
+        self.max_queue = max(0, int(max_queue))
+        self.wait = wait
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._lock = threading.Lock()
+        self.hold_avg = 1.0          # متوسط متحرك لزمن شغل المقعد (لتقدير Retry-After)
+        self.admitted = 0
+        self.shed = 0
+
+    def _eta(self) -> float:
+        return self.hold_avg * (len(self._waiters) + 1) / self.limit
+
+    async def acquire(self) -> None:
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                self.admitted += 1
+                return
+            if len(self._waiters) >= self.max_queue:
+                self.shed += 1
+                raise Shed("overloaded", self._eta())
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), self.wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                got = fut.done() and not fut.cancelled()
+                if not got:
+                    # إن كان التسليم في الطريق فـ _hand_over سيجده ملغى ويمرّره للتالي
+                    fut.cancel()
+                    if fut in self._waiters:
+                        self._waiters.remove(fut)
+            if isinstance(e, asyncio.CancelledError):
+                if got:                       # وصل المقعد لكن العميل قطع الاتصال
+                    self.release(0.0)
+                raise
+            if not got:
+                with self._lock:
+                    self.shed += 1
+                    raise Shed("queue_timeout", self._eta())
+        with self._lock:
+            self.admitted += 1
+
+    def release(self, held: float) -> None:
+        """آمن من أي خيط (المهام الخلفية تنتهي في خيوط المنفّذ)"""
+        with self._lock:
+            self.hold_avg = 0.8 * self.hold_avg + 0.2 * held
+            self._next()
+
+    def _next(self) -> None:
+        # داخل _lock: المقعد ينتقل لأول منتظر مباشرة (active لا يتغير) أو يُعاد
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                try:
+                    fut.get_loop().call_soon_threadsafe(self._hand_over, fut)
+                    return
+                except RuntimeError:          # حلقة المنتظر أُغلقت
+                    continue
+        self.active -= 1
+
+    def _hand_over(self, fut: asyncio.Future) -> None:
+        if not fut.done():
+            fut.set_result(True)
+            return
+        with self._lock:                      # المنتظر ألغى قبل التسليم → للتالي
+            self._next()
+
+class Ticket:
+    """مقعد مقبول؛ يُحرَّر عند انتهاء الطلب أو يُنقل لمهمة خلفية (detach)"""
+
+    def __init__(self, gate: Gate):
+        self._gate = gate
+        self._start = time.monotonic()
+        self._done = False
+        self._detached = False
+        self._lock = threading.Lock()
+
+    def release(self) -> None:
+        with self._lock:
+            if self._done:
+                return
+            self._done = True
+        self._gate.release(time.monotonic() - self._start)
+
+    def detach(self) -> Callable[[], None]:
+        """يبقى المقعد محجوزاً بعد نهاية الطلب؛ يعيد دالة تحريره"""
+        self._detached = True
+        return self.release
+
+# ==== المتحكم ====
+class Admission:
+    def __init__(self, classes: Dict[str, Dict[str, float]]):
+        self.buckets = {c: TokenBuckets(v["rate"], v["burst"]) for c, v in classes.items()}
+        self.gates = {c: Gate(v["concurrency"], v["queue"], v["wait"]) for c, v in classes.items()}
+
+    async def enter(self, cls: str, client: str) -> Ticket:
+        self.buckets[cls].take(client)
+        try:
+            await self.gates[cls].acquire()
+        except Shed:
+            self.buckets[cls].refund(client)   # لم يُخدم → لا يُحتسب على حصته
+            raise
+        return Ticket(self.gates[cls])
+
+    def stats(self) -> Dict[str, Any]:
+        out = {}
+        for cls, gate in self.gates.items():
+            b = self.buckets[cls]
+            out[cls] = {**CLASSES.get(cls, {}), "active": gate.active, "waiting": len(gate._waiters),
+                        "admitted": gate.admitted, "shed": gate.shed, "rate_limited": b.limited,
+                        "clients": len(b), "hold_avg_sec": round(gate.hold_avg, 3)}
+        return out
+
+ADMISSION = Admission(CLASSES)
+
+def client_key(request: Request) -> str:
+    if ADMIT_TRUST_PROXY:
+        fwd = request.headers.get("x-forwarded-for")
+        if fwd:
+            return fwd.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+def admit(cls: str):
+    """اعتمادية FastAPI: Depends(admit("learn")) → Ticket أو 429"""
+    async def dependency(request: Request):
+        try:
+            ticket = await ADMISSION.enter(cls, client_key(request))
+        except Shed as e:
+            raise HTTPException(429, {"error": e.reason, "retry_after": e.retry_after},
+                                headers={"Retry-After": str(e.retry_after)})
+        try:
+            yield ticket
+        finally:
+            if not ticket._detached:
+                ticket.release()
+    return dependency
@@ -0,0 +1,157 @@
+# bassam_core/app/answer_cache.py
+# كاش الإجابات: مفتاحه السؤال بعد توحيد الكتابة العربية/اللاتينية + النبرة
+import os, json, time, threading
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+from utils.textnorm import normalize, tokens as content_tokens
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+CACHE_PATH = os.path.join(DATA_DIR, "answer_cache.jsonl")
+
+CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "1800"))            # ثوانٍ
+CACHE_PERSIST = os.getenv("ANSWER_CACHE_PERSIST", "0") == "1"
+NEAR_THRESHOLD = float(os.getenv("ANSWER_CACHE_NEAR", "0.8"))      # تشابه Jaccard
+# مع الأسئلة الطويلة يسمح 0.8 وحده باستبدال كلمات (2023 ← 2024)؛ نحدّ عدد الكلمات المختلفة أيضاً
+NEAR_MAX_DIFF = int(os.getenv("ANSWER_CACHE_NEAR_DIFF", "1"))
+CACHE_FORMAT = 2   # 2: القيمة بلا ترويسة السؤال (تُعاد صياغتها لكل طلب)
+
+# ==== الكاش ====
+Key = Tuple[str, str]   # (tone, normalized)
+
+class AnswerCache:
+    def __init__(self, capacity: int = CACHE_SIZE, ttl: int = CACHE_TTL,
+                 path: Optional[str] = None, near_threshold: float = NEAR_THRESHOLD,
+                 near_max_diff: int = NEAR_MAX_DIFF):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.path = path
+        self.near_threshold = near_threshold
+        self.near_max_diff = near_max_diff
+        self._items: "OrderedDict[Key, Dict]" = OrderedDict()
+        self._index: Dict[str, Set[Key]] = {}   # كلمة → مفاتيح (للبحث عن الأسئلة المتقاربة)
+        self._lock = threading.Lock()
+        self._appended = 0
+        self.hits = self.near_hits = self.misses = 0
+        if path:
+            self._load()
+
+    # ---- داخلي ----
+    def _drop(self, key: Key) -> None:
+        item = self._items.pop(key, None)
+        if not item:
+            return
+        for tok in item["tokens"]:
+            keys = self._index.get(tok)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._index[tok]
+
+    def _insert(self, key: Key, value: str, ts: float) -> None:
+        self._drop(key)
+        tokens = frozenset(content_tokens(key[1]))
+        self._items[key] = {"value": value, "ts": ts, "tokens": tokens}
+        for tok in tokens:
+            self._index.setdefault(tok, set()).add(key)
+        while len(self._items) > self.capacity:
+            self._drop(next(iter(self._items)))
+
+    def _fresh(self, key: Key, now: float) -> Optional[Dict]:
+        item = self._items.get(key)
+        if item and now - item["ts"] > self.ttl:
+            self._drop(key)
+            return None
+        return item
+
+    def _near(self, tone: str, tokens: frozenset, now: float) -> Optional[Key]:
+        if len(tokens) < 2:
+            return None
+        candidates: Set[Key] = set()
+        for tok in tokens:
+            candidates.update(k for k in self._index.get(tok, ()) if k[0] == tone)
+        best, best_sim = None, self.near_threshold
+        for key in candidates:
+            item = self._fresh(key, now)
+            if not item:
+                continue
+            other = item["tokens"]
+            if len(tokens ^ other) > self.near_max_diff:
+                continue
+            sim = len(tokens & other) / len(tokens | other)
+            if sim >= best_sim:
+                best, best_sim = key, sim
+        return best
+
+    # ---- الواجهة ----
+    def get(self, question: str, tone: str) -> Optional[str]:
+        norm = normalize(question)
+        key = (tone, norm)
+        now = time.time()
+        with self._lock:
+            item = self._fresh(key, now)
+            if item is None:
+                near = self._near(tone, frozenset(content_tokens(norm)), now)
+                if near is None:
+                    self.misses += 1
+                    return None
+                key, item = near, self._items[near]
+                self.near_hits += 1
+            else:
+                self.hits += 1
+            self._items.move_to_end(key)
+            return item["value"]
+
+    def put(self, question: str, tone: str, value: str) -> None:
+        norm = normalize(question)
+        if not norm:
+            return
+        now = time.time()
+        with self._lock:
+            self._insert((tone, norm), value, now)
+            if self.path:
+                self._persist({"v": CACHE_FORMAT, "tone": tone, "q": norm, "value": value, "ts": now})
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"size": len(self._items), "hits": self.hits,
+                    "near_hits": self.near_hits, "misses": self.misses}
+
+    # ---- الحفظ على القرص (اختياري) ----
+    def _persist(self, rec: Dict) -> None:
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self._appended += 1
+            if self._appended > 4 * self.capacity:
+                self._compact()
+        except Exception as e:
+            print("⚠️ Answer cache persist error:", e)
+
+    def _compact(self) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for (tone, norm), item in self._items.items():
+                f.write(json.dumps({"v": CACHE_FORMAT, "tone": tone, "q": norm, "value": item["value"], "ts": item["ts"]},
+                                   ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+        self._appended = len(self._items)
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        now = time.time()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except Exception:
+                        continue
+                    if rec.get("v") == CACHE_FORMAT and now - rec.get("ts", 0) <= self.ttl:
+                        self._insert((rec["tone"], rec["q"]), rec["value"], rec["ts"])
+            self._compact()
+        except Exception as e:
+            print("⚠️ Answer cache load error:", e)
+
+ANSWERS = AnswerCache(path=CACHE_PATH if CACHE_PERSIST else None)
@@ -1,5 +1,10 @@
 # bassam_core/app/api.py
-from fastapi import APIRouter, BackgroundTasks, HTTPException, Query
+import os
+import json
+import time
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 
@@ -11,7 +16,16 @@ from workers.core_worker import (
     get_latest_results,
     run_cycle_once,
     learn_from_query,  # دالة في العامل تقوم بالبحث والتلخيص
+    search_knowledge,
+    lease_held,
+    NEWS_PATH,
+    PENDING_PATH,
+    LEADER_LOCK,
 )
+from workers.jobs import JobsBusy, submit
+from workers.events import BUS
+from .http_cache import cached_json
+from .admission import ADMISSION, Ticket, admit
 
 # تشفير اختياري
 try:
@@ -40,11 +54,17 @@ async def search(req: SearchRequest, background: BackgroundTasks):
 
 @router.get("/status")
 async def status():
-    return {"queue": query_index()}
+    # الصف ملف مشترك تحت flock → القراءة في خيط لا في حلقة الأحداث
+    return {"queue": await run_in_threadpool(query_index)}
+
+def _docs_response(request: Request, limit: int):
+    # ETag من إصدار أحداث "doc" + stat لملف news.jsonl → 304 بدون قراءة الملف
+    return cached_json(request, "learn.docs", lambda: {"docs": get_latest_results(limit=limit)},
+                       BUS.version("doc"), paths=(NEWS_PATH,), variant=str(limit))
 
 @router.get("/news")
-async def news(limit: int = 10):
-    return {"docs": get_latest_results(limit=limit)}
+async def news(request: Request, limit: int = 10):
+    return _docs_response(request, limit)
 
 @router.post("/secure")
 async def secure_echo(body: dict):
@@ -52,29 +72,124 @@ async def secure_echo(body: dict):
     data = decrypt_json(token)
     return {"encrypted": token, "decrypted": data}
 
+def _submit(kind: str, fn, *args, ticket: Optional[Ticket] = None, **kwargs) -> Dict[str, Any]:
+    # مقعد التحكم بالقبول يبقى محجوزاً حتى تنتهي المهمة نفسها لا الطلب
+    release = ticket.detach() if ticket else None
+    try:
+        job = submit(kind, fn, *args, on_done=release, **kwargs)
+    except JobsBusy as e:
+        if release:
+            release()
+        raise HTTPException(429, str(e), headers={"Retry-After": "5"})
+    return {"ok": True, "job_id": job.id, "status": job.status}
+
 # ===== التحكم بالتعلّم الذاتي =====
 @router.post("/learn/run")
-async def learn_run(payload: Optional[LearnRunIn] = None):
+async def learn_run(payload: Optional[LearnRunIn] = None, ticket: Ticket = Depends(admit("learn"))):
+    # الدورة الكاملة مهمة خلفية؛ المتابعة عبر /api/jobs/{job_id}
     topics = payload.topics if payload else None
-    res = run_cycle_once(topics)
-    return {"ok": True, **res}
+    return _submit("learn_run", run_cycle_once, topics, ticket=ticket, params={"topics": topics})
 
 @router.get("/learn/state")
-async def learn_state():
-    return get_status()
+async def learn_state(request: Request):
+    # الحالة مشتركة بين العمّال: الإصدار المحلي وحده لا يرى ما تغيّر في عامل آخر →
+    # القيادة المحمولة فعلاً + stat لملف الصف وملف القفل (cycling يُكتب فيه)
+    # get_status يأخذ قفل الصف (قد ينتظر تفريغ القائد) → في خيط
+    return await run_in_threadpool(cached_json, request, "learn.state", get_status, BUS.version("state"),
+                                   lease_held(), paths=(PENDING_PATH, LEADER_LOCK))
 
 @router.get("/learn/latest")
-async def learn_latest(limit: int = 10):
-    return {"docs": get_latest_results(limit=limit)}
+async def learn_latest(request: Request, limit: int = 10):
+    return _docs_response(request, limit)
+
+@router.get("/admission/stats")
+async def admission_stats():
+    return ADMISSION.stats()
+
+STREAM_CHECK_SEC = float(os.getenv("STREAM_CHECK_SEC", "5"))
+STREAM_PING_SEC = 15.0
+
+def _news_mark():
+    try:
+        st = os.stat(NEWS_PATH)
+        return (st.st_size, st.st_mtime_ns)
+    except OSError:
+        return None
+
+def _state_key(st: Dict[str, Any]):
+    return (st.get("running"), st.get("cycling"), st.get("queue_size"))
+
+@router.get("/learn/stream")
+async def learn_stream(request: Request, limit: int = 8):
+    """Server-Sent Events: لقطة أولى (آخر السجلات + الحالة) ثم دفع كل سجل جديد
+    وكل تغيّر في حالة الجدولة. عدد اللوحات المفتوحة لا يزيد قراءات news.jsonl.
+    الناقل داخل العملية فقط → ما يحدث في عامل آخر (دورة القائد) يُلتقط كل STREAM_CHECK_SEC
+    من الملفات المشتركة (stat لـ news.jsonl + الحالة)."""
+    limit = max(1, min(limit, 50))
+    sub = BUS.subscribe()
+
+    def sse(event: str, data) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+    async def snapshot():
+        state = await run_in_threadpool(get_status)
+        return state, sse("snapshot", {"docs": get_latest_results(limit=limit), "state": state})
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            mark = _news_mark()
+            state, frame = await snapshot()
+            yield frame
+            quiet = time.monotonic()
+            while not await request.is_disconnected():
+                ev = await sub.get(timeout=STREAM_CHECK_SEC)
+                if ev is None:
+                    now_mark, now_state = _news_mark(), await run_in_threadpool(get_status)
+                    if now_mark != mark:            # سجلات جديدة من عامل آخر
+                        mark = now_mark
+                        state, frame = await snapshot()
+                        yield frame
+                    elif _state_key(now_state) != _state_key(state):
+                        state = now_state
+                        yield sse("state", state)
+                    elif time.monotonic() - quiet >= STREAM_PING_SEC:
+                        yield ": ping\n\n"
+                    else:
+                        continue
+                elif ev["topic"] == "resync":   # العميل تأخر وفُقدت أحداث → لقطة جديدة
+                    mark = _news_mark()
+                    state, frame = await snapshot()
+                    yield frame
+                else:
+                    if ev["topic"] == "doc":
+                        mark = _news_mark()
+                    elif ev["topic"] == "state":
+                        state = ev["data"]
+                    yield sse(ev["topic"], ev["data"])
+                quiet = time.monotonic()
+        finally:
+            BUS.unsubscribe(sub)
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.get("/learn/search")
+async def learn_search(q: str = Query(..., description="نص البحث في المعرفة المخزّنة"), k: int = 5):
+    q = (q or "").strip()
+    if not q:
+        raise HTTPException(400, "q is empty")
+    # أول استدعاء قد يعيد بناء الفهرس، وكل بحث يمسح المصفوفة كاملة → خارج حلقة الأحداث
+    return {"query": q, "hits": await run_in_threadpool(search_knowledge, q, max(1, min(k, 50)))}
 
 # ===== تعلّم فوري لسؤال واحد =====
 @router.post("/learn/fast")
 async def learn_fast(
     q: str = Query(..., description="سؤال أو موضوع للتعلّم الفوري"),
-    source: str = Query("auto", description="auto | google | ddg | both")
+    source: str = Query("auto", description="auto | google | ddg | both"),
+    ticket: Ticket = Depends(admit("learn")),
 ) -> Dict[str, Any]:
     q = (q or "").strip()
     if not q:
         raise HTTPException(400, "q is empty")
-    out = learn_from_query(q, source=source)
-    return {"ok": True, "query": q, **out}
+    return {**_submit("learn_fast", learn_from_query, q, source=source, ticket=ticket,
+                      params={"q": q, "source": source}), "query": q}
@@ -1,42 +1,64 @@
-import os, json, time
-from typing import List, Dict
+import os, json, time, threading
+from typing import List, Dict, Iterator
 from duckduckgo_search import DDGS
+from .ringlog import RingLog
+from .answer_cache import ANSWERS
+from utils.textnorm import classify_tone
+from utils.textrank import summarize_sentences
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
 os.makedirs(DATA_DIR, exist_ok=True)
-MEM_PATH = os.path.join(DATA_DIR, "memory.json")
+MEM_PATH = os.path.join(DATA_DIR, "memory.json")        # الصيغة القديمة (تُستورد مرة واحدة)
+MEM_RING_PATH = os.path.join(DATA_DIR, "memory.ring")
+MEM_SIZE = 50
 
-# ذاكرة قصيرة تحفظ آخر 50 تفاعل
-def _load_mem() -> List[Dict]:
+# ذاكرة قصيرة تحفظ آخر 50 تفاعل في حلقة ثابتة الحجم
+_ring: RingLog | None = None
+_ring_lock = threading.Lock()
+
+def _legacy_mem() -> List[Dict]:
+    # يُستدعى من RingLog عند إنشاء الحلقة فقط وقفل الملف مأخوذ
+    if not os.path.exists(MEM_PATH):
+        return []
     try:
         with open(MEM_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
+            return json.load(f)[-MEM_SIZE:]
+    except Exception:
+        return []
+
+def _mem() -> RingLog:
+    global _ring
+    if _ring is None:
+        with _ring_lock:
+            if _ring is None:
+                _ring = RingLog(MEM_RING_PATH, capacity=MEM_SIZE, seed=_legacy_mem)
+    return _ring
+
+def _load_mem() -> List[Dict]:
+    try:
+        return _mem().read()
     except Exception:
         return []
 
-def _save_mem(items: List[Dict]):
-    items = items[-50:]
-    with open(MEM_PATH, "w", encoding="utf-8") as f:
-        json.dump(items, f, ensure_ascii=False, indent=2)
+def _append_mem(item: Dict):
+    _mem().append(item)
 
 def analyze_tone(msg: str) -> str:
-    m = msg.lower()
-    sad = ["حزين","حزن","تعبان","محبط","فشلت","كسرت خاطري","متضايق"]
-    angry = ["غاضب","زعلان","مستفز","عصّبت","ليش","خطأ","سيء"]
-    excited = ["رائع","متحمس","فرحان","نجحت","جميل","ممتاز","واو"]
-    if any(w in m for w in sad): return "supportive"
-    if any(w in m for w in angry): return "calm"
-    if any(w in m for w in excited): return "excited"
-    return "friendly"
+    return classify_tone(msg)
 
-def style_wrap(text: str, tone: str) -> str:
+def _tone_parts(tone: str) -> tuple[str, str]:
+    """بداية ونهاية الرد حسب النبرة (تُرسل البداية فوراً في وضع البث)"""
     if tone == "supportive":
-        return f"أفهم شعورك 💙. خلّينا نمشي خطوة بخطوة:\n{text}\nأنا هنا معك."
+        return "أفهم شعورك 💙. خلّينا نمشي خطوة بخطوة:\n", "\nأنا هنا معك."
     if tone == "calm":
-        return f"ولا يهمك ✋، بهدوء نحلّها:\n{text}"
+        return "ولا يهمك ✋، بهدوء نحلّها:\n", ""
     if tone == "excited":
-        return f"يا سلام! 🎉 خبر جميل. التفاصيل:\n{text}"
-    return f"أكيد! 🙂\n{text}"
+        return "يا سلام! 🎉 خبر جميل. التفاصيل:\n", ""
+    return "أكيد! 🙂\n", ""
+
+def style_wrap(text: str, tone: str) -> str:
+    head, tail = _tone_parts(tone)
+    return f"{head}{text}{tail}"
 
 def web_search(q: str, n:int=5) -> List[Dict]:
     out = []
@@ -45,24 +67,59 @@ def web_search(q: str, n:int=5) -> List[Dict]:
             out.append({"title": r.get("title",""), "href": r.get("href",""), "body": r.get("body","")})
     return out
 
+NO_SOURCES = "لم أعثر على مصادر مناسبة حالياً."
+
+def _header(question: str) -> str:
+    return f"ملخّص سريع للسؤال: {question}\n"
+
+def _bullets(points: List[Dict]) -> str:
+    # أهم الجمل من الملخصات (TextRank + MMR لتقليل التكرار)
+    top = summarize_sentences([p.get("body","") for p in points], n=6)
+    return "\n".join([f"- {s}" for s in top])
+
+def _links(points: List[Dict]) -> str:
+    links = "\n".join([f"• {p.get('title','')} — {p.get('href','')}" for p in points[:5]])
+    return f"\n\nأهم المصادر:\n{links}"
+
 def summarize(points: List[Dict], question:str) -> str:
-    if not points: return "لم أعثر على مصادر مناسبة حالياً."
-    # تلخيص بسيط: نأخذ أهم الجمل من الملخصات
-    bodies = " ".join(p.get("body","") for p in points)
-    sentences = [s.strip() for s in bodies.replace("؟",".").split(".") if len(s.strip())>20]
-    top = sentences[:6]
-    bullets = "\n".join([f"- {s}" for s in top])
-    links  = "\n".join([f"• {p.get('title','')} — {p.get('href','')}" for p in points[:5]])
-    return f"ملخّص سريع للسؤال: {question}\n{bullets}\n\nأهم المصادر:\n{links}"
+    if not points: return NO_SOURCES
+    return _header(question) + _bullets(points) + _links(points)
 
-def answer(message: str, preferred_tone: str|None=None) -> str:
+def answer_stream(message: str, preferred_tone: str|None=None) -> Iterator[Dict]:
+    """نفس answer لكن على مراحل: tone → sources → bullets → links → done
+    كل مرحلة تحمل نصاً جزئياً يُلحق بما قبله، و done تحمل الرد الكامل."""
     tone = preferred_tone or analyze_tone(message)
+    head, tail = _tone_parts(tone)
+    yield {"stage": "tone", "tone": tone, "text": head}
+    # الكاش يحفظ الجسم وحده؛ الترويسة بسؤال هذا الطلب لا بسؤال من سبقه (قد يكون قريباً لا مطابقاً)
+    cached = ANSWERS.get(message, tone)
+    if cached is not None:
+        body = _header(message) + cached
+        yield {"stage": "bullets", "text": body, "cached": True}
+        _append_mem({"ts": int(time.time()), "user": message, "tone": tone})
+        yield {"stage": "done", "text": tail, "reply": f"{head}{body}{tail}", "cached": True}
+        return
     sr = web_search(message, n=6)
-    body = summarize(sr, message)
-    wrapped = style_wrap(body, tone)
+    yield {"stage": "sources", "count": len(sr),
+           "sources": [{"title": p.get("title",""), "href": p.get("href","")} for p in sr[:5]]}
+    if sr:
+        bullets = _bullets(sr)
+        yield {"stage": "bullets", "text": _header(message) + bullets}
+        links = _links(sr)
+        yield {"stage": "links", "text": links}
+        ANSWERS.put(message, tone, bullets + links)
+        body = _header(message) + bullets + links
+    else:
+        body = NO_SOURCES
+        yield {"stage": "bullets", "text": body}
 
     # تحديث الذاكرة القصيرة
-    mem = _load_mem()
-    mem.append({"ts": int(time.time()), "user": message, "tone": tone})
-    _save_mem(mem)
-    return wrapped
+    _append_mem({"ts": int(time.time()), "user": message, "tone": tone})
+    yield {"stage": "done", "text": tail, "reply": f"{head}{body}{tail}"}
+
+def answer(message: str, preferred_tone: str|None=None) -> str:
+    reply = ""
+    for ev in answer_stream(message, preferred_tone):
+        if ev["stage"] == "done":
+            reply = ev["reply"]
+    return reply
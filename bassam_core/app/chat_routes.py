@@ -1,7 +1,12 @@
-from fastapi import APIRouter
-from fastapi.responses import HTMLResponse, JSONResponse
+import json
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from .assistant import answer, analyze_tone
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+from .assistant import answer, answer_stream, analyze_tone
+from .http_cache import StaticPage
+from .admission import Ticket, admit
 
 router = APIRouter()
 
@@ -9,9 +14,7 @@ class ChatIn(BaseModel):
     message: str
     tone: str | None = None
 
-@router.get("/chat", response_class=HTMLResponse)
-def chat_page():
-    html = """
+CHAT_PAGE = StaticPage("""
 <!doctype html><html lang="ar" dir="rtl"><meta charset="utf-8"/>
 <title>الدردشة مع نواة بسام</title>
 <style>
@@ -62,13 +65,29 @@ async function callAPI(m){
   const r=await fetch('/api/chat',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(payload)});
   const j=await r.json(); return j.reply;
 }
+// بث الرد على مراحل (SSE): تظهر بداية الرد فوراً ثم تُلحق الأجزاء عند جاهزيتها
+function streamAPI(m,onText){
+  return new Promise((resolve,reject)=>{
+    let url='/api/chat/stream?message='+encodeURIComponent(m);
+    if(tone.value) url+='&tone='+encodeURIComponent(tone.value);
+    const es=new EventSource(url); let text=''; let done=false;
+    const part=e=>{ const j=JSON.parse(e.data); text+=j.text||''; onText(text); };
+    ['tone','bullets','links'].forEach(n=>es.addEventListener(n,part));
+    es.addEventListener('sources',e=>{ const j=JSON.parse(e.data); onText(text+'('+j.count+' مصادر… جاري التلخيص)'); });
+    es.addEventListener('done',e=>{ done=true; es.close(); resolve(JSON.parse(e.data).reply); });
+    es.onerror=()=>{ es.close(); if(!done) reject(new Error('stream failed')); };
+  });
+}
 
 send.onclick=async ()=>{
   const m=msg.value.trim(); if(!m) return;
   add('user',m); msg.value='';
   add('bot','...جاري البحث والتلخيص');
-  const reply=await callAPI(m);
-  log.lastChild.textContent=reply;
+  const box=log.lastChild;
+  let reply;
+  try{ reply=await streamAPI(m,t=>{ box.textContent=t; log.scrollTop=log.scrollHeight; }); }
+  catch(e){ reply=await callAPI(m); }
+  box.textContent=reply;
   speak(reply);
 };
 msg.addEventListener('keydown',e=>{ if(e.key==='Enter'){send.click()} });
@@ -94,10 +113,30 @@ micBtn.onclick=()=>{
   micBtn.textContent='⏹️'; rec.start();
 };
 </script>
-"""
-    return HTMLResponse(html)
+""")
+
+@router.get("/chat", response_class=HTMLResponse)
+def chat_page(request: Request):
+    return CHAT_PAGE.response(request)
 
 @router.post("/api/chat")
-async def api_chat(payload: ChatIn):
+async def api_chat(payload: ChatIn, ticket: Ticket = Depends(admit("chat"))):
     t = payload.tone or analyze_tone(payload.message)
-    return JSONResponse({"reply": answer(payload.message, t)})
+    # answer متزامن (بحث + ملفات) → يُنفّذ في مجمّع الخيوط كي لا يوقف حلقة الأحداث
+    reply = await run_in_threadpool(answer, payload.message, t)
+    return JSONResponse({"reply": reply})
+
+@router.get("/api/chat/stream")
+async def api_chat_stream(message: str, tone: str | None = None,
+                          ticket: Ticket = Depends(admit("chat"))):
+    """Server-Sent Events: كل مرحلة من answer_stream حدث مستقل"""
+    release = ticket.detach()   # المقعد محجوز طوال البث لا حتى بدء الرد فقط
+    async def events():
+        try:
+            async for ev in iterate_in_threadpool(answer_stream(message, tone or None)):
+                yield f"event: {ev['stage']}\ndata: {json.dumps(ev, ensure_ascii=False)}\n\n"
+        finally:
+            release()
+    # release متكرر آمن: المهمة الخلفية تغطي حالة عدم بدء المولّد أصلاً
+    return StreamingResponse(events(), media_type="text/event-stream", background=BackgroundTask(release),
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,124 @@
+# bassam_core/app/command_output.py
+# سجل مخرجات كل أمر (مقاطع مرقّمة من الوكيل) على القرص مع حد أعلى للحجم
+# - المقاطع تصل بالترتيب عبر WS؛ المكرر (seq أقدم) يُتجاهل
+# - بعد CMD_OUTPUT_MAX_BYTES يُعلَّم السجل "مقطوع" ولا يُكتب المزيد
+# - المتابعة الحية: كل إلحاق يوقظ من ينتظر (tail)
+import os, json, time, asyncio
+from typing import Any, Dict, Optional, Tuple
+
+OUT_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "cmd_output")
+os.makedirs(OUT_DIR, exist_ok=True)
+MAX_BYTES = int(os.getenv("CMD_OUTPUT_MAX_BYTES", str(1024 * 1024)))
+OUTPUT_TTL_SEC = int(os.getenv("CMD_OUTPUT_TTL_SEC", str(7 * 24 * 3600)))
+PRUNE_EVERY_SEC = 600
+
+_state: Dict[str, Dict[str, Any]] = {}     # cmd_id -> {"seq", "size", "truncated", "closed"}
+_events: Dict[str, asyncio.Event] = {}
+_last_prune = 0.0
+
+def _path(cmd_id: str, ext: str = "log") -> str:
+    safe = "".join(ch for ch in cmd_id if ch.isalnum() or ch == "-")
+    return os.path.join(OUT_DIR, f"{safe}.{ext}")
+
+def _meta(cmd_id: str) -> Dict[str, Any]:
+    st = _state.get(cmd_id)
+    if st is None:
+        try:
+            with open(_path(cmd_id, "json"), "r", encoding="utf-8") as f:
+                st = json.load(f)
+        except (OSError, ValueError):
+            size = os.path.getsize(_path(cmd_id)) if os.path.exists(_path(cmd_id)) else 0
+            st = {"seq": 0, "size": size, "truncated": False, "closed": False}
+        _state[cmd_id] = st
+    return st
+
+def _save_meta(cmd_id: str, st: Dict[str, Any]) -> None:
+    tmp = _path(cmd_id, "json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(st, f)
+    os.replace(tmp, _path(cmd_id, "json"))
+
+def _wake(cmd_id: str) -> None:
+    ev = _events.pop(cmd_id, None)
+    if ev:
+        ev.set()
+
+def append(cmd_id: str, seq: int, data: str) -> bool:
+    """يلحق مقطعاً؛ False إن كان مكرراً أو تجاوز الحد"""
+    _maybe_prune()
+    st = _meta(cmd_id)
+    if seq <= st["seq"] or st["closed"]:
+        return False
+    st["seq"] = seq
+    raw = data.encode("utf-8")
+    room = MAX_BYTES - st["size"]
+    if room <= 0:
+        st["truncated"] = True
+        return False
+    if len(raw) > room:
+        raw = raw[:room].decode("utf-8", "ignore").encode("utf-8")
+        st["truncated"] = True
+    with open(_path(cmd_id), "ab") as f:
+        f.write(raw)
+    st["size"] += len(raw)
+    if st["truncated"]:
+        _save_meta(cmd_id, st)
+    _wake(cmd_id)
+    return True
+
+def close(cmd_id: str) -> None:
+    """الأمر انتهى: لا مقاطع بعد الآن، ونوقظ المتابعين ليختموا"""
+    st = _meta(cmd_id)
+    st["closed"] = True
+    _save_meta(cmd_id, st)
+    _state.pop(cmd_id, None)      # الحالة محفوظة على القرص؛ نخفف الذاكرة
+    _wake(cmd_id)
+
+def info(cmd_id: str) -> Dict[str, Any]:
+    st = _meta(cmd_id)
+    return {"bytes": st["size"], "chunks": st["seq"], "truncated": st["truncated"],
+            "closed": st["closed"], "max_bytes": MAX_BYTES}
+
+def read(cmd_id: str, offset: int = 0, limit: int = MAX_BYTES) -> Tuple[bytes, int]:
+    """بايتات من offset؛ يعيد (البيانات، الإزاحة التالية)"""
+    try:
+        with open(_path(cmd_id), "rb") as f:
+            f.seek(max(0, offset))
+            data = f.read(limit)
+    except FileNotFoundError:
+        return b"", offset
+    return data, offset + len(data)
+
+def read_text(cmd_id: str, offset: int = 0, limit: int = 64 * 1024) -> Tuple[str, int]:
+    """مثل read لكن نصاً: لا نقطع حرفاً متعدد البايتات عند الحد"""
+    data, nxt = read(cmd_id, offset, limit)
+    for cut in range(4):
+        try:
+            return data[:len(data) - cut].decode("utf-8"), nxt - cut
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", "replace"), nxt
+
+async def wait_more(cmd_id: str, timeout: float) -> None:
+    """ينتظر إلحاقاً جديداً أو إغلاقاً (أو انتهاء المهلة)"""
+    ev = _events.get(cmd_id)
+    if ev is None:
+        ev = _events[cmd_id] = asyncio.Event()
+    try:
+        await asyncio.wait_for(ev.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+def _maybe_prune() -> None:
+    global _last_prune
+    now = time.time()
+    if now - _last_prune < PRUNE_EVERY_SEC:
+        return
+    _last_prune = now
+    for name in os.listdir(OUT_DIR):
+        p = os.path.join(OUT_DIR, name)
+        try:
+            if now - os.path.getmtime(p) > OUTPUT_TTL_SEC:
+                os.remove(p)
+        except OSError:
+            pass
@@ -0,0 +1,278 @@
+# bassam_core/app/command_store.py
+# مخزن أوامر الأجهزة على SQLite (WAL) بدل إعادة كتابة pending_commands.json كاملاً
+# - فهارس على (device_id, status) و ts
+# - انتقالات حالة ذرّية: UPDATE ... WHERE status IN (...) → لا يتسابق طلبان على نفس الأمر
+# - ترقيم بمؤشر (seq) مع فلترة بالحالة والجهاز
+# - أرشفة الأوامر المنتهية بعد CMD_ARCHIVE_TTL_SEC إلى جدول منفصل
+import os, json, time, uuid, sqlite3, threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+os.makedirs(DATA_DIR, exist_ok=True)
+DB_PATH = os.getenv("CMD_DB_PATH", os.path.join(DATA_DIR, "commands.db"))
+LEGACY_JSON = os.path.join(DATA_DIR, "pending_commands.json")
+
+ARCHIVE_TTL_SEC = int(os.getenv("CMD_ARCHIVE_TTL_SEC", str(7 * 24 * 3600)))
+ARCHIVE_EVERY_SEC = int(os.getenv("CMD_ARCHIVE_EVERY_SEC", "600"))
+
+# pending → approved → sent → running → executed | failed | cancelled ؛ أو pending → rejected | cancelled
+FINISHED = ("executed", "failed", "rejected", "cancelled")
+# أُرسل للوكيل ولم ينتهِ بعد (قد يكون في طابوره أو قيد التشغيل)
+IN_FLIGHT = ("approved", "sent", "running")
+# حالات الوكيل → حالة الأمر
+RESULT_STATUS = {"ok": "executed", "executed": "executed",
+                 "error": "failed", "timeout": "failed", "failed": "failed",
+                 "cancelled": "cancelled"}
+
+COLUMNS = ("seq", "cmd_id", "device_id", "command", "description", "status",
+           "result", "ts", "sent_ts", "exec_ts", "updated", "batch_id")
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_ready = False
+_last_archive = 0.0
+
+def _conn() -> sqlite3.Connection:
+    # اتصال لكل خيط: WAL يسمح بقراءات متوازية مع كاتب واحد
+    c = getattr(_local, "conn", None)
+    if c is None:
+        c = sqlite3.connect(DB_PATH, timeout=10, isolation_level=None)
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("PRAGMA synchronous=NORMAL")
+        c.row_factory = sqlite3.Row
+        _local.conn = c
+    if not _ready:
+        _init(c)
+    return c
+
+def _init(c: sqlite3.Connection) -> None:
+    global _ready
+    with _init_lock:
+        if _ready:
+            return
+        schema = """(
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            cmd_id TEXT UNIQUE NOT NULL,
+            device_id TEXT NOT NULL,
+            command TEXT NOT NULL,
+            description TEXT,
+            status TEXT NOT NULL,
+            result TEXT,
+            ts INTEGER NOT NULL,
+            sent_ts INTEGER, exec_ts INTEGER,
+            updated REAL NOT NULL,
+            batch_id TEXT
+        )"""
+        c.execute("CREATE TABLE IF NOT EXISTS commands" + schema)
+        c.execute("CREATE TABLE IF NOT EXISTS commands_archive" + schema)
+        for table in ("commands", "commands_archive"):
+            # قواعد أقدم بلا batch_id: الإضافة في آخر الأعمدة تحفظ ترتيب SELECT * للأرشفة
+            if "batch_id" not in {r[1] for r in c.execute(f"PRAGMA table_info({table})")}:
+                c.execute(f"ALTER TABLE {table} ADD COLUMN batch_id TEXT")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_cmd_batch ON commands(batch_id) WHERE batch_id IS NOT NULL")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_cmd_device_status ON commands(device_id, status)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_cmd_ts ON commands(ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_cmd_status_updated ON commands(status, updated)")
+        _migrate_json(c)
+        _ready = True
+
+def _migrate_json(c: sqlite3.Connection) -> None:
+    """استيراد pending_commands.json القديم مرة واحدة ثم إعادة تسميته"""
+    if not os.path.exists(LEGACY_JSON):
+        return
+    try:
+        with open(LEGACY_JSON, "r", encoding="utf-8") as f:
+            old = json.load(f) or {}
+    except Exception as e:
+        print("⚠️ pending_commands.json migration skipped:", e)
+        return
+    rows = []
+    for cmd in sorted(old.values(), key=lambda x: x.get("ts") or 0):
+        ts = int(cmd.get("ts") or time.time())
+        rows.append((cmd.get("cmd_id") or str(uuid.uuid4()), cmd.get("device_id") or "", cmd.get("command") or "",
+                     cmd.get("description") or "", cmd.get("status") or "pending", _dump(cmd.get("result")),
+                     ts, cmd.get("sent_ts"), cmd.get("exec_ts"), float(cmd.get("exec_ts") or cmd.get("sent_ts") or ts)))
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        c.executemany("""INSERT OR IGNORE INTO commands(cmd_id, device_id, command, description, status,
+                         result, ts, sent_ts, exec_ts, updated) VALUES(?,?,?,?,?,?,?,?,?,?)""", rows)
+        c.execute("COMMIT")
+    except Exception:
+        c.execute("ROLLBACK")
+        raise
+    os.replace(LEGACY_JSON, LEGACY_JSON + ".migrated")
+    print(f"📦 Migrated {len(rows)} commands from pending_commands.json")
+
+def _dump(v: Any) -> Optional[str]:
+    return None if v is None else json.dumps(v, ensure_ascii=False)
+
+def _row(r: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+    if r is None:
+        return None
+    d = dict(r)
+    if d.get("result") is not None:
+        try:
+            d["result"] = json.loads(d["result"])
+        except ValueError:
+            pass
+    return d
+
+# ==== العمليات ====
+def create(device_id: str, command: str, description: str = "") -> Dict[str, Any]:
+    now = time.time()
+    cmd_id = str(uuid.uuid4())
+    c = _conn()
+    c.execute("""INSERT INTO commands(cmd_id, device_id, command, description, status, ts, updated)
+                 VALUES(?,?,?,?, 'pending', ?, ?)""", (cmd_id, device_id, command, description or "", int(now), now))
+    maybe_archive()
+    return get(cmd_id)
+
+def create_many(targets: Iterable[Tuple[str, str, Any]], command: str, description: str = "",
+                batch_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """إنشاء أمر واحد لعدة أجهزة في معاملة واحدة؛ targets = (device_id, status, result)"""
+    now = time.time()
+    rows = [(str(uuid.uuid4()), dev, command, description or "", status, _dump(result), int(now), now, batch_id)
+            for dev, status, result in targets]
+    c = _conn()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        c.executemany("""INSERT INTO commands(cmd_id, device_id, command, description, status, result, ts, updated, batch_id)
+                         VALUES(?,?,?,?,?,?,?,?,?)""", rows)
+        c.execute("COMMIT")
+    except Exception:
+        c.execute("ROLLBACK")
+        raise
+    maybe_archive()
+    keys = ("cmd_id", "device_id", "command", "description", "status", "result", "ts", "updated", "batch_id")
+    return [{**dict(zip(keys, r)), "result": res} for r, (_, _, res) in zip(rows, targets)]
+
+def get(cmd_id: str) -> Optional[Dict[str, Any]]:
+    r = _conn().execute("SELECT * FROM commands WHERE cmd_id=?", (cmd_id,)).fetchone()
+    if r is None:
+        r = _conn().execute("SELECT * FROM commands_archive WHERE cmd_id=?", (cmd_id,)).fetchone()
+    return _row(r)
+
+def transition(cmd_id: str, to: str, allowed_from: Iterable[str], *, owner: Optional[str] = None,
+               **fields: Any) -> Optional[Dict[str, Any]]:
+    """ينقل الأمر إلى الحالة to فقط إن كانت حالته الحالية ضمن allowed_from (ذرّياً).
+    owner: لا ينتقل إلا إن كان الأمر لهذا الجهاز (رسائل الوكلاء لا تمس أوامر غيرها).
+    يعيد الأمر بعد التحديث، أو None إن لم تنطبق الحالة (أو لم يوجد الأمر)."""
+    allowed = tuple(allowed_from)
+    sets = ["status=?", "updated=?"]
+    args: List[Any] = [to, time.time()]
+    for k, v in fields.items():
+        if k not in COLUMNS or k in ("seq", "cmd_id", "status", "updated"):
+            raise ValueError(f"bad field {k}")
+        sets.append(f"{k}=?")
+        args.append(_dump(v) if k == "result" else v)
+    c = _conn()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        where = f"cmd_id=? AND status IN ({','.join('?' * len(allowed))})" + (" AND device_id=?" if owner is not None else "")
+        cur = c.execute(f"UPDATE commands SET {', '.join(sets)} WHERE {where}",
+                        (*args, cmd_id, *allowed, *((owner,) if owner is not None else ())))
+        row = c.execute("SELECT * FROM commands WHERE cmd_id=?", (cmd_id,)).fetchone() if cur.rowcount else None
+        c.execute("COMMIT")
+    except Exception:
+        c.execute("ROLLBACK")
+        raise
+    return _row(row)
+
+def transition_many(cmd_ids: Iterable[str], to: str, allowed_from: Iterable[str], **fields: Any) -> int:
+    """مثل transition لعدة أوامر بنفس القيم في معاملة واحدة؛ يعيد عدد ما انتقل"""
+    ids = list(cmd_ids)
+    if not ids:
+        return 0
+    allowed = tuple(allowed_from)
+    sets = ["status=?", "updated=?"]
+    args: List[Any] = [to, time.time()]
+    for k, v in fields.items():
+        if k not in COLUMNS or k in ("seq", "cmd_id", "status", "updated"):
+            raise ValueError(f"bad field {k}")
+        sets.append(f"{k}=?")
+        args.append(_dump(v) if k == "result" else v)
+    sql = f"UPDATE commands SET {', '.join(sets)} WHERE cmd_id=? AND status IN ({','.join('?' * len(allowed))})"
+    c = _conn()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        n = sum(c.execute(sql, (*args, cmd_id, *allowed)).rowcount for cmd_id in ids)
+        c.execute("COMMIT")
+    except Exception:
+        c.execute("ROLLBACK")
+        raise
+    return n
+
+def orphan(device_id: str, result: str, before: Optional[float] = None) -> List[Dict[str, Any]]:
+    """أوامر الجهاز المرسلة أو الجارية حين انقطع اتصاله (قبل before): الوكيل يلغي كل ما
+    يعمل عند الانقطاع فلن تصل نتيجتها أبداً → failed. لا نعيدها للطابور: قد تكون نُفّذت جزئياً."""
+    now = time.time()
+    c = _conn()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        ids = [r[0] for r in c.execute("""SELECT cmd_id FROM commands WHERE device_id=? AND status IN ('sent','running')
+                                          AND updated<=?""", (device_id, before or now))]
+        rows = []
+        for cmd_id in ids:
+            c.execute("UPDATE commands SET status='failed', result=?, exec_ts=?, updated=? WHERE cmd_id=?",
+                      (_dump(result), int(now), now, cmd_id))
+            rows.append(c.execute("SELECT * FROM commands WHERE cmd_id=?", (cmd_id,)).fetchone())
+        c.execute("COMMIT")
+    except Exception:
+        c.execute("ROLLBACK")
+        raise
+    return [_row(r) for r in rows]
+
+def list_batch(batch_id: str) -> List[Dict[str, Any]]:
+    """كل أوامر الدفعة (النشطة والمؤرشفة) بترتيب الإنشاء"""
+    c = _conn()
+    rows = c.execute("SELECT * FROM commands WHERE batch_id=? ORDER BY seq", (batch_id,)).fetchall()
+    rows += c.execute("SELECT * FROM commands_archive WHERE batch_id=? ORDER BY seq", (batch_id,)).fetchall()
+    return [_row(r) for r in rows]
+
+def list_commands(status: Optional[str] = None, device_id: Optional[str] = None,
+                  cursor: Optional[int] = None, limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """الأحدث أولاً؛ cursor = آخر seq في الصفحة السابقة. يعيد (العناصر، المؤشر التالي)"""
+    where, args = [], []
+    if device_id:
+        where.append("device_id=?"); args.append(device_id)
+    if status:
+        where.append("status=?"); args.append(status)
+    if cursor:
+        where.append("seq<?"); args.append(int(cursor))
+    sql = "SELECT * FROM commands" + (" WHERE " + " AND ".join(where) if where else "")
+    sql += " ORDER BY seq DESC LIMIT ?"
+    rows = [_row(r) for r in _conn().execute(sql, (*args, limit + 1)).fetchall()]
+    nxt = rows[limit - 1]["seq"] if len(rows) > limit else None
+    return rows[:limit], nxt
+
+def archive(ttl: int = ARCHIVE_TTL_SEC) -> int:
+    """نقل الأوامر المنتهية الأقدم من ttl ثانية إلى commands_archive"""
+    cutoff = time.time() - ttl
+    marks = ",".join("?" * len(FINISHED))
+    c = _conn()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        c.execute(f"INSERT OR IGNORE INTO commands_archive SELECT * FROM commands WHERE status IN ({marks}) AND updated<?",
+                  (*FINISHED, cutoff))
+        n = c.execute(f"DELETE FROM commands WHERE status IN ({marks}) AND updated<?", (*FINISHED, cutoff)).rowcount
+        c.execute("COMMIT")
+    except Exception:
+        c.execute("ROLLBACK")
+        raise
+    return n
+
+def maybe_archive() -> None:
+    global _last_archive
+    now = time.time()
+    if now - _last_archive < ARCHIVE_EVERY_SEC:
+        return
+    _last_archive = now
+    try:
+        n = archive()
+        if n:
+            print(f"🗄️ Archived {n} finished commands")
+    except sqlite3.Error as e:
+        print("⚠️ Command archive error:", e)
+
+def counts() -> Dict[str, int]:
+    return {r[0]: r[1] for r in _conn().execute("SELECT status, COUNT(*) FROM commands GROUP BY status")}
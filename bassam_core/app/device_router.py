@@ -0,0 +1,354 @@
+# bassam_core/app/device_router.py
+# سجل اتصالات الأجهزة المشترك بين عمّال uvicorn + توجيه الرسائل بينهم
+# - جدول presence في SQLite: أي جهاز متصل بأي عامل (مع وسومه وآخر حمل)
+# - كل عامل يستمع على مقبس Unix خاص به؛ الإرسال لجهاز عند عامل آخر يمر عبره
+# - إشعار انتهاء الأوامر يُبث لكل العمّال فيستيقظ من ينتظر في أي منهم
+# - العامل الذي يموت دون تنظيف تُحذف أجهزته بعد DEVICE_ROUTER_STALE_SEC
+# - الجهاز الصامت أكثر من DEVICE_DEAD_FACTOR × فترة نبضه يُطرد ويُغلق اتصاله
+# - كل استدعاء SQLite يمر عبر _db (threadpool): قفل الكاتب قد يُنتظر حتى 10 ث
+import os, json, time, atexit, socket, sqlite3, asyncio, threading
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import WebSocket
+from starlette.concurrency import run_in_threadpool
+from agent.codec import Codec
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+os.makedirs(DATA_DIR, exist_ok=True)
+DB_PATH = os.getenv("DEVICE_REGISTRY_PATH", os.path.join(DATA_DIR, "devices.db"))
+SOCK_DIR = os.path.normpath(os.getenv("DEVICE_ROUTER_DIR", os.path.join(DATA_DIR, "ws_router")))
+HEARTBEAT_SEC = float(os.getenv("DEVICE_ROUTER_HEARTBEAT_SEC", "10"))
+STALE_SEC = float(os.getenv("DEVICE_ROUTER_STALE_SEC", str(HEARTBEAT_SEC * 3)))
+CALL_TIMEOUT = 5.0
+DEAD_FACTOR = float(os.getenv("DEVICE_DEAD_FACTOR", "3"))
+
+WORKER_ID = str(os.getpid())
+ROUTING = hasattr(socket, "AF_UNIX")       # ويندوز: عملية واحدة، الاتصالات المحلية فقط
+
+# الاتصالات المحلية في هذه العملية: device_id -> websocket
+CONNECTED_DEVICES: Dict[str, WebSocket] = {}
+# الترميز المتفق عليه مع كل اتصال محلي (msgpack/JSON، مختوم أو لا)
+_codecs: Dict[str, Codec] = {}
+# الأجهزة التي أعلنت فترة نبض: device_id -> [آخر إطار (monotonic)، فترة النبض]
+_liveness: Dict[str, List[float]] = {}
+# ما كُتب في presence لكل اتصال محلي (لإعادة تأكيده في كل نبضة): device_id -> (connected, tags)
+_presence: Dict[str, tuple] = {}
+
+class DeviceUnavailable(Exception):
+    """الجهاز غير متصل بأي عامل، أو تعذّر التسليم إليه"""
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_ready = False
+_started = False
+_on_notify: Optional[Callable[[str], None]] = None
+# استعلامات تجيب عنها كل عملية من حالتها المحلية (مثل القياسات): op -> fn(req) -> dict
+_queries: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {}
+
+# كتابات presence لهذا العامل بترتيبها: حذف اتصال قديم لا يسبق تسجيل أحدث منه في خيط آخر
+_presence_lock = asyncio.Lock()
+
+async def _db(fn: Callable[..., Any], *args: Any) -> Any:
+    """SQLite خارج حلقة الأحداث (كما في devices_ws.db لمخزن الأوامر)"""
+    return await run_in_threadpool(fn, *args)
+
+def _exec(sql: str, args: tuple = ()) -> None:
+    _conn().execute(sql, args)
+
+def _conn() -> sqlite3.Connection:
+    c = getattr(_local, "conn", None)
+    if c is None:
+        c = sqlite3.connect(DB_PATH, timeout=10, isolation_level=None)
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("PRAGMA synchronous=NORMAL")
+        c.row_factory = sqlite3.Row
+        _local.conn = c
+    if not _ready:
+        _init(c)
+    return c
+
+def _init(c: sqlite3.Connection) -> None:
+    global _ready
+    with _init_lock:
+        if _ready:
+            return
+        c.execute("CREATE TABLE IF NOT EXISTS workers(worker TEXT PRIMARY KEY, sock TEXT, started REAL, seen REAL)")
+        c.execute("""CREATE TABLE IF NOT EXISTS presence(
+            device_id TEXT PRIMARY KEY, worker TEXT NOT NULL,
+            connected REAL NOT NULL, tags TEXT, load TEXT)""")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_presence_worker ON presence(worker)")
+        _ready = True
+
+def _sock_path(worker: str) -> str:
+    return os.path.join(SOCK_DIR, f"w{worker}.sock")
+
+# ==== دورة حياة العامل ====
+async def ensure_started() -> None:
+    """يسجّل هذا العامل ويفتح مقبسه (مرة واحدة، من داخل حلقة الأحداث)"""
+    global _started
+    if _started:
+        return
+    _started = True
+    await _db(_join)
+    if ROUTING:
+        os.makedirs(SOCK_DIR, exist_ok=True)
+        try:
+            os.unlink(_sock_path(WORKER_ID))
+        except FileNotFoundError:
+            pass
+        await asyncio.start_unix_server(_serve, path=_sock_path(WORKER_ID))
+    asyncio.get_running_loop().create_task(_heartbeat_loop())
+    atexit.register(_shutdown)
+    print(f"🛰️ Device router: worker {WORKER_ID} ready")
+
+def _join() -> None:
+    now = time.time()
+    c = _conn()
+    # بقايا عملية سابقة بنفس pid
+    c.execute("DELETE FROM presence WHERE worker=?", (WORKER_ID,))
+    c.execute("INSERT OR REPLACE INTO workers(worker, sock, started, seen) VALUES(?,?,?,?)",
+              (WORKER_ID, _sock_path(WORKER_ID) if ROUTING else None, now, now))
+
+def _shutdown() -> None:
+    try:
+        c = _conn()
+        c.execute("DELETE FROM presence WHERE worker=?", (WORKER_ID,))
+        c.execute("DELETE FROM workers WHERE worker=?", (WORKER_ID,))
+        os.unlink(_sock_path(WORKER_ID))
+    except Exception:
+        pass
+
+def _beat() -> None:
+    now = time.time()
+    c = _conn()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        # upsert لا UPDATE: إن حذفنا عامل آخر (تعطلنا أكثر من STALE_SEC) نعود للسجل
+        c.execute("""INSERT INTO workers(worker, sock, started, seen) VALUES(?,?,?,?)
+                     ON CONFLICT(worker) DO UPDATE SET seen=excluded.seen, sock=excluded.sock""",
+                  (WORKER_ID, _sock_path(WORKER_ID) if ROUTING else None, now, now))
+        # ومعنا أجهزتنا المتصلة فعلاً؛ جهاز سجّله عامل آخر بعدنا يبقى له
+        c.executemany("""INSERT INTO presence(device_id, worker, connected, tags, load) VALUES(?,?,?,?,NULL)
+                         ON CONFLICT(device_id) DO NOTHING""",
+                      [(d, WORKER_ID, *_presence[d]) for d in list(CONNECTED_DEVICES) if d in _presence])
+        # عمّال ماتوا دون تنظيف (SIGKILL، انهيار) → أجهزتهم لم تعد متصلة فعلاً
+        for (w,) in c.execute("SELECT worker FROM workers WHERE seen<?", (now - STALE_SEC,)).fetchall():
+            c.execute("DELETE FROM presence WHERE worker=?", (w,))
+            c.execute("DELETE FROM workers WHERE worker=?", (w,))
+        c.execute("COMMIT")
+    except Exception:
+        c.execute("ROLLBACK")
+        raise
+
+async def _heartbeat_loop() -> None:
+    while True:
+        await asyncio.sleep(HEARTBEAT_SEC)
+        try:
+            await _db(_beat)
+        except sqlite3.Error as e:
+            print("⚠️ Device router heartbeat error:", e)
+        await _evict_silent()
+
+async def _evict_silent() -> None:
+    """اتصالات نصف مفتوحة (انقطاع شبكة دون FIN) تبقى في السجل للأبد بدون هذا"""
+    now = time.monotonic()
+    for device_id, (seen, period) in list(_liveness.items()):
+        if now - seen <= period * DEAD_FACTOR:
+            continue
+        ws = CONNECTED_DEVICES.get(device_id)
+        if ws is None or not await unregister(device_id, ws):
+            _liveness.pop(device_id, None)
+            continue
+        print(f"💀 Evicting silent device {device_id} ({now - seen:.0f}s without a frame)")
+        try:
+            await asyncio.wait_for(ws.close(code=4408), 2.0)
+        except Exception:
+            pass
+
+def _drop_worker(worker: str) -> None:
+    c = _conn()
+    c.execute("DELETE FROM presence WHERE worker=?", (worker,))
+    c.execute("DELETE FROM workers WHERE worker=?", (worker,))
+
+def _live_workers() -> List[str]:
+    rows = _conn().execute("SELECT worker FROM workers WHERE seen>=? AND sock IS NOT NULL",
+                           (time.time() - STALE_SEC,)).fetchall()
+    return [r[0] for r in rows]
+
+# ==== السجل ====
+async def register(device_id: str, ws: WebSocket, tags: List[str], codec: Optional[Codec] = None,
+                   heartbeat: float = 0) -> None:
+    async with _presence_lock:
+        CONNECTED_DEVICES[device_id] = ws
+        _codecs[device_id] = codec or Codec()
+        # وكيل قديم بلا نبض لا يُطرد بسبب الصمت (يعتمد على إغلاق TCP)
+        if heartbeat > 0:
+            _liveness[device_id] = [time.monotonic(), heartbeat]
+        else:
+            _liveness.pop(device_id, None)
+        _presence[device_id] = (time.time(), json.dumps(tags, ensure_ascii=False))
+        await _db(_exec, "INSERT OR REPLACE INTO presence(device_id, worker, connected, tags, load) VALUES(?,?,?,?,NULL)",
+                  (device_id, WORKER_ID, *_presence[device_id]))
+
+async def unregister(device_id: str, ws: WebSocket) -> bool:
+    """يزيل الاتصال فقط إن كان هو المسجّل (الجهاز ربما أعاد الاتصال بعامل/مقبس آخر)"""
+    async with _presence_lock:
+        if CONNECTED_DEVICES.get(device_id) is not ws:
+            return False
+        CONNECTED_DEVICES.pop(device_id, None)
+        _codecs.pop(device_id, None)
+        _liveness.pop(device_id, None)
+        _presence.pop(device_id, None)
+        await _db(_exec, "DELETE FROM presence WHERE device_id=? AND worker=?", (device_id, WORKER_ID))
+        return True
+
+def touch(device_id: str) -> None:
+    live = _liveness.get(device_id)
+    if live:
+        live[0] = time.monotonic()
+
+async def set_load(device_id: str, load: Dict[str, Any]) -> None:
+    await _db(_exec, "UPDATE presence SET load=? WHERE device_id=? AND worker=?",
+              (json.dumps(load), device_id, WORKER_ID))
+
+async def devices() -> List[Dict[str, Any]]:
+    """كل الأجهزة المتصلة بأي عامل حي"""
+    return await _db(read_devices)
+
+def read_devices() -> List[Dict[str, Any]]:
+    """devices() متزامنة: للاستدعاء من خيط (threadpool) فقط لا من حلقة الأحداث"""
+    rows = _conn().execute("""SELECT p.* FROM presence p JOIN workers w ON p.worker = w.worker
+                              WHERE w.seen >= ? ORDER BY p.device_id""", (time.time() - STALE_SEC,)).fetchall()
+    out = []
+    for r in rows:
+        d = dict(r)
+        d["tags"] = json.loads(d["tags"] or "[]")
+        d["load"] = json.loads(d["load"]) if d["load"] else None
+        out.append(d)
+    return out
+
+async def locate(device_id: str) -> Optional[str]:
+    return await _db(_locate, device_id)
+
+def _locate(device_id: str) -> Optional[str]:
+    r = _conn().execute("""SELECT p.worker FROM presence p JOIN workers w ON p.worker = w.worker
+                           WHERE p.device_id=? AND w.seen >= ?""", (device_id, time.time() - STALE_SEC)).fetchone()
+    return r[0] if r else None
+
+async def is_connected(device_id: str) -> bool:
+    return device_id in CONNECTED_DEVICES or await locate(device_id) is not None
+
+# ==== التوجيه ====
+async def deliver(device_id: str, message: Dict[str, Any], timeout: float = CALL_TIMEOUT) -> None:
+    """يرسل رسالة للجهاز أينما كان اتصاله؛ يرفع DeviceUnavailable عند الفشل.
+    الترميز يحدث في العامل المالك للاتصال (هو من يعرف ما اتُّفق عليه)"""
+    if device_id in CONNECTED_DEVICES:
+        await _send_local(device_id, message, timeout)
+        return
+    worker = await locate(device_id)
+    if not worker or worker == WORKER_ID or not ROUTING:
+        raise DeviceUnavailable("device not connected")
+    reply = await _call(worker, {"op": "send", "device_id": device_id, "message": message, "timeout": timeout}, timeout + 1)
+    if not reply.get("ok"):
+        raise DeviceUnavailable(reply.get("error") or "send failed")
+
+async def _send_local(device_id: str, message: Dict[str, Any], timeout: float) -> None:
+    ws = CONNECTED_DEVICES.get(device_id)
+    if ws is None:
+        raise DeviceUnavailable("device not connected")
+    frame = _codecs.get(device_id, Codec()).encode(message)
+    try:
+        if isinstance(frame, bytes):
+            await asyncio.wait_for(ws.send_bytes(frame), timeout)
+        else:
+            await asyncio.wait_for(ws.send_text(frame), timeout)
+    except asyncio.TimeoutError:
+        raise DeviceUnavailable("send timeout")
+    except Exception as e:
+        raise DeviceUnavailable(str(e) or type(e).__name__)
+
+async def _call(worker: str, msg: Dict[str, Any], timeout: float = CALL_TIMEOUT) -> Dict[str, Any]:
+    # طلب واحد لكل اتصال: سطر JSON ذهاباً وسطر JSON إياباً
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(_sock_path(worker)), timeout)
+    except asyncio.TimeoutError:
+        raise DeviceUnavailable(f"worker {worker} busy")
+    except (ConnectionRefusedError, FileNotFoundError):
+        await _db(_drop_worker, worker)   # لا مقبس أو لا مستمع عليه = العامل مات
+        raise DeviceUnavailable(f"worker {worker} gone")
+    except OSError as e:
+        # EMFILE وأمثاله مشكلتنا نحن لا موت العامل الآخر → لا نحذف أجهزته
+        raise DeviceUnavailable(f"worker {worker}: {e}")
+    try:
+        writer.write(json.dumps(msg, ensure_ascii=False).encode("utf-8") + b"\n")
+        await writer.drain()
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        return json.loads(line) if line else {"ok": False, "error": "no reply"}
+    except (OSError, ValueError, asyncio.TimeoutError) as e:
+        raise DeviceUnavailable(f"worker {worker}: {e or type(e).__name__}")
+    finally:
+        writer.close()
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        req = json.loads(await reader.readline() or b"{}")
+        op = req.get("op")
+        if op == "send":
+            try:
+                await _send_local(req.get("device_id"), req.get("message") or {},
+                                  float(req.get("timeout") or CALL_TIMEOUT))
+                reply = {"ok": True}
+            except DeviceUnavailable as e:
+                reply = {"ok": False, "error": str(e)}
+        elif op == "done":
+            if _on_notify and req.get("cmd_id"):
+                _on_notify(req["cmd_id"])
+            reply = {"ok": True}
+        elif op in _queries:
+            reply = {"ok": True, **_queries[op](req)}
+        else:
+            reply = {"ok": False, "error": f"unknown op {op}"}
+        writer.write(json.dumps(reply).encode("utf-8") + b"\n")
+        await writer.drain()
+    except Exception as e:
+        print("⚠️ Device router request error:", e)
+    finally:
+        writer.close()
+
+# ==== البث ====
+def on_notify(fn: Callable[[str], None]) -> None:
+    """ما يُستدعى هنا عندما يعلن عامل آخر انتهاء أمر"""
+    global _on_notify
+    _on_notify = fn
+
+def on_query(op: str, fn: Callable[[Dict[str, Any]], Dict[str, Any]]) -> None:
+    """fn(req) تجيب عن op من حالة هذه العملية عندما يسأل عامل آخر"""
+    _queries[op] = fn
+
+async def ask(worker: str, msg: Dict[str, Any], timeout: float = 2.0) -> Dict[str, Any]:
+    """استعلام عامل محدد (العامل الحالي يُجاب محلياً)"""
+    if worker == WORKER_ID or not ROUTING:
+        return {"ok": True, **_queries[msg["op"]](msg)}
+    return await _call(worker, msg, timeout)
+
+async def ask_all(msg: Dict[str, Any], timeout: float = 2.0) -> List[Dict[str, Any]]:
+    """نفس الاستعلام لكل العمّال الأحياء بما فيهم هذا؛ العامل الذي لا يرد يُتجاوز"""
+    workers = [WORKER_ID] + [w for w in (await _db(_live_workers) if ROUTING else []) if w != WORKER_ID]
+    results = await asyncio.gather(*(ask(w, msg, timeout) for w in workers), return_exceptions=True)
+    return [r for r in results if isinstance(r, dict) and r.get("ok")]
+
+async def _broadcast(msg: Dict[str, Any]) -> None:
+    others = [w for w in await _db(_live_workers) if w != WORKER_ID]
+    results = await asyncio.gather(*(_call(w, msg, 2.0) for w in others), return_exceptions=True)
+    for w, r in zip(others, results):
+        if isinstance(r, Exception):
+            print(f"⚠️ Device router: broadcast to worker {w} failed:", r)
+
+def announce_done(cmd_id: str) -> None:
+    """أمر انتهى هنا → أيقظ منتظريه في بقية العمّال (بلا انتظار)"""
+    if not ROUTING or not _started:
+        return
+    try:
+        asyncio.get_running_loop().create_task(_broadcast({"op": "done", "cmd_id": cmd_id}))
+    except RuntimeError:
+        pass
@@ -1,68 +1,60 @@
 # bassam_core/app/devices_api.py
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-import os, json, time, uuid
-from typing import Dict, Any
-from .devices_ws import CONNECTED_DEVICES
-from workers.core_worker import enqueue_dialog  # كي يمكن تسجيل الحوارات إن رغبت
+import os, json, time, uuid, asyncio
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from .devices_ws import apply_result, db, notify, valid_token, wait_result
+from .device_router import DeviceUnavailable
+from . import device_router as registry
+from . import telemetry
+from .http_cache import bump, cached_json
+from . import command_store as store
+from . import command_output as output
 
 router = APIRouter()
-
-# مكان حفظ الأوامر المؤقتة
-CMD_STORE = os.path.join(os.path.dirname(__file__), "..", "data", "pending_commands.json")
-os.makedirs(os.path.dirname(CMD_STORE), exist_ok=True)
-
-def _load_cmds() -> Dict[str, Any]:
-    try:
-        with open(CMD_STORE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
-
-def _save_cmds(d):
-    with open(CMD_STORE, "w", encoding="utf-8") as f:
-        json.dump(d, f, ensure_ascii=False, indent=2)
+BATCH_MAX_DEVICES = int(os.getenv("BATCH_MAX_DEVICES", "1000"))
 
 class CmdRequest(BaseModel):
     device_id: str
     command: str
     description: str | None = None
 
+class BatchRequest(BaseModel):
+    command: str
+    description: str | None = None
+    devices: List[str] | None = None      # قائمة صريحة…
+    tag: str | None = None                # …أو كل الأجهزة المتصلة بهذا الوسم
+    send_timeout: float = 5.0             # مهلة الإرسال لكل جهاز
+
 @router.post("/device/command/request")
 async def request_command(req: CmdRequest):
     """تنشئ طلب أمر؛ يظل في القائمة حتى توافق عليه صراحة"""
-    # تحقق من وجود الجهاز المسجل
-    device_ws = CONNECTED_DEVICES.get(req.device_id)
-    cmd_id = str(uuid.uuid4())
-    store = _load_cmds()
-    store[cmd_id] = {
-        "cmd_id": cmd_id,
-        "device_id": req.device_id,
-        "command": req.command,
-        "description": req.description or "",
-        "ts": int(time.time()),
-        "status": "pending",   # pending, approved, sent, executed, failed, rejected
-        "result": None
-    }
-    _save_cmds(store)
-    return {"status":"queued", "cmd_id": cmd_id, "device_connected": bool(device_ws)}
+    # تحقق من وجود الجهاز المسجل (في أي عامل)
+    connected = await registry.is_connected(req.device_id)
+    cmd = await db(store.create, req.device_id, req.command, req.description or "")
+    bump("commands")
+    return {"status":"queued", "cmd_id": cmd["cmd_id"], "device_connected": connected}
 
 @router.post("/device/command/approve/{cmd_id}")
 async def approve_command(cmd_id: str):
     """أنت توافق على إرسال الأمر إلى الوكيل المُسجل."""
-    store = _load_cmds()
-    cmd = store.get(cmd_id)
+    cmd = await db(store.get, cmd_id)
     if not cmd:
         raise HTTPException(404, "cmd not found")
     if cmd["status"] != "pending":
         raise HTTPException(400, f"bad status {cmd['status']}")
-    # تحقق أن الوكيل متصل
-    ws = CONNECTED_DEVICES.get(cmd["device_id"])
-    if not ws:
-        cmd["status"] = "rejected"
-        _save_cmds(store)
+    # تحقق أن الوكيل متصل (الاتصال قد يكون عند عامل آخر)
+    if not await registry.is_connected(cmd["device_id"]):
+        notify(await db(store.transition, cmd_id, "rejected", ("pending",), result="device not connected"))
+        bump("commands")
         raise HTTPException(400, "device not connected")
-    # أعِد حالة ومحتوى وأرسل عبر WS
+    # حجز ذرّي pending → approved: موافقتان متزامنتان لا ترسلان الأمر مرتين
+    if not await db(store.transition, cmd_id, "approved", ("pending",)):
+        raise HTTPException(409, "command already handled")
+    bump("commands")
     payload = {
         "type": "execute",
         "cmd_id": cmd_id,
@@ -70,34 +62,207 @@ async def approve_command(cmd_id: str):
         "ts": int(time.time())
     }
     try:
-        await ws.send_text(json.dumps(payload))
-        cmd["status"] = "sent"
-        cmd["sent_ts"] = int(time.time())
-        _save_cmds(store)
+        await registry.deliver(cmd["device_id"], payload)
+        await db(store.transition, cmd_id, "sent", ("approved",), sent_ts=int(time.time()))
+        bump("commands")
         return {"status":"sent", "cmd_id": cmd_id}
-    except Exception as e:
-        cmd["status"] = "failed"
-        cmd["result"] = str(e)
-        _save_cmds(store)
+    except DeviceUnavailable as e:
+        notify(await db(store.transition, cmd_id, "failed", ("approved",), result=str(e)))
+        bump("commands")
         raise HTTPException(500, "send failed")
 
-@router.post("/device/command/result/{cmd_id}")
-async def command_result(cmd_id: str, payload: Dict[str, Any]):
-    """استقبال نتيجة تنفيذ من الوكيل. (يُفعل من الوكيل عبر WS أو HTTP)"""
-    store = _load_cmds()
-    cmd = store.get(cmd_id)
+@router.post("/device/command/cancel/{cmd_id}")
+async def cancel_command(cmd_id: str):
+    """إلغاء أمر: المعلّق يُلغى فوراً، والمرسل يُطلب من الوكيل قتل عمليته
+    (الحالة النهائية cancelled تصل مع نتيجته)"""
+    cmd = await db(store.transition, cmd_id, "cancelled", ("pending",), result="cancelled before approval")
+    if cmd:
+        bump("commands")
+        notify(cmd)
+        return {"status": "cancelled", "cmd_id": cmd_id}
+    cmd = await db(store.get, cmd_id)
     if not cmd:
         raise HTTPException(404, "cmd not found")
-    cmd["status"] = payload.get("status", "executed")
-    cmd["result"] = payload.get("output")
-    cmd["exec_ts"] = int(time.time())
-    _save_cmds(store)
+    if cmd["status"] not in store.IN_FLIGHT:
+        raise HTTPException(409, f"bad status {cmd['status']}")
+    try:
+        # الإلغاء يذهب لصاحب الأمر فقط، وأي رد منه (نتيجة أو state=unknown) يُطابق عليه
+        await registry.deliver(cmd["device_id"], {"type": "cancel", "cmd_id": cmd_id})
+    except DeviceUnavailable as e:
+        # الجهاز غير متصل: الوكيل ألغى كل أوامره عند الانقطاع → لا ننتظر نتيجة لن تأتي
+        gone = await db(store.transition, cmd_id, "cancelled", ("sent", "running"), owner=cmd["device_id"],
+                        result=f"cancelled: {e}", exec_ts=int(time.time()))
+        if not gone:
+            raise HTTPException(400, str(e))
+        bump("commands")
+        notify(gone)
+        return {"status": "cancelled", "cmd_id": cmd_id}
+    return {"status": "cancelling", "cmd_id": cmd_id}
+
+# ==== الدفعات: أمر واحد لعدة أجهزة ====
+def _batch_view(batch_id: str, cmds: List[Dict[str, Any]]) -> Dict[str, Any]:
+    counts = Counter(c["status"] for c in cmds)
+    done = sum(counts[s] for s in store.FINISHED)
+    return {
+        "batch_id": batch_id, "command": cmds[0]["command"] if cmds else None,
+        "total": len(cmds), "done": done, "complete": done == len(cmds), "counts": dict(counts),
+        "items": [{"cmd_id": c["cmd_id"], "device_id": c["device_id"], "status": c["status"],
+                   "result": c.get("result"), "exec_ts": c.get("exec_ts")} for c in cmds],
+    }
+
+@router.post("/device/batch")
+async def batch_command(req: BatchRequest):
+    """ينشئ ويوافق ويرسل نفس الأمر لعدة أجهزة معاً (طلب واحد بدل طلبين لكل جهاز)"""
+    online = {d["device_id"]: d for d in await registry.devices()}
+    if req.devices:
+        targets = list(dict.fromkeys(d for d in req.devices if d))
+    elif req.tag:
+        targets = [d for d, info in online.items() if req.tag in info["tags"]]
+    else:
+        raise HTTPException(400, "devices or tag required")
+    if not targets:
+        raise HTTPException(400, "no target devices")
+    if len(targets) > BATCH_MAX_DEVICES:
+        raise HTTPException(400, f"too many devices (max {BATCH_MAX_DEVICES})")
+
+    batch_id = uuid.uuid4().hex[:12]
+    # كل الأوامر في معاملة واحدة: المتصل يبدأ approved، وغير المتصل يُرفض فوراً
+    cmds = await db(store.create_many, [(d, "approved", None) if d in online
+                                        else (d, "rejected", "device not connected") for d in targets],
+                    req.command, req.description or "", batch_id=batch_id)
+    timeout = max(0.1, min(req.send_timeout, 30.0))
+
+    async def send(cmd: Dict[str, Any]):
+        payload = {"type": "execute", "cmd_id": cmd["cmd_id"], "command": req.command,
+                   "batch_id": batch_id, "ts": int(time.time())}
+        try:
+            await registry.deliver(cmd["device_id"], payload, timeout)
+            return cmd["cmd_id"], None
+        except DeviceUnavailable as e:
+            return cmd["cmd_id"], str(e)
+
+    # الإرسال المتزامن: زمن الدفعة ≈ أبطأ جهاز لا مجموع الأجهزة
+    sent = await asyncio.gather(*(send(c) for c in cmds if c["status"] == "approved"))
+    await db(store.transition_many, [cid for cid, err in sent if err is None], "sent", ("approved",),
+             sent_ts=int(time.time()))
+    for cid, err in sent:
+        if err is not None:
+            notify(await db(store.transition, cid, "failed", ("approved",), result=err))
+    bump("commands")
+    return _batch_view(batch_id, await db(store.list_batch, batch_id))
+
+@router.get("/device/batch/{batch_id}")
+async def batch_status(batch_id: str, wait: float = 0):
+    """الحالة المجمّعة للدفعة؛ wait>0 ينتظر حتى تكتمل كلها أو تنتهي المهلة"""
+    cmds = await db(store.list_batch, batch_id)
+    if not cmds:
+        raise HTTPException(404, "batch not found")
+    wait = max(0.0, min(wait, 120.0))
+    open_ids = [c["cmd_id"] for c in cmds if c["status"] not in store.FINISHED]
+    if wait and open_ids:
+        await asyncio.gather(*(wait_result(cid, wait) for cid in open_ids))
+        cmds = await db(store.list_batch, batch_id)
+    return _batch_view(batch_id, cmds)
+
+@router.post("/device/command/result/{cmd_id}")
+async def command_result(cmd_id: str, payload: Dict[str, Any]):
+    """استقبال نتيجة تنفيذ من الوكيل. (يُفعل من الوكيل عبر WS أو HTTP)
+    الجسم يحمل device_id وtoken كرسالة تسجيل WS؛ النتيجة تُقبل من صاحب الأمر فقط"""
+    device_id = payload.get("device_id")
+    if not device_id or not valid_token(payload.get("token")):
+        raise HTTPException(401, "device auth failed")
+    if not await apply_result(cmd_id, payload, device_id):
+        cur = await db(store.get, cmd_id)
+        if not cur:
+            raise HTTPException(404, "cmd not found")
+        if cur["device_id"] != device_id:
+            raise HTTPException(403, "command belongs to another device")
+        raise HTTPException(409, f"bad status {cur['status']}")
     return {"ok": True}
 
 @router.get("/devices")
-async def list_devices():
-    return {"connected": list(CONNECTED_DEVICES.keys())}
+async def list_devices(request: Request):
+    def build():
+        online = registry.read_devices()
+        return {"connected": [d["device_id"] for d in online],
+                "load": {d["device_id"]: d["load"] for d in online},
+                "tags": {d["device_id"]: d["tags"] for d in online},
+                "workers": {d["device_id"]: d["worker"] for d in online}}
+    # السجل مشترك بين العمّال → ملفه جزء من ETag
+    return await run_in_threadpool(cached_json, request, "devices", build,
+                                   paths=(registry.DB_PATH, registry.DB_PATH + "-wal"))
+
+@router.get("/devices/telemetry")
+async def devices_telemetry(device_id: Optional[str] = None, since: float = 0, points: int = 120):
+    """مجاميع الأسطول الحالية، ومع device_id سلسلة الجهاز مقلّصة إلى points نقطة"""
+    out = await telemetry.query(device_id, since, points)
+    if device_id and not out["device"].get("found"):
+        raise HTTPException(404, "no telemetry for device")
+    out["memory"] = telemetry.memory()
+    return out
 
 @router.get("/device/commands")
-async def list_commands():
-    return _load_cmds()
+async def list_commands(request: Request, status: Optional[str] = None, device_id: Optional[str] = None,
+                        cursor: Optional[int] = None, limit: int = 50):
+    """صفحة من الأوامر (الأحدث أولاً)؛ next_cursor يُمرَّر كـ cursor للصفحة التالية"""
+    limit = max(1, min(limit, 200))
+
+    def build():
+        items, nxt = store.list_commands(status=status, device_id=device_id, cursor=cursor, limit=limit)
+        return {"items": items, "next_cursor": nxt}
+    # ملف WAL يتغير مع كل كتابة (حتى من عمليات أخرى) → جزء من ETag
+    return await run_in_threadpool(cached_json, request, "commands", build,
+                                   paths=(store.DB_PATH, store.DB_PATH + "-wal"),
+                                   variant=f"{status}|{device_id}|{cursor}|{limit}")
+
+@router.get("/device/command/{cmd_id}/wait")
+async def wait_command(cmd_id: str, timeout: float = 30):
+    """long-poll: يعود فور وصول النتيجة، أو بعد timeout ثانية بالحالة الحالية (done=false)"""
+    cmd = await wait_result(cmd_id, max(0.0, min(timeout, 120.0)))
+    if not cmd:
+        raise HTTPException(404, "cmd not found")
+    return {"done": cmd["status"] in store.FINISHED, "command": cmd}
+
+@router.get("/device/command/{cmd_id}/output")
+async def command_output(cmd_id: str, offset: int = 0, limit: int = 64 * 1024):
+    """المخرجات الكاملة على دفعات: ابدأ من offset=0 وتابع بـ next_offset"""
+    cmd = await db(store.get, cmd_id)
+    if not cmd:
+        raise HTTPException(404, "cmd not found")
+    text, nxt = output.read_text(cmd_id, offset, max(1, min(limit, 1024 * 1024)))
+    return {"text": text, "offset": offset, "next_offset": nxt,
+            "done": cmd["status"] in store.FINISHED, **output.info(cmd_id)}
+
+@router.get("/device/command/{cmd_id}/tail")
+async def command_tail(cmd_id: str, request: Request, offset: int = 0):
+    """Server-Sent Events: المخرجات لحظة وصولها ثم حدث done بالحالة النهائية"""
+    if not await db(store.get, cmd_id):
+        raise HTTPException(404, "cmd not found")
+
+    async def events():
+        pos, idle = offset, 0.0
+        while not await request.is_disconnected():
+            text, nxt = output.read_text(cmd_id, pos)
+            if nxt > pos:
+                pos, idle = nxt, 0.0
+                yield f"event: output\ndata: {json.dumps({'text': text, 'offset': pos}, ensure_ascii=False)}\n\n"
+                continue
+            cmd = await db(store.get, cmd_id)
+            if cmd["status"] in store.FINISHED or output.info(cmd_id)["closed"]:
+                yield f"event: done\ndata: {json.dumps({**cmd, 'output': output.info(cmd_id)}, ensure_ascii=False)}\n\n"
+                return
+            # يوقظنا الإلحاق في هذه العملية؛ المهلة القصيرة تلتقط كتابات العمليات الأخرى
+            await output.wait_more(cmd_id, 2.0)
+            idle += 2.0
+            if idle >= 15:
+                idle = 0.0
+                yield ": ping\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.get("/device/command/{cmd_id}")
+async def get_command(cmd_id: str):
+    cmd = await db(store.get, cmd_id)
+    if not cmd:
+        raise HTTPException(404, "cmd not found")
+    return {**cmd, "output": output.info(cmd_id)}
@@ -2,12 +2,124 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
 import asyncio
 import json
-from typing import Dict
+import time
+from typing import Any, Callable, Dict, List, Optional
 import os
+from starlette.concurrency import run_in_threadpool
+from .http_cache import bump
+from . import command_store as store
+from . import command_output as output
+from . import device_router as registry
+from . import telemetry
+from .device_router import CONNECTED_DEVICES   # الاتصالات المحلية في هذه العملية
+from agent.codec import CodecError, describe, negotiate
 
 router = APIRouter()
-# في الذاكرة: device_id -> websocket
-CONNECTED_DEVICES: Dict[str, WebSocket] = {}
+
+async def db(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """استدعاء command_store خارج حلقة الأحداث: BEGIN IMMEDIATE قد ينتظر قفل الكاتب
+    حتى مهلة SQLite (10 ث)، ولو جرى هنا لتوقف كل اتصال WS وطلب HTTP في العامل"""
+    return await run_in_threadpool(fn, *args, **kwargs)
+
+# ==== انتظار نتائج الأوامر ====
+# cmd_id -> futures لمن ينتظر (GET /device/command/{id}/wait)
+_waiters: Dict[str, List[asyncio.Future]] = {}
+WAIT_RECHECK_SEC = 2.0   # شبكة أمان إن ضاع إشعار من عامل آخر
+
+def _wake(cmd_id: str) -> None:
+    # المنتظر يعيد قراءة الأمر بنفسه (في wait_result) → لا قراءة من المخزن هنا
+    for fut in _waiters.pop(cmd_id, []):
+        if not fut.done():
+            fut.set_result(None)
+
+def notify(cmd: Optional[Dict[str, Any]]) -> None:
+    """يوقظ المنتظرين إن انتهى الأمر، هنا وفي بقية العمّال (يُستدعى من حلقة الأحداث)"""
+    if cmd and cmd["status"] in store.FINISHED:
+        _wake(cmd["cmd_id"])
+        registry.announce_done(cmd["cmd_id"])
+
+registry.on_notify(_wake)
+
+async def apply_result(cmd_id: str, payload: Dict[str, Any], device_id: str) -> Optional[Dict[str, Any]]:
+    """نتيجة من الوكيل (WS أو HTTP) → المخزن ذرّياً ثم إيقاظ المنتظرين.
+    لا تُقبل إلا من الجهاز صاحب الأمر."""
+    status = store.RESULT_STATUS.get(payload.get("status", "executed"), "executed")
+    cmd = await db(store.transition, cmd_id, status, store.IN_FLIGHT, owner=device_id,
+                   result=payload.get("output"), exec_ts=int(time.time()))
+    if cmd:
+        bump("commands")
+        notify(cmd)
+    return cmd
+
+async def orphan_commands(device_id: str, reason: str, before: Optional[float] = None) -> None:
+    """الجهاز انقطع (أو عاد بجلسة جديدة): أوامره المرسلة/الجارية لن تكتمل → failed وإيقاظ منتظريها"""
+    cmds = await db(store.orphan, device_id, reason, before)
+    for cmd in cmds:
+        notify(cmd)
+    if cmds:
+        bump("commands")
+        print(f"⚠️ {len(cmds)} in-flight command(s) of {device_id} failed: {reason}")
+
+async def wait_result(cmd_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+    """ينتظر حتى ينتهي الأمر أو تنتهي المهلة؛ يعيد الأمر بحالته الأخيرة (None إن لم يوجد)"""
+    await registry.ensure_started()     # كي تصلنا إشعارات العمّال الآخرين
+    deadline = time.monotonic() + timeout
+    loop = asyncio.get_running_loop()
+    while True:
+        cmd = await db(store.get, cmd_id)
+        left = deadline - time.monotonic()
+        if not cmd or cmd["status"] in store.FINISHED or left <= 0:
+            return cmd
+        fut = loop.create_future()
+        _waiters.setdefault(cmd_id, []).append(fut)
+        try:
+            await asyncio.wait_for(fut, min(left, WAIT_RECHECK_SEC))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            lst = _waiters.get(cmd_id)
+            if lst and fut in lst:
+                lst.remove(fut)
+                if not lst:
+                    _waiters.pop(cmd_id, None)
+
+_key_error: Optional[str] = None
+
+def _fernet():
+    """سياق الختم المشترك (utils.crypto.context: الأساسي + المفاتيح القديمة)؛ None إن لم يُضبط مفتاح.
+    يُستدعى لكل اتصال: السياق مخزّن هناك، وreload_keys() يصل للقناة مباشرة."""
+    global _key_error
+    from utils import crypto
+    try:
+        return crypto.context()
+    except RuntimeError:
+        return None            # لا مفتاح مضبوط: القناة بلا ختم (كما كانت)
+    except Exception as e:
+        # مفتاح تالف: الختم يتعطل → نقولها مرة لكل خطأ بدل الصمت
+        msg = f"{type(e).__name__}: {e}"
+        if msg != _key_error:
+            _key_error = msg
+            print("⚠️ Fernet key error — device channel sealing disabled:", msg)
+        return None
+
+def _fernet_for(info: Dict[str, Any]):
+    """الختم لهذا الاتصال: بالمفتاح الذي أثبت الوكيل امتلاكه (seal_proof)، وإلا الأساسي"""
+    ctx = _fernet()
+    proof = info.get("seal_proof")
+    if ctx is None or not info.get("seal") or not proof:
+        return ctx
+    from utils import crypto
+    f = crypto.context_for(proof, str(info.get("device_id")).encode())
+    if f is None:
+        print("⚠️ Device", info.get("device_id"), "seals with an unknown key — channel left unsealed")
+    return f
+
+async def _recv(websocket: WebSocket):
+    """الإطار التالي نصياً كان أو ثنائياً"""
+    m = await websocket.receive()
+    if m["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(m.get("code", 1000))
+    return m["text"] if m.get("text") is not None else m.get("bytes")
 
 # بسيط: تحقق توكن (يمكن تحسين لاحقًا)
 def valid_token(token: str) -> bool:
@@ -16,8 +128,10 @@ def valid_token(token: str) -> bool:
 
 @router.websocket("/ws/device")
 async def device_ws_endpoint(websocket: WebSocket):
-    # يتوقع رسالة تسجيل JSON: {"device_id":"id","token":"..."}
+    # يتوقع رسالة تسجيل JSON: {"device_id":"id","token":"...","tags":[...],"codecs":["msgpack","json"],"seal":true}
     await websocket.accept()
+    await registry.ensure_started()
+    device_id = None
     try:
         auth = await asyncio.wait_for(websocket.receive_text(), timeout=10)
         info = json.loads(auth)
@@ -27,26 +141,101 @@ async def device_ws_endpoint(websocket: WebSocket):
             await websocket.send_text(json.dumps({"error":"auth_failed"}))
             await websocket.close()
             return
-        CONNECTED_DEVICES[device_id] = websocket
-        await websocket.send_text(json.dumps({"ok":"registered", "device_id": device_id}))
+        # الرد بـ JSON دائماً؛ بعده يستخدم الطرفان الترميز المتفق عليه
+        codec = negotiate(info, _fernet_for(info))
+        try:
+            heartbeat = max(0.0, float(info.get("heartbeat") or 0))
+        except (TypeError, ValueError):
+            heartbeat = 0.0
+        await registry.register(device_id, websocket, [str(t) for t in (info.get("tags") or []) if t][:32], codec,
+                                heartbeat=heartbeat)
+        # جلسة جديدة = الوكيل ألغى كل ما كان يعمل في الجلسة السابقة
+        await orphan_commands(device_id, "device reconnected before reporting a result", before=time.time())
+        bump("devices")
+        await websocket.send_text(json.dumps({"ok":"registered", "device_id": device_id, **describe(codec)}))
+
+        # cmd_id -> هل الأمر لهذا الجهاز؟ (قراءة واحدة من المخزن لكل أمر لا لكل مقطع)
+        owned: Dict[str, bool] = {}
+
+        async def owns(cmd_id: str) -> bool:
+            if cmd_id not in owned:
+                if len(owned) >= 1024:
+                    owned.clear()
+                cmd = await db(store.get, cmd_id)
+                owned[cmd_id] = bool(cmd and cmd["device_id"] == device_id)
+            return owned[cmd_id]
+
         # بقاء الاتصال واستقبال رسائل إن جاءت من الوكيل (logs أو heartbeats)
         while True:
             try:
-                msg = await websocket.receive_text()
-                # يمكن هنا حفظ مخرجات تنفيذ من الوكيل
-                # رسالة متوقعة JSON: {"type":"result","cmd_id":"...","output":"...","status":"ok"}
+                msg = await _recv(websocket)
+                registry.touch(device_id)
+                # رسالة متوقعة: {"type":"result","cmd_id":"...","output":"...","status":"ok"}
                 try:
-                    obj = json.loads(msg)
-                    # ببساطة اطبعها في لوج السيرفر
+                    obj = codec.decode(msg)
+                except CodecError as e:
+                    print("bad frame from device", device_id, e)
+                    continue
+                kind = obj.get("type")
+                if kind == "ping":
+                    # الرد على نفس الاتصال بترميزه (لا عبر السجل: قد يكون للجهاز اتصال أحدث في عامل آخر)
+                    if CONNECTED_DEVICES.get(device_id) is not websocket:
+                        # طُرد هذا الاتصال أو حلّ محله أحدث؛ لا نبقيه حياً
+                        try:
+                            await websocket.close(code=4409)
+                        except Exception:
+                            pass
+                        break
+                    try:
+                        frame = codec.encode({"type": "pong", "ts": obj.get("ts")})
+                        if isinstance(frame, str):
+                            await websocket.send_text(frame)
+                        else:
+                            await websocket.send_bytes(frame)
+                    except Exception:
+                        break
+                elif kind == "chunk" and obj.get("cmd_id"):
+                    # مقطع مخرجات مرقّم؛ الكتابة هنا متزامنة عمداً: إن تأخر القرص
+                    # نتوقف عن القراءة من WS فيتباطأ الوكيل (ضغط عكسي طبيعي)
+                    if not await owns(obj["cmd_id"]):
+                        print("device-> chunk for foreign command", device_id, obj["cmd_id"])
+                        continue
+                    output.append(obj["cmd_id"], int(obj.get("seq") or 0), obj.get("data") or "")
+                elif kind == "result" and obj.get("cmd_id"):
+                    # النتيجة تذهب للمخزن مباشرة وتوقظ من ينتظرها
+                    if obj.get("streamed") and await owns(obj["cmd_id"]):
+                        output.close(obj["cmd_id"])
+                    if not await apply_result(obj["cmd_id"], obj, device_id):
+                        print("device-> stale result", device_id, obj.get("cmd_id"))
+                elif kind == "state" and obj.get("cmd_id"):
+                    # الوكيل بدأ تشغيل الأمر فعلاً (بعد انتظاره في طابوره)
+                    if obj.get("state") == "running" and await db(store.transition, obj["cmd_id"], "running",
+                                                                  ("approved", "sent"), owner=device_id):
+                        bump("commands")
+                    elif obj.get("state") == "unknown":
+                        # رد على cancel: الوكيل لا يعرف الأمر (لم يصله أو انتهى) → لن تأتي نتيجة
+                        cmd = await db(store.transition, obj["cmd_id"], "cancelled", ("sent", "running"),
+                                       owner=device_id, result="not running on device", exec_ts=int(time.time()))
+                        if cmd:
+                            bump("commands")
+                            notify(cmd)
+                elif kind == "telemetry":
+                    telemetry.record(device_id, obj)
+                elif kind == "status":
+                    await registry.set_load(device_id, {k: obj.get(k) for k in ("running", "queued", "max", "ts")})
+                    bump("devices")
+                else:
                     print("device->", device_id, obj)
-                except Exception:
-                    print("raw from device", device_id, msg)
             except WebSocketDisconnect:
                 break
     except Exception as e:
         print("WS auth/recv error:", e)
     finally:
         try:
-            CONNECTED_DEVICES.pop(device_id, None)
-        except Exception:
-            pass
+            if device_id and await registry.unregister(device_id, websocket):
+                bump("devices")
+                # لم يعد الجهاز متصلاً بأي عامل → ما أُرسل له ولم يكتمل لن تصل نتيجته
+                if not await registry.locate(device_id):
+                    await orphan_commands(device_id, "device disconnected")
+        except Exception as e:
+            print("WS cleanup error:", device_id, e)
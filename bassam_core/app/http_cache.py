@@ -0,0 +1,132 @@
+# bassam_core/app/http_cache.py
+# ETag/304 للمسارات الساخنة + صفحات HTML مضغوطة مسبقاً في الذاكرة
+# - لكل مورد عدّاد إصدار يزداد عند كل تعديل (bump)؛ الموارد المخزّنة في ملفات
+#   تضيف حجم الملف ووقت تعديله (يلتقط كتابات العمليات الأخرى بدون قراءة الملف).
+# - ETag = بصمة التشغيل + الإصدار (+ stat)، فطلب If-None-Match المطابق يعود 304
+#   قبل أي قراءة أو تسلسل JSON، والجسم المسلسل الأخير يُعاد استخدامه كما هو.
+import os, gzip, json, uuid, hashlib, threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli  # اختياري
+except ImportError:
+    brotli = None
+
+BOOT = uuid.uuid4().hex[:8]   # إعادة التشغيل تُبطل كل ETag سابق (العدادات تبدأ من الصفر)
+BODY_CACHE_SIZE = int(os.getenv("HTTP_BODY_CACHE", "64"))
+
+# ==== عدادات الإصدار ====
+_versions: Dict[str, int] = {}
+_versions_lock = threading.Lock()
+
+def bump(resource: str) -> int:
+    with _versions_lock:
+        _versions[resource] = _versions.get(resource, 0) + 1
+        return _versions[resource]
+
+def version(resource: str) -> int:
+    return _versions.get(resource, 0)
+
+def _stat(path: str) -> str:
+    try:
+        st = os.stat(path)
+        return f"{st.st_mtime_ns:x}.{st.st_size:x}"
+    except OSError:
+        return "0"
+
+def make_etag(resource: str, *parts: Any, paths: Iterable[str] = ()) -> str:
+    raw = "|".join([BOOT, resource, str(version(resource)), *map(str, parts), *map(_stat, paths)])
+    return 'W/"' + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20] + '"'
+
+def _matches(request: Request, etag: str) -> bool:
+    inm = request.headers.get("if-none-match")
+    if not inm:
+        return False
+    tags = {t.strip() for t in inm.split(",")}
+    return "*" in tags or etag in tags or etag.removeprefix("W/") in tags
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+# ==== JSON مع ETag ====
+_bodies: "OrderedDict[Tuple[str, str], Tuple[str, bytes]]" = OrderedDict()
+_bodies_lock = threading.Lock()
+
+def cached_json(request: Request, resource: str, build: Callable[[], Any], *parts: Any,
+                paths: Iterable[str] = (), variant: str = "") -> Response:
+    """يعيد 304 إن طابق ETag؛ وإلا الجسم المسلسل المخزّن لنفس الإصدار، أو يبنيه مرة"""
+    paths = tuple(paths)
+    etag = make_etag(resource, variant, *parts, paths=paths)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _matches(request, etag):
+        return not_modified(etag)
+    key = (resource, variant)
+    with _bodies_lock:
+        hit = _bodies.get(key)
+        if hit and hit[0] == etag:
+            _bodies.move_to_end(key)
+            return Response(hit[1], media_type="application/json", headers=headers)
+    body = json.dumps(build(), ensure_ascii=False, default=str).encode("utf-8")
+    with _bodies_lock:
+        _bodies[key] = (etag, body)
+        _bodies.move_to_end(key)
+        while len(_bodies) > BODY_CACHE_SIZE:
+            _bodies.popitem(last=False)
+    return Response(body, media_type="application/json", headers=headers)
+
+# ==== صفحات HTML ثابتة مضغوطة مسبقاً ====
+class StaticPage:
+    """النص يُرمّز ويُضغط مرة واحدة (gzip، وbrotli إن توفّرت)؛ كل طلب يختار
+    الترميز المناسب من Accept-Encoding ويعيد البايتات الجاهزة"""
+
+    def __init__(self, html: str, media_type: str = "text/html; charset=utf-8"):
+        self.media_type = media_type
+        self.raw = html.encode("utf-8")
+        self.etag = '"' + hashlib.sha1(self.raw).hexdigest()[:20] + '"'
+        self.encoded: Dict[str, bytes] = {"gzip": gzip.compress(self.raw, 9, mtime=0)}
+        if brotli is not None:
+            self.encoded["br"] = brotli.compress(self.raw, quality=11)
+
+    def response(self, request: Request) -> Response:
+        headers = {"ETag": self.etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+        if _matches(request, self.etag):
+            return Response(status_code=304, headers=headers)
+        enc = _pick_encoding(request.headers.get("accept-encoding", ""), self.encoded)
+        if enc:
+            return Response(self.encoded[enc], media_type=self.media_type,
+                            headers={**headers, "Content-Encoding": enc})
+        return Response(self.raw, media_type=self.media_type, headers=headers)
+
+def _accept_q(header: str) -> Dict[str, float]:
+    """Accept-Encoding → {ترميز: q}؛ قيمة q غير صالحة تُعامل كصفر"""
+    out: Dict[str, float] = {}
+    for token in header.split(","):
+        name, *params = [p.strip() for p in token.split(";")]
+        if not name:
+            continue
+        q = 1.0
+        for p in params:
+            k, _, v = p.partition("=")
+            if k.strip().lower() == "q":
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        out[name.lower()] = q
+    return out
+
+def _pick_encoding(header: str, available: Iterable[str]) -> Optional[str]:
+    # الأعلى q بين المتاح (br قبل gzip عند التساوي)؛ q=0 رفض صريح، و* تغطي غير المذكور
+    accepted = _accept_q(header)
+    best, best_q = None, 0.0
+    for enc in ("br", "gzip"):
+        if enc not in available:
+            continue
+        q = accepted.get(enc, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = enc, q
+    return best
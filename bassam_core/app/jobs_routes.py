@@ -0,0 +1,68 @@
+# bassam_core/app/jobs_routes.py
+# متابعة المهام الخلفية: الحالة والنتيجة + بث التقدّم (SSE)
+# الحالة في مخزن مشترك (workers/jobs.py) → أي عامل يجيب، والمتابعة استطلاع غير حاجز
+import os
+import json
+import time
+import asyncio
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from workers.jobs import FINAL, get_job, job_events as read_events, list_jobs
+
+router = APIRouter()
+
+JOBS_POLL_SEC = float(os.getenv("JOBS_POLL_SEC", "0.5"))
+JOBS_HEARTBEAT_SEC = 15.0
+
+async def _job_or_404(job_id: str, with_result: bool = True):
+    job = await run_in_threadpool(get_job, job_id, with_result)
+    if job is None:
+        raise HTTPException(404, "job not found (unknown or expired)")
+    return job
+
+@router.get("/jobs")
+async def jobs_index(limit: int = 20):
+    return {"jobs": await run_in_threadpool(list_jobs, max(1, min(limit, 200)))}
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    return await _job_or_404(job_id)
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request, after: int = 0):
+    """Server-Sent Events: حدث لكل مرحلة، والحدث الأخير done أو error مع الحالة الكاملة"""
+    await _job_or_404(job_id, with_result=False)
+    # EventSource يرسل Last-Event-ID عند إعادة الاتصال → نكمل من حيث توقفنا
+    last = request.headers.get("last-event-id")
+    if last and last.isdigit():
+        after = max(after, int(last))
+
+    async def events():
+        nonlocal after
+        quiet = time.monotonic()
+        while not await request.is_disconnected():
+            new = await run_in_threadpool(read_events, job_id, after)
+            for ev in new:
+                after = ev["seq"]
+                final = ev["stage"] in FINAL
+                if final:
+                    ev = {**ev, "job": await run_in_threadpool(get_job, job_id)}
+                yield f"id: {ev['seq']}\nevent: {ev['stage']}\ndata: {json.dumps(ev, ensure_ascii=False, default=str)}\n\n"
+                if final:
+                    return
+            if new:
+                quiet = time.monotonic()
+            else:
+                job = await run_in_threadpool(get_job, job_id, False)
+                if job is None:
+                    return        # حُذفت المهمة
+                if job["status"] in FINAL and not await run_in_threadpool(read_events, job_id, after):
+                    return        # انتهت وقد أرسلنا كل أحداثها
+                if time.monotonic() - quiet >= JOBS_HEARTBEAT_SEC:
+                    quiet = time.monotonic()
+                    yield ": ping\n\n"
+            await asyncio.sleep(JOBS_POLL_SEC)
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
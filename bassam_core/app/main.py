@@ -1,15 +1,21 @@
 # bassam_core/app/main.py
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import HTMLResponse, JSONResponse
 from .api import router as api_router
+from .jobs_routes import router as jobs_router
 from workers.core_worker import start_scheduler
+from .memory import start_compactor
+from .http_cache import StaticPage
 
 app = FastAPI(title="Bassam Core", version="1.0.0")
+# ضغط الردود الكبيرة (SSE text/event-stream والردود المضغوطة مسبقاً تُستثنى)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 app.include_router(api_router, prefix="/api", tags=["API"])
+app.include_router(jobs_router, prefix="/api", tags=["Jobs"])
 
-@app.get("/", response_class=HTMLResponse)
-def index():
-    html = """
+# الصفحة ثابتة → تُرمّز وتُضغط مرة واحدة عند الاستيراد
+INDEX_PAGE = StaticPage("""
 <!doctype html><meta charset="utf-8"><title>Bassam Core</title>
 <style>
 :root{--bg:#0b1220;--card:#0f1a2b;--muted:#a5b4d4;--line:#1e2b44}
@@ -93,6 +99,18 @@ function render(items){
   });
 }
 
+// دفع من الخادم: لقطة عند الاتصال ثم كل سجل جديد وكل تغيّر في الحالة فور حدوثه
+let docs=[];
+function connectStream(){
+  if(!window.EventSource){ refreshState(); startPolling(); return; }
+  const es=new EventSource('/api/learn/stream?limit=8');
+  es.addEventListener('snapshot',e=>{ const j=JSON.parse(e.data); docs=j.docs||[]; render(docs); setBadge(!!(j.state||{}).running); });
+  es.addEventListener('doc',e=>{ const d=JSON.parse(e.data); docs=[d].concat(docs.filter(x=>x.id!==d.id)).slice(0,8); render(docs); });
+  es.addEventListener('state',e=>setBadge(!!JSON.parse(e.data).running));
+  // EventSource يعيد الاتصال تلقائياً ويصل بلقطة جديدة
+}
+
+// بديل للمتصفحات بدون EventSource فقط
 async function startPolling(){
   clearInterval(pollTimer);
   pollTimer=setInterval(async()=>{ try{
@@ -108,24 +126,51 @@ async function go(mode){
   if(!q) return alert('اكتب موضوعًا أولاً');
 
   try{
+    let job;
     if(mode==='fast'){
       show('⏳ يبحث الآن ويتعلّم…');
-      await api('/api/learn/fast?q='+encodeURIComponent(q)+'&source='+encodeURIComponent(src), {method:'POST'});
+      job=await api('/api/learn/fast?q='+encodeURIComponent(q)+'&source='+encodeURIComponent(src), {method:'POST'});
     }else{
       show('⏳ إضافة للصف ثم تشغيل دورة…');
       await api('/api/search',{method:'POST',body:JSON.stringify({q})});
-      await api('/api/learn/run',{method:'POST',body:JSON.stringify({topics:[q]})});
+      job=await api('/api/learn/run',{method:'POST',body:JSON.stringify({topics:[q]})});
     }
-    hide(); show('✅ تم — يتم تحديث النتائج أسفل تلقائيًا.');
-    startPolling();
+    const st=await followJob(job.job_id, ev=>show('⏳ '+stageText(ev)));
+    hide(); show(st==='done'?'✅ تم — يتم تحديث النتائج أسفل تلقائيًا.':'❌ فشلت المهمة');
   }catch(e){ show('❌ خطأ: '+e.message); }
 }
 
+// متابعة مهمة خلفية: SSE على /api/jobs/{id}/events، وعند تعذّره استطلاع الحالة
+function stageText(ev){
+  const n=ev.total?(' ('+ev.done+'/'+ev.total+')'):'';
+  return ({queued:'في الانتظار',running:'بدأ التنفيذ',search:'بحث',learned:'تم التعلّم',queue:'الصف',topic:'موضوع',fetch:'جلب الصفحات',summarize:'تلخيص'}[ev.stage]||ev.stage)+n+(ev.query?(' — '+ev.query):'');
+}
+function followJob(id,onEvent){
+  return new Promise(resolve=>{
+    if(!window.EventSource) return pollJob(id,onEvent).then(resolve);
+    const es=new EventSource('/api/jobs/'+id+'/events'); let fin=false;
+    ['queued','running','search','learned','queue','topic','fetch','summarize'].forEach(n=>es.addEventListener(n,e=>onEvent(JSON.parse(e.data))));
+    ['done','error'].forEach(n=>es.addEventListener(n,()=>{ fin=true; es.close(); resolve(n); }));
+    es.onerror=()=>{ es.close(); if(!fin) pollJob(id,onEvent).then(resolve); };
+  });
+}
+async function pollJob(id,onEvent){
+  for(;;){
+    const j=await api('/api/jobs/'+id);
+    if(j.last_event) onEvent(j.last_event);
+    if(j.status==='done'||j.status==='error') return j.status;
+    await new Promise(r=>setTimeout(r,1500));
+  }
+}
+
 document.getElementById('q').addEventListener('keydown',e=>{ if(e.key==='Enter'){ e.preventDefault(); go('fast'); }});
-refreshState(); startPolling();
+connectStream();
 </script>
-"""
-    return HTMLResponse(html)
+""")
+
+@app.get("/", response_class=HTMLResponse)
+def index(request: Request):
+    return INDEX_PAGE.response(request)
 
 @app.get("/health")
 def health():
@@ -134,3 +179,4 @@ def health():
 @app.on_event("startup")
 def _startup():
     start_scheduler()
+    start_compactor()
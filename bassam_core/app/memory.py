@@ -1,9 +1,26 @@
-import sqlite3, os, time, textwrap
+import sqlite3, os, time, threading, atexit
+from collections import OrderedDict, deque
 from datetime import datetime
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "core.db")
+COMPACT_LOCK = os.path.join(os.path.dirname(__file__), "..", "data", "compactor.lock")
 os.makedirs(os.path.join(os.path.dirname(__file__), "..", "data"), exist_ok=True)
 
+# الضغط الخلفي: أي جلسة تتجاوز هذا العدد من الرسائل تُلخّص
+COMPACT_THRESHOLD = int(os.getenv("MEMORY_COMPACT_THRESHOLD", "40"))
+COMPACT_INTERVAL_SEC = int(os.getenv("MEMORY_COMPACT_SEC", "300"))
+SUMMARY_WIDTH = 800
+
+# كاش الجلسات النشطة (LRU) + وضع الكتابة:
+#   sync  → كل رسالة تُكتب فوراً عبر اتصال واحد دائم
+#   group → تُجمع الرسائل وتُكتب دفعة واحدة في معاملة كل MEMORY_FLUSH_MS
+HOT_SESSIONS = int(os.getenv("MEMORY_HOT_SESSIONS", "256"))
+HOT_MESSAGES = int(os.getenv("MEMORY_HOT_MESSAGES", "32"))
+DURABILITY = os.getenv("MEMORY_DURABILITY", "sync").lower()
+FLUSH_MS = int(os.getenv("MEMORY_FLUSH_MS", "50"))
+FLUSH_BATCH = int(os.getenv("MEMORY_FLUSH_BATCH", "256"))
+LOCK_STRIPES = int(os.getenv("MEMORY_LOCK_STRIPES", "64"))
+
 def _conn():
     return sqlite3.connect(DB_PATH)
 
@@ -15,37 +32,214 @@ def init_memory():
             ts REAL
         )""")
         c.execute("""CREATE INDEX IF NOT EXISTS idx_session_ts ON messages(session, ts)""")
+        c.execute("""CREATE INDEX IF NOT EXISTS idx_session_id ON messages(session, id)""")
+        # ملخّص متدحرج لكل جلسة + العلامة المائية (آخر id تم طيّه في الملخّص)
+        c.execute("""CREATE TABLE IF NOT EXISTS summaries(
+            session TEXT PRIMARY KEY,
+            upto_id INTEGER NOT NULL DEFAULT 0,
+            content TEXT, ts REAL
+        )""")
+
+# ==== الكاش والكاتب الخلفي ====
+_hot: "OrderedDict[str, deque]" = OrderedDict()
+_hot_summary: dict = {}          # ملخّص كل جلسة ساخنة (نفس مفاتيح _hot)
+_hot_lock = threading.Lock()     # بنية الكاش فقط (عمليات قصيرة، لا قرص تحته)
+# أقفال الجلسات (مخطّطة بالتجزئة): الكتابة للقرص وتعبئة الكاش من القرص لنفس الجلسة
+# لا تتداخلان، وجلسة تنتظر القرص لا توقف بقية الجلسات ولا قراءات الكاش
+_session_locks = [threading.Lock() for _ in range(max(1, LOCK_STRIPES))]
+
+def _slock(session: str) -> threading.Lock:
+    return _session_locks[hash(session) % len(_session_locks)]
+_pending: list = []
+_pending_cv = threading.Condition()
+_writer = None
+_writer_lock = threading.RLock()
+_flusher: threading.Thread | None = None
+
+def _writer_conn():
+    global _writer
+    if _writer is None:
+        _writer = sqlite3.connect(DB_PATH, check_same_thread=False)
+        _writer.execute("PRAGMA journal_mode=WAL")
+        if DURABILITY == "group":
+            _writer.execute("PRAGMA synchronous=NORMAL")
+    return _writer
+
+def _write_rows(rows):
+    if not rows:
+        return
+    with _writer_lock:
+        c = _writer_conn()
+        with c:
+            c.executemany("INSERT INTO messages(session, role, content, ts) VALUES(?,?,?,?)", rows)
+
+def flush():
+    """يكتب كل الرسائل المعلّقة الآن (يُستدعى قبل أي قراءة من القرص)"""
+    with _writer_lock:
+        with _pending_cv:
+            rows = _pending[:]
+            _pending.clear()
+        _write_rows(rows)
+
+def _flusher_loop():
+    while True:
+        with _pending_cv:
+            if len(_pending) < FLUSH_BATCH:
+                _pending_cv.wait(FLUSH_MS / 1000)
+        try:
+            flush()
+        except Exception as e:
+            print("⚠️ Memory flush error:", e)
+
+def _start_flusher():
+    global _flusher
+    with _pending_cv:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flusher_loop, daemon=True)
+            _flusher.start()
+            atexit.register(flush)
 
 def save_message(session: str, role: str, content: str):
-    with _conn() as c:
-        c.execute("INSERT INTO messages(session, role, content, ts) VALUES(?,?,?,?)",
-                  (session, role, content, time.time()))
+    row = (session, role, content, time.time())
+    if DURABILITY == "group":
+        _start_flusher()
+    # الكتابة والكاش تحت قفل الجلسة كي لا تفوت قراءةٌ من القرص رسالةً قيد الكتابة
+    with _slock(session):
+        if DURABILITY == "group":
+            with _pending_cv:
+                _pending.append(row)
+                if len(_pending) >= FLUSH_BATCH:
+                    _pending_cv.notify()
+        else:
+            _write_rows([row])
+        with _hot_lock:
+            dq = _hot.get(session)
+            if dq is not None:
+                dq.append((role, content))
+                _hot.move_to_end(session)
 
-def get_recent(session: str, limit: int = 12):
-    with _conn() as c:
-        cur = c.execute("SELECT role, content FROM messages WHERE session=? ORDER BY ts DESC LIMIT ?",
-                        (session, limit))
-        rows = cur.fetchall()[::-1]
+def get_recent(session: str, limit: int = 12, with_summary: bool = True):
+    """آخر limit رسالة؛ ما طواه الضاغط يأتي أولاً كسطر summary (كما كان قبل الملخّص المتدحرج)
+    كي لا يختفي أول المحادثة عن السياق بعد الضغط"""
+    rows, brief = _recent(session, limit)
+    if with_summary and brief and limit > 0:
+        # السطر الملخّص ضمن limit كما في الأصل
+        rows = [("summary", f"[ملخّص سابق]: {brief}")] + (rows[-(limit - 1):] if limit > 1 else [])
     return rows
 
+def _recent(session: str, limit: int):
+    if limit <= HOT_MESSAGES:
+        with _hot_lock:
+            dq = _hot.get(session)
+            if dq is not None:
+                _hot.move_to_end(session)
+                return (list(dq)[-limit:] if limit > 0 else []), _hot_summary.get(session)
+    with _slock(session):
+        flush()
+        with _conn() as c:
+            cur = c.execute("SELECT role, content FROM messages WHERE session=? ORDER BY id DESC LIMIT ?",
+                            (session, max(limit, HOT_MESSAGES)))
+            rows = cur.fetchall()[::-1]
+            brief = c.execute("SELECT content FROM summaries WHERE session=?", (session,)).fetchone()
+        brief = brief[0] if brief else None
+        if HOT_SESSIONS > 0:
+            with _hot_lock:
+                _hot[session] = deque(rows[-HOT_MESSAGES:], maxlen=HOT_MESSAGES)
+                _hot_summary[session] = brief
+                while len(_hot) > HOT_SESSIONS:
+                    _hot_summary.pop(_hot.popitem(last=False)[0], None)
+    return (rows[-limit:] if limit > 0 else []), brief
+
+def get_summary(session: str) -> str | None:
+    with _hot_lock:
+        if session in _hot:
+            return _hot_summary.get(session)
+    with _conn() as c:
+        row = c.execute("SELECT content FROM summaries WHERE session=?", (session,)).fetchone()
+    return row[0] if row else None
+
+def _fold(prev: str | None, lines, width: int = SUMMARY_WIDTH) -> str:
+    """يدمج الرسائل الجديدة في الملخّص السابق مع إبقاء الأحدث عند تجاوز الطول"""
+    text = " | ".join(([prev] if prev else []) + lines)
+    if len(text) <= width:
+        return text
+    tail = text[-width:]
+    return "... " + tail[tail.find(" ") + 1:]
+
 def summarize_history(session: str, keep:int=8):
-    """يلخّص القديم عندما تكبر الجلسة لتبقى خفيفة"""
+    """يلخّص القديم عندما تكبر الجلسة لتبقى خفيفة (فقط ما بعد آخر علامة مائية)"""
+    with _slock(session):
+        _summarize_locked(session, keep)
+
+def _summarize_locked(session: str, keep: int):
+    flush()
     with _conn() as c:
-        cur = c.execute("SELECT id, role, content FROM messages WHERE session=? ORDER BY ts ASC", (session,))
-        rows = cur.fetchall()
-        if len(rows) <= keep:
+        # أحدث رسالة خارج نافذة الإبقاء: كل ما قبلها (وهي ضمناً) يُطوى في الملخّص
+        row = c.execute("SELECT id FROM messages WHERE session=? ORDER BY id DESC LIMIT 1 OFFSET ?",
+                        (session, keep)).fetchone()
+        if not row:
             return
-        old = rows[:-keep]
-        text = "\n".join([f"{r}: {t}" for _, r, t in old])
-        # تلخيص بسيط محلّي (يمكن لاحقًا استبداله باستدعاء نموذج خارجي إذا أردت)
-        lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-        brief = textwrap.shorten(" | ".join(lines), width=800, placeholder=" ...")
-        # امسح القديم واستبدله بسطر مُلخّص
-        ids = tuple([i for i,_,_ in old])
-        q = "DELETE FROM messages WHERE id IN ({})".format(",".join("?"*len(ids)))
-        c.execute(q, ids)
-        c.execute("INSERT INTO messages(session, role, content, ts) VALUES(?,?,?,?)",
-                  (session, "summary", f"[ملخّص سابق]: {brief}", time.time()))
+        upto = row[0]
+        prev = c.execute("SELECT upto_id, content FROM summaries WHERE session=?", (session,)).fetchone()
+        mark, prev_text = prev if prev else (0, None)
+        cur = c.execute("SELECT role, content FROM messages WHERE session=? AND id>? AND id<=? ORDER BY id",
+                        (session, mark, upto))
+        lines = [f"{r}: {' '.join(t.split())}" for r, t in cur if t and t.strip()]
+        brief = _fold(prev_text, lines)
+        # حذف بالمدى على id بدل قائمة IN بطول السجل
+        c.execute("DELETE FROM messages WHERE session=? AND id<=?", (session, upto))
+        c.execute("""INSERT INTO summaries(session, upto_id, content, ts) VALUES(?,?,?,?)
+                     ON CONFLICT(session) DO UPDATE SET
+                       upto_id=excluded.upto_id, content=excluded.content, ts=excluded.ts""",
+                  (session, upto, brief, time.time()))
+    # الكاش يبقى ساخناً: نقصّ منه ما طُوي فقط (تحت قفل الجلسة لا كتابة جديدة بينهما)
+    with _hot_lock:
+        dq = _hot.get(session)
+        if dq is not None:
+            while len(dq) > keep:
+                dq.popleft()
+            _hot_summary[session] = brief
+
+def compact_all(threshold: int = COMPACT_THRESHOLD, keep: int = 8) -> int:
+    """يمر على كل الجلسات التي تجاوزت الحد ويلخّصها"""
+    flush()
+    with _conn() as c:
+        sessions = [s for (s,) in c.execute(
+            "SELECT session FROM messages GROUP BY session HAVING COUNT(*) > ?", (threshold,))]
+    for s in sessions:
+        summarize_history(s, keep=keep)
+    return len(sessions)
+
+# ==== الضاغط الخلفي ====
+# مع --workers N: عامل واحد فقط يضغط (قفل flock مثل قائد الجدولة)، والبقية تتولى إن سقط
+_COMPACTOR = None
+_compactor_stop = threading.Event()
+
+def _compactor_loop(interval_sec: int):
+    while not _compactor_stop.wait(interval_sec):
+        try:
+            n = compact_all()
+            if n:
+                print(f"🗜️ Memory compactor: summarized {n} session(s)")
+        except Exception as e:
+            print("⚠️ Memory compactor error:", e)
+
+def start_compactor(interval_sec: int = COMPACT_INTERVAL_SEC) -> None:
+    global _COMPACTOR
+    if _COMPACTOR or interval_sec <= 0:
+        return
+    init_memory()
+    from workers.leader import Leader
+    _COMPACTOR = Leader(COMPACT_LOCK, role="memory compactor",
+                        on_elected=lambda: threading.Thread(target=_compactor_loop, args=(interval_sec,),
+                                                            daemon=True).start())
+    _COMPACTOR.start()
+
+def stop_compactor() -> None:
+    _compactor_stop.set()
+    if _COMPACTOR:
+        _COMPACTOR.release()
+
 if __name__ == "__main__":
     import os
     import sqlite3
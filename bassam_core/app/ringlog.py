@@ -0,0 +1,100 @@
+# bassam_core/app/ringlog.py
+# حلقة ثابتة السعة على ملف مُخصّص مسبقاً (mmap): إضافة وقراءة O(1) وآمنة بين العمليات
+import os, json, mmap, struct, threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # ويندوز: قفل داخل العملية فقط
+    fcntl = None
+
+MAGIC = b"BRNG"
+_HEADER = struct.Struct("<4sIIQ")   # magic, capacity, slot_size, head (عدد الإضافات الكلي)
+HEADER_SIZE = 64
+_LEN = struct.Struct("<I")
+
+def _fit(entry: Dict[str, Any], limit: int) -> bytes:
+    """يقصّ أطول حقل نصي حتى يتسع السجل في خانة واحدة"""
+    raw = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+    entry = dict(entry)
+    while len(raw) > limit:
+        texts = [k for k, v in entry.items() if isinstance(v, str) and v]
+        if not texts:
+            raise ValueError("entry does not fit in ring slot")
+        k = max(texts, key=lambda x: len(entry[x]))
+        b = entry[k].encode("utf-8")
+        entry[k] = b[:max(0, len(b) - (len(raw) - limit))].decode("utf-8", "ignore")
+        raw = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+    return raw
+
+class RingLog:
+    def __init__(self, path: str, capacity: int = 50, slot_size: int = 512,
+                 seed: Optional[Callable[[], Iterable[Dict[str, Any]]]] = None):
+        """seed: سجلات أولية تُكتب عند إنشاء الملف فقط، تحت نفس القفل (استيراد صيغة قديمة)"""
+        self.path = path
+        self._lock = threading.Lock()
+        self.created = False
+        self._f = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), "r+b")
+        self._flock(fcntl.LOCK_EX if fcntl else None)
+        try:
+            if os.fstat(self._f.fileno()).st_size < HEADER_SIZE:
+                self.created = True
+                self._f.truncate(HEADER_SIZE + capacity * slot_size)
+                self._f.seek(0)
+                self._f.write(_HEADER.pack(MAGIC, capacity, slot_size, 0))
+                self._f.flush()
+            self._mm = mmap.mmap(self._f.fileno(), 0)
+            magic, self.capacity, self.slot_size, _ = _HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a ring log")
+            if self.created and seed is not None:
+                for entry in seed():
+                    try:
+                        self._write(_fit(entry, self.slot_size - _LEN.size))
+                    except (TypeError, ValueError):
+                        continue
+        finally:
+            self._flock(fcntl.LOCK_UN if fcntl else None)
+
+    def _flock(self, op):
+        if op is not None:
+            fcntl.flock(self._f.fileno(), op)
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        raw = _fit(entry, self.slot_size - _LEN.size)
+        with self._lock:
+            self._flock(fcntl.LOCK_EX if fcntl else None)
+            try:
+                self._write(raw)
+            finally:
+                self._flock(fcntl.LOCK_UN if fcntl else None)
+
+    def _write(self, raw: bytes) -> None:
+        # يُستدعى والقفل الحصري مأخوذ
+        head = _HEADER.unpack_from(self._mm, 0)[3]
+        off = HEADER_SIZE + (head % self.capacity) * self.slot_size
+        self._mm[off:off + _LEN.size + len(raw)] = _LEN.pack(len(raw)) + raw
+        # تحديث المؤشر بعد اكتمال الخانة كي لا يقرأ أحد خانة نصف مكتوبة
+        struct.pack_into("<Q", self._mm, 12, head + 1)
+
+    def read(self) -> List[Dict[str, Any]]:
+        """السجلات الموجودة من الأقدم إلى الأحدث"""
+        with self._lock:
+            self._flock(fcntl.LOCK_SH if fcntl else None)
+            try:
+                head = _HEADER.unpack_from(self._mm, 0)[3]
+                out = []
+                for i in range(max(0, head - self.capacity), head):
+                    off = HEADER_SIZE + (i % self.capacity) * self.slot_size
+                    (n,) = _LEN.unpack_from(self._mm, off)
+                    out.append(json.loads(self._mm[off + _LEN.size:off + _LEN.size + n]))
+                return out
+            finally:
+                self._flock(fcntl.LOCK_UN if fcntl else None)
+
+    def __len__(self) -> int:
+        return min(_HEADER.unpack_from(self._mm, 0)[3], self.capacity)
+
+    def close(self) -> None:
+        self._mm.close()
+        self._f.close()
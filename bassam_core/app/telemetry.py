@@ -0,0 +1,164 @@
+# bassam_core/app/telemetry.py
+# قياسات الوكلاء الدورية (الحمل، الذاكرة، القرص، طابور الأوامر)
+# - حلقة ثابتة الحجم لكل جهاز على مصفوفات numpy: الذاكرة لكل جهاز ثابتة مهما طال التشغيل
+# - تقليص السلاسل لعدد نقاط محدد (متوسط + أعلى قيمة لكل دلو) بعمليات متجهة
+# - مجاميع الأسطول من آخر عينة لكل جهاز، ومن كل العمّال عبر device_router
+import os, time, warnings
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import device_router as registry
+
+FIELDS = ("load1", "mem_pct", "disk_pct", "running", "queued")
+POINTS = int(os.getenv("TELEMETRY_POINTS", "720"))            # 3 ساعات بفاصل 15 ثانية
+MAX_DEVICES = int(os.getenv("TELEMETRY_MAX_DEVICES", "5000"))
+FRESH_SEC = float(os.getenv("TELEMETRY_FRESH_SEC", "120"))     # أقدم عينة تُحتسب في مجاميع الأسطول
+
+class Ring:
+    """آخر POINTS عينة: ts (float64) وقيم (float32، NaN للمفقود)"""
+
+    def __init__(self, size: int = POINTS):
+        self.ts = np.zeros(size, dtype=np.float64)
+        self.values = np.full((size, len(FIELDS)), np.nan, dtype=np.float32)
+        self.head = 0          # موضع الكتابة التالية
+        self.count = 0
+        self.skew = None       # ساعة الوكيل − ساعة الخادم في آخر عينة (للعرض فقط)
+
+    def push(self, ts: float, row: np.ndarray) -> None:
+        self.ts[self.head] = ts
+        self.values[self.head] = row
+        self.head = (self.head + 1) % len(self.ts)
+        self.count = min(self.count + 1, len(self.ts))
+
+    def series(self, since: float = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """العينات بترتيب زمني (نسخ عبر فهرسة، بلا حلقات)"""
+        n = len(self.ts)
+        idx = (np.arange(self.count) + (self.head - self.count)) % n
+        ts, vals = self.ts[idx], self.values[idx]
+        if since:
+            keep = ts >= since
+            ts, vals = ts[keep], vals[keep]
+        return ts, vals
+
+    def latest(self) -> Tuple[float, np.ndarray]:
+        i = (self.head - 1) % len(self.ts)
+        return float(self.ts[i]), self.values[i]
+
+    @property
+    def nbytes(self) -> int:
+        return self.ts.nbytes + self.values.nbytes
+
+_rings: "OrderedDict[str, Ring]" = OrderedDict()
+
+def _num(v: Any) -> float:
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return np.nan
+
+def record(device_id: str, sample: Dict[str, Any]) -> None:
+    ring = _rings.pop(device_id, None) or Ring()
+    _rings[device_id] = ring                   # الأحدث في النهاية (LRU)
+    while len(_rings) > MAX_DEVICES:
+        _rings.popitem(last=False)
+    # الختم بوقت الاستلام في الخادم: ساعة جهاز منحرفة أو راجعة للخلف لا تُخرجه من مجاميع
+    # الأسطول ولا تكسر ترتيب ts الذي يفترضه downsample؛ وقت الوكيل يبقى معلومة فقط
+    now = time.time()
+    agent_ts = _num(sample.get("ts"))
+    ring.skew = round(agent_ts - now, 3) if agent_ts == agent_ts else None
+    ring.push(now, np.array([_num(sample.get(f)) for f in FIELDS], dtype=np.float32))
+
+# ==== الحساب المتجه ====
+def downsample(ts: np.ndarray, vals: np.ndarray, points: int) -> Dict[str, Any]:
+    """تقسيم المدى الزمني إلى points دلو متساوٍ: متوسط وأعلى قيمة لكل حقل في كل دلو"""
+    if len(ts) == 0:
+        return {"ts": [], "mean": {f: [] for f in FIELDS}, "max": {f: [] for f in FIELDS}}
+    if len(ts) <= points:
+        mean = mx = vals
+        bts = ts
+    else:
+        span = max(ts[-1] - ts[0], 1e-9)
+        bucket = np.minimum(((ts - ts[0]) / span * points).astype(np.int64), points - 1)
+        # ts مرتبة → الدلاء متجاورة؛ reduceat على بدايات كل دلو
+        starts = np.flatnonzero(np.r_[True, np.diff(bucket) > 0])
+        counts = np.diff(np.r_[starts, len(ts)])
+        ok = ~np.isnan(vals)
+        sums = np.add.reduceat(np.where(ok, vals, 0), starts, axis=0)
+        n_ok = np.add.reduceat(ok, starts, axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = sums / n_ok
+        mx = np.fmax.reduceat(vals, starts, axis=0)
+        bts = np.add.reduceat(ts, starts) / counts
+    return {"ts": np.round(bts, 3).tolist(),
+            "mean": {f: _clean(mean[:, i]) for i, f in enumerate(FIELDS)},
+            "max": {f: _clean(mx[:, i]) for i, f in enumerate(FIELDS)}}
+
+def _clean(col: np.ndarray) -> List[Optional[float]]:
+    # NaN ليس JSON صالحاً → None
+    return [None if v != v else round(float(v), 3) for v in col]
+
+def fleet_stats(ids: List[str], ts: np.ndarray, latest: np.ndarray, top: int = 5) -> Dict[str, Any]:
+    """مجاميع الأسطول من آخر عينة لكل جهاز (مصفوفة أجهزة × حقول)"""
+    fresh = ts >= time.time() - FRESH_SEC
+    ids = [d for d, keep in zip(ids, fresh) if keep]
+    m = latest[fresh]
+    out: Dict[str, Any] = {"devices": len(ids), "reporting_window_sec": FRESH_SEC}
+    if not len(ids):
+        return out
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)   # عمود كله NaN (وكلاء بلا getloadavg مثلاً)
+        p50, p95 = np.nanpercentile(m, [50, 95], axis=0)
+        stats = {"mean": np.nanmean(m, axis=0), "p50": p50, "p95": p95, "max": np.nanmax(m, axis=0)}
+    out["fields"] = {f: {k: (None if v[i] != v[i] else round(float(v[i]), 3)) for k, v in stats.items()}
+                     for i, f in enumerate(FIELDS)}
+    q = FIELDS.index("queued"), FIELDS.index("running")
+    out["queue_total"] = int(np.nansum(m[:, q[0]]) + np.nansum(m[:, q[1]]))
+    load = np.nan_to_num(m[:, FIELDS.index("load1")], nan=-1.0)
+    order = np.argsort(-load)[:top]
+    out["hottest"] = [{"device_id": ids[i], "load1": round(float(load[i]), 3)} for i in order if load[i] >= 0]
+    return out
+
+# ==== الاستعلام عبر العمّال ====
+def _local_latest() -> Dict[str, Any]:
+    ids = list(_rings)
+    rows = [_rings[d].latest() for d in ids]
+    return {"ids": ids, "ts": [r[0] for r in rows], "values": [_clean(r[1]) for r in rows]}
+
+def _local_series(req: Dict[str, Any]) -> Dict[str, Any]:
+    ring = _rings.get(req.get("device_id") or "")
+    if ring is None:
+        return {"found": False}
+    ts, vals = ring.series(float(req.get("since") or 0))
+    return {"found": True, "samples": int(len(ts)), "clock_skew_sec": ring.skew,
+            **downsample(ts, vals, int(req.get("points") or 120))}
+
+def _handle(req: Dict[str, Any]) -> Dict[str, Any]:
+    return _local_series(req) if req.get("device_id") else _local_latest()
+
+registry.on_query("telemetry", _handle)
+
+async def query(device_id: Optional[str] = None, since: float = 0, points: int = 120) -> Dict[str, Any]:
+    points = max(1, min(points, POINTS))
+    out: Dict[str, Any] = {"fields": list(FIELDS)}
+    replies = await registry.ask_all({"op": "telemetry"})
+    ids = [d for r in replies for d in r["ids"]]
+    ts = np.array([t for r in replies for t in r["ts"]], dtype=np.float64)
+    latest = np.array([[np.nan if v is None else v for v in row] for r in replies for row in r["values"]],
+                      dtype=np.float32).reshape(len(ids), len(FIELDS))
+    out["fleet"] = fleet_stats(ids, ts, latest)
+    if device_id:
+        # السلسلة عند العامل الذي استقبل قياسات الجهاز (قد يكون غير متصل الآن)
+        msg = {"op": "telemetry", "device_id": device_id, "since": since, "points": points}
+        series = _local_series(msg)
+        if not series["found"]:
+            replies = await registry.ask_all(msg)
+            series = next((r for r in replies if r.get("found")), series)
+        series.pop("ok", None)
+        out["device"] = {"device_id": device_id, **series}
+    return out
+
+def memory() -> Dict[str, int]:
+    return {"devices": len(_rings), "bytes_per_device": Ring(1).nbytes * POINTS,
+            "bytes": sum(r.nbytes for r in _rings.values())}
@@ -1,11 +1,15 @@
 from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
 from .api import router as api_router
+from .app.jobs_routes import router as jobs_router
 
 app = FastAPI(title="Bassam Core", version="1.0.0")
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.include_router(api_router, prefix="/api", tags=["API"])
+app.include_router(jobs_router, prefix="/api", tags=["Jobs"])
 
 @app.get("/")
 def root():
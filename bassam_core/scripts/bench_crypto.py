@@ -0,0 +1,71 @@
+# قياس عمليات التشفير في الثانية: الطريقة القديمة (Fernet جديد لكل استدعاء)
+# مقابل السياق المخزّن (MultiFernet) ودفعات encrypt_many/decrypt_many، ثم موجة تدوير
+# لسجلات مشفرة بمفتاح قديم. المفاتيح مولّدة للقياس فقط (لا تُلمس keys/).
+# الاستخدام (من مجلد bassam_core): python -m scripts.bench_crypto [--n 20000]
+import argparse, json, os, time
+from cryptography.fernet import Fernet
+
+def payloads(n: int):
+    return [{"cmd_id": f"{i:08x}-0000-4000-8000-000000000000", "device_id": f"dev-{i % 50}",
+             "command": "ps aux --sort=-%cpu | head -20", "description": "فحص الحمل",
+             "requested_by": "admin", "ts": 1700000000 + i} for i in range(n)]
+
+def rate(n: int, fn) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return n / (time.perf_counter() - t0)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20000)
+    args = ap.parse_args()
+    old_key, new_key = Fernet.generate_key().decode(), Fernet.generate_key().decode()
+    os.environ["FERNET_KEY"] = old_key
+    os.environ["FERNET_OLD_KEYS"] = ""
+    from utils import crypto
+    crypto.reload_keys()
+
+    objs = payloads(args.n)
+    n = len(objs)
+
+    # السلوك السابق: بناء Fernet لكل عملية
+    def legacy_enc():
+        return [Fernet(old_key.encode()).encrypt(json.dumps(o, ensure_ascii=False).encode()).decode() for o in objs]
+    tokens = legacy_enc()
+
+    def legacy_dec():
+        for t in tokens:
+            json.loads(Fernet(old_key.encode()).decrypt(t.encode()).decode())
+
+    rows = [("legacy (Fernet per call)", rate(n, legacy_enc), rate(n, legacy_dec)),
+            ("cached encrypt_json", rate(n, lambda: [crypto.encrypt_json(o) for o in objs]),
+             rate(n, lambda: [crypto.decrypt_json(t) for t in tokens])),
+            ("encrypt_many / decrypt_many", rate(n, lambda: crypto.encrypt_many(objs)),
+             rate(n, lambda: crypto.decrypt_many(tokens)))]
+    print(f"{n} command payloads (~{len(json.dumps(objs[0]))} B JSON)\n")
+    print(f"{'path':30s} {'encrypt ops/s':>14s} {'decrypt ops/s':>14s}")
+    for name, e, d in rows:
+        print(f"{name:30s} {e:14,.0f} {d:14,.0f}   (x{e / rows[0][1]:.2f} / x{d / rows[0][2]:.2f})")
+
+    # تدوير: مفتاح جديد أساسي، القديم للفك فقط، ثم موجة على "السجلات المخزنة"
+    os.environ["FERNET_KEY"] = new_key
+    os.environ["FERNET_OLD_KEYS"] = old_key
+    crypto.reload_keys()
+    d_old = rate(n, lambda: crypto.decrypt_many(tokens))
+    store = dict(enumerate(tokens))
+    t0 = time.perf_counter()
+    stats = crypto.sweep(list(store.items()), lambda batch: store.update(batch))
+    took = time.perf_counter() - t0
+    print(f"\nafter rotation: decrypt old-key tokens {d_old:,.0f} ops/s (tries the new key first)")
+    print(f"sweep: {stats['rotated']} rotated, {stats['failed']} failed in {took:.2f}s "
+          f"({stats['rotated'] / took:,.0f} records/s)")
+
+    # بعد الموجة: يكفي المفتاح الجديد وحده
+    os.environ["FERNET_OLD_KEYS"] = ""
+    crypto.reload_keys()
+    ok = crypto.decrypt_many(store.values()) == objs
+    print(f"old key dropped: all records readable with the new key only: {ok}")
+    print(f"decrypt after sweep {rate(n, lambda: crypto.decrypt_many(store.values())):,.0f} ops/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# قياس ترميز رسائل قناة الأجهزة: حجم الإطار على السلك ووقت المعالج لكل رسالة
+# لكل ترميز (JSON نصي، msgpack، ومع ختم Fernet) مع/بدون permessage-deflate.
+# الضغط يُحاكى كما يفعله websockets: سياق deflate واحد طوال الاتصال (context takeover)
+# و Z_SYNC_FLUSH بعد كل رسالة مع حذف الذيل 00 00 ff ff.
+# الاستخدام (من مجلد bassam_core): python -m scripts.bench_device_codec [--n 2000]
+import argparse, random, time, uuid, zlib
+from cryptography.fernet import Fernet
+from agent.codec import Codec
+
+def sample_messages(n: int):
+    rnd = random.Random(7)
+    procs = ["python3", "uvicorn", "nginx", "sshd", "systemd", "bash", "postgres", "redis-server"]
+
+    def output(lines: int) -> str:
+        return "".join(f"{rnd.choice(['root', 'www-data', 'bassam'])} {rnd.randint(1, 40000):6d} "
+                       f"{rnd.random() * 5:4.1f} {rnd.random() * 10:4.1f} {rnd.choice(procs)} --port {rnd.randint(1000, 9999)}\n"
+                       for _ in range(lines))
+    msgs = []
+    for i in range(n):
+        cmd_id = str(uuid.UUID(int=rnd.getrandbits(128)))
+        kind = i % 4
+        if kind == 0:
+            msgs.append({"type": "execute", "cmd_id": cmd_id, "command": "ps aux --sort=-%cpu | head -40",
+                         "ts": 1700000000 + i})
+        elif kind == 1:
+            msgs.append({"type": "status", "running": rnd.randint(0, 4), "queued": rnd.randint(0, 3),
+                         "max": 4, "ts": 1700000000 + i})
+        elif kind == 2:
+            msgs.append({"type": "chunk", "cmd_id": cmd_id, "seq": i, "data": output(70)[:4096]})
+        else:
+            msgs.append({"type": "result", "cmd_id": cmd_id, "streamed": True, "status": "ok",
+                         "output": output(40)[-2000:], "exit_code": 0, "chunks": 3, "bytes": 11000,
+                         "truncated": False})
+    return msgs
+
+def deflate_sizes(frames):
+    # permessage-deflate بالإعدادات الافتراضية لـ websockets (مستوى 6، نافذة 15، بلا إعادة ضبط السياق)
+    z = zlib.compressobj(6, zlib.DEFLATED, -15)
+    t0 = time.perf_counter()
+    total = 0
+    for f in frames:
+        data = f.encode("utf-8") if isinstance(f, str) else f
+        out = z.compress(data) + z.flush(zlib.Z_SYNC_FLUSH)
+        total += len(out) - 4
+    return total, time.perf_counter() - t0
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=2000)
+    args = ap.parse_args()
+    msgs = sample_messages(args.n)
+    fernet = Fernet(Fernet.generate_key())
+    variants = [("json", Codec("json")), ("msgpack", Codec("msgpack")),
+                ("json + fernet", Codec("json", fernet)), ("msgpack + fernet", Codec("msgpack", fernet))]
+    n = len(msgs)
+    print(f"{n} messages (execute / status / 4 KB chunk / result with 2 KB tail)\n")
+    print(f"{'encoding':18s} {'raw B/msg':>10s} {'deflate B/msg':>14s} {'enc µs':>8s} {'dec µs':>8s} {'deflate µs':>11s}")
+    base = None
+    for name, codec in variants:
+        t0 = time.perf_counter()
+        frames = [codec.encode(m) for m in msgs]
+        enc = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for f in frames:
+            codec.decode(f)
+        dec = time.perf_counter() - t0
+        raw = sum(len(f.encode("utf-8")) if isinstance(f, str) else len(f) for f in frames)
+        wire, zt = deflate_sizes(frames)
+        base = base or wire
+        print(f"{name:18s} {raw / n:10.0f} {wire / n:14.0f} {enc / n * 1e6:8.1f} {dec / n * 1e6:8.1f} {zt / n * 1e6:11.1f}"
+              f"   ({wire / base:4.0%} of json+deflate)")
+    for kind in ("execute", "status", "chunk", "result"):
+        sub = [m for m in msgs if m["type"] == kind]
+        js = sum(len(Codec("json").encode(m).encode("utf-8")) for m in sub) / len(sub)
+        mp = sum(len(Codec("msgpack").encode(m)) for m in sub) / len(sub)
+        print(f"  {kind:8s} json {js:7.0f} B   msgpack {mp:7.0f} B")
+
+if __name__ == "__main__":
+    main()
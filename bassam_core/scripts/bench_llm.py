@@ -0,0 +1,59 @@
+# قياس عميل النموذج ضد الخادم المحلي: عميل جديد لكل طلب (الطريقة القديمة) مقابل
+# العميل المشترك بالتتابع، بالتوازي (complete_many)، ومن الكاش.
+# الاستخدام (من مجلد bassam_core): python -m scripts.bench_llm [--n 16] [--latency 0.2]
+import argparse, tempfile, time
+from pathlib import Path
+from scripts.fake_llm_server import serve
+from utils.llm_client import LLMClient
+
+TEXT = ("الذكاء الاصطناعي يغيّر طريقة العمل في الشركات. النماذج اللغوية تلخّص التقارير الطويلة بسرعة. "
+        "لكن تكلفة الاستدعاء وزمن الانتظار يبقيان عاملاً مهماً في التصميم. "
+        "الكاش يقلل التكلفة عند تكرار نفس الطلب. والتوازي يقلل زمن الدورة الكامل.")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=16)
+    ap.add_argument("--latency", type=float, default=0.2)
+    ap.add_argument("--port", type=int, default=8099)
+    args = ap.parse_args()
+    srv = serve(port=args.port, latency=args.latency)
+    base = f"http://127.0.0.1:{args.port}/v1"
+    batch = [[{"role": "system", "content": "لخّص"}, {"role": "user", "content": f"[{i}] {TEXT}"}]
+             for i in range(args.n)]
+
+    def report(name, t):
+        print(f"{name:34s} {t:7.2f} s  ({args.n / t:6.1f} req/s)")
+
+    # الطريقة القديمة: OpenAI() جديد لكل استدعاء وبالتتابع
+    from openai import OpenAI
+    t0 = time.perf_counter()
+    for m in batch:
+        OpenAI(base_url=base, api_key="local").chat.completions.create(model="local", messages=m)
+    report("new client per call, sequential", time.perf_counter() - t0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        seq = LLMClient(base_url=base, cache_dir=None)
+        t0 = time.perf_counter()
+        for m in batch:
+            seq.complete(m)
+        report("shared client, sequential", time.perf_counter() - t0)
+
+        for c in (4, 8):
+            cli = LLMClient(base_url=base, concurrency=c, cache_dir=Path(tmp) / f"c{c}")
+            t0 = time.perf_counter()
+            cli.complete_many(batch)
+            report(f"complete_many (concurrency={c})", time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            cli.complete_many(batch)
+            report(f"complete_many cached (c={c})", time.perf_counter() - t0)
+            print("   ", cli.stats())
+
+        dup = LLMClient(base_url=base, concurrency=4, cache_dir=None)
+        t0 = time.perf_counter()
+        dup.complete_many([batch[0]] * args.n)
+        report("complete_many, identical prompts", time.perf_counter() - t0)
+        print("   ", dup.stats())
+    srv.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# قياس زمن عمليات ذاكرة الدردشة (p50/p99)
+# الاستخدام (من مجلد bassam_core):
+#   python -m scripts.bench_memory --durability sync
+#   python -m scripts.bench_memory --durability group
+#   MEMORY_HOT_SESSIONS=0 python -m scripts.bench_memory   # بدون كاش
+import argparse, os, random, statistics, sys, tempfile, time
+
+def pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(len(xs) * p / 100))] * 1000
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sessions", type=int, default=50)
+    ap.add_argument("--turns", type=int, default=40)
+    ap.add_argument("--durability", default=os.getenv("MEMORY_DURABILITY", "sync"))
+    args = ap.parse_args()
+    os.environ["MEMORY_DURABILITY"] = args.durability
+
+    from app import memory
+    memory.DB_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+    memory.init_memory()
+
+    reads, writes = [], []
+    sessions = [f"s{i}" for i in range(args.sessions)]
+    for turn in range(args.turns):
+        random.shuffle(sessions)
+        for s in sessions:
+            t = time.perf_counter()
+            memory.get_recent(s, 12)
+            reads.append(time.perf_counter() - t)
+            for role in ("user", "assistant"):
+                t = time.perf_counter()
+                memory.save_message(s, role, f"{role} message {turn} " * 8)
+                writes.append(time.perf_counter() - t)
+    flush = getattr(memory, "flush", None)
+    if flush:
+        flush()
+
+    print(f"durability={args.durability} hot_sessions={os.getenv('MEMORY_HOT_SESSIONS', 'default')}")
+    for name, xs in (("get_recent", reads), ("save_message", writes)):
+        print(f"  {name:13s} n={len(xs):5d}  p50={pct(xs, 50):.3f}ms  p99={pct(xs, 99):.3f}ms"
+              f"  mean={statistics.mean(xs) * 1000:.3f}ms")
+
+if __name__ == "__main__":
+    sys.exit(main())
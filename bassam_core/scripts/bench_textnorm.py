@@ -0,0 +1,57 @@
+# قياس سرعة التوحيد ومصنّف النبرة مقارنة بالطريقة القديمة (any(w in m ...))
+# الاستخدام (من مجلد bassam_core): python -m scripts.bench_textnorm
+import random, timeit
+from utils.textnorm import TONE_LEXICONS, ToneClassifier, TONE_PRIORITY, normalize, tokens
+
+WORDS = "الذكاء الاصطناعي مشروع بايثون سريع اليوم كيف يمكنني أن أتعلّم البرمجة بسهولة".split()
+LEX = [w for ws in TONE_LEXICONS.values() for w in ws]
+
+def make_messages(n, seed=0):
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(n):
+        ws = [rnd.choice(WORDS) for _ in range(rnd.randint(5, 25))]
+        if rnd.random() < 0.3:
+            ws.insert(rnd.randrange(len(ws)), rnd.choice(LEX))
+        out.append(" ".join(ws) + rnd.choice(["؟", "!", ".", ""]))
+    return out
+
+def old_tone(msg):
+    m = msg.lower()
+    sad, angry, excited = (TONE_LEXICONS[t] for t in TONE_PRIORITY)
+    if any(w in m for w in sad): return "supportive"
+    if any(w in m for w in angry): return "calm"
+    if any(w in m for w in excited): return "excited"
+    return "friendly"
+
+def main():
+    msgs = make_messages(5000)
+    clf = ToneClassifier(TONE_LEXICONS, TONE_PRIORITY)
+    n = len(msgs)
+    cases = [
+        ("normalize", lambda: [normalize(m) for m in msgs]),
+        ("tokens", lambda: [tokens(m) for m in msgs]),
+        ("tone (old any-scan)", lambda: [old_tone(m) for m in msgs]),
+        ("tone (compiled, incl. normalize)", lambda: [clf.classify(m) for m in msgs]),
+        ("tone classify_many", lambda: clf.classify_many(msgs)),
+    ]
+    for name, fn in cases:
+        t = min(timeit.repeat(fn, number=1, repeat=5))
+        print(f"{name:34s} {t / n * 1e6:8.2f} µs/msg  ({n / t:,.0f} msg/s)")
+    # قاموس كبير (٣٠٠ كلمة لكل نبرة): المسح القديم يكبر مع حجم القاموس، النمط المُترجم لا
+    big = {t: ws + [f"{w}{i}" for w in ws for i in range(40)] for t, ws in TONE_LEXICONS.items()}
+    big_clf = ToneClassifier(big, TONE_PRIORITY)
+    def old_big(msg):
+        m = msg.lower()
+        for t in TONE_PRIORITY:
+            if any(w in m for w in big[t]): return t
+        return "friendly"
+    for name, fn in (("big lexicon (old any-scan)", lambda: [old_big(m) for m in msgs]),
+                     ("big lexicon (compiled)", lambda: big_clf.classify_many(msgs))):
+        t = min(timeit.repeat(fn, number=1, repeat=3))
+        print(f"{name:34s} {t / n * 1e6:8.2f} µs/msg  ({n / t:,.0f} msg/s)")
+    agree = sum(old_tone(m) == clf.classify(m) for m in msgs)
+    print(f"agreement with old classifier: {agree}/{n}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# خادم محلي صغير يحاكي POST /v1/chat/completions (بديل OpenAI للتجربة والقياس بدون شبكة)
+# الاستخدام (من مجلد bassam_core):
+#   python -m scripts.fake_llm_server --port 8089 --latency 0.3
+#   LLM_BACKEND=local python main.py
+# الرد: أهم جمل رسالة المستخدم (TextRank) بعد انتظار latency ثانية لمحاكاة زمن النموذج.
+import argparse, json, threading, time, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils.textrank import summarize_sentences
+
+class _State:
+    latency = 0.3
+    requests = 0
+    lock = threading.Lock()
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive: العميل يعيد استخدام الاتصال
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code: int, obj: dict):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            return self._send(200, {"requests": _State.requests})
+        self._send(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send(404, {"error": {"message": "not found"}})
+        size = int(self.headers.get("Content-Length") or 0)
+        try:
+            req = json.loads(self.rfile.read(size) or b"{}")
+        except ValueError:
+            return self._send(400, {"error": {"message": "invalid json"}})
+        with _State.lock:
+            _State.requests += 1
+        user = "\n".join(m.get("content", "") for m in req.get("messages", []) if m.get("role") == "user")
+        time.sleep(_State.latency)
+        top = summarize_sentences([user], n=5, min_len=10)
+        text = "\n".join(f"- {s}" for s in top) or user[:400]
+        self._send(200, {
+            "id": "chatcmpl-" + uuid.uuid4().hex[:12],
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": req.get("model", "local"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": text}}],
+            "usage": {"prompt_tokens": len(user.split()), "completion_tokens": len(text.split()),
+                      "total_tokens": len(user.split()) + len(text.split())},
+        })
+
+def serve(host: str = "127.0.0.1", port: int = 8089, latency: float = 0.3) -> ThreadingHTTPServer:
+    """يشغّل الخادم في خيط خلفي ويعيده (يُستخدم أيضاً من سكربت القياس)"""
+    _State.latency = latency
+    srv = ThreadingHTTPServer((host, port), Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency", type=float, default=0.3)
+    args = ap.parse_args()
+    srv = serve(args.host, args.port, args.latency)
+    print(f"🤖 fake LLM on http://{args.host}:{args.port}/v1 (latency {args.latency}s)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        srv.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-import os
+import os, sys
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
@@ -14,6 +14,21 @@ def gen_fernet_key():
     print("FERNET_KEY (base64) saved to:", path)
     print(key.decode())
 
+def rotate_fernet_key():
+    # مفتاح جديد في أول السطر (الأساسي) والقديمة بعده للفك فقط حتى تنتهي crypto.sweep
+    path = os.path.join(OUT_DIR, "fernet.key")
+    old = []
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            old = [k.strip() for k in f.read().split() if k.strip()]
+    key = Fernet.generate_key().decode()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join([key] + old) + "\n")
+    print("New primary FERNET_KEY saved to:", path, f"({len(old)} old key(s) kept for decryption)")
+    print("FERNET_KEY=" + key)
+    if old:
+        print("FERNET_OLD_KEYS=" + ",".join(old))
+
 def gen_rsa_keys():
     private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
     priv_pem = private_key.private_bytes(
@@ -32,6 +47,9 @@ def gen_rsa_keys():
     print("RSA keys saved to:", OUT_DIR)
 
 if __name__ == "__main__":
+    if "--rotate" in sys.argv:
+        rotate_fernet_key()
+        sys.exit(0)
     gen_fernet_key()
     gen_rsa_keys()
     print("Done. انسخ قيمة FERNET_KEY وأضفها إلى Secrets في Replit أو إلى .env")
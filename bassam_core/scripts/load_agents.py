@@ -0,0 +1,157 @@
+# محاكاة أسطول وكلاء ضد خادم محلي وقياس عاصفة إعادة الاتصال بعد إعادة تشغيله.
+# الخادم يُشغَّل كعملية فرعية (uvicorn على app أدناه) ثم يُقتل ويعاد تشغيله بعد --downtime،
+# ونقيس: متى عاد كل الأسطول، ذروة محاولات الاتصال في الثانية، وعدد المحاولات الفاشلة.
+# --strategy jitter = سياسة الوكيل الحالية (تراجع أسّي + ارتعاش كامل)
+# --strategy fixed  = السلوك القديم (انتظار ثابت ثم إعادة المحاولة معاً)
+# الاستخدام (من مجلد bassam_core): python -m scripts.load_agents [--agents 2000] [--downtime 5]
+import argparse, asyncio, json, os, resource, subprocess, sys, tempfile, time
+from collections import Counter
+import websockets
+
+from fastapi import FastAPI
+from app.devices_api import router as devices_router
+from app.devices_ws import router as devices_ws_router
+from agent.agent import backoff_delay
+
+# تطبيق يحمل مسارات الأجهزة فقط (يشغّله الخادم الفرعي)
+app = FastAPI()
+app.include_router(devices_router, prefix="/api")
+app.include_router(devices_ws_router)
+
+TOKEN = "load-test-token"
+
+class Stats:
+    def __init__(self, n: int):
+        self.n = n
+        self.connected = set()
+        self.attempts = []          # توقيت كل محاولة اتصال
+        self.failures = 0
+        self.all_up = asyncio.Event()
+        self.stop = False
+
+    def up(self, i: int):
+        self.connected.add(i)
+        if len(self.connected) == self.n:
+            self.all_up.set()
+
+    def down(self, i: int):
+        self.connected.discard(i)
+        self.all_up.clear()
+
+async def sim_agent(i: int, url: str, st: Stats, args):
+    """وكيل خفيف بنفس بروتوكول التسجيل والنبض وسياسة إعادة الاتصال"""
+    attempt = 0
+    while not st.stop:
+        st.attempts.append(time.monotonic())
+        registered = False
+        try:
+            async with websockets.connect(url, open_timeout=10, ping_interval=None, compression=None) as ws:
+                await ws.send(json.dumps({"device_id": f"load-{i}", "token": TOKEN, "heartbeat": args.ping}))
+                if not json.loads(await ws.recv()).get("ok"):
+                    raise RuntimeError("refused")
+                st.up(i)
+                registered = True
+                attempt = 0
+
+                async def beat():
+                    while True:
+                        await asyncio.sleep(args.ping)
+                        await ws.send(json.dumps({"type": "ping", "ts": time.time()}))
+                pinger = asyncio.create_task(beat())
+                try:
+                    async for _ in ws:
+                        pass
+                finally:
+                    pinger.cancel()
+        except Exception:
+            # انقطاع بعد التسجيل (إعادة تشغيل الخادم) ليس محاولة فاشلة
+            st.failures += not registered
+        st.down(i)
+        if st.stop:
+            return
+        attempt += 1
+        await asyncio.sleep(backoff_delay(attempt, args.base, args.cap) if args.strategy == "jitter"
+                            else args.fixed_delay)
+
+def start_server(port: int, tmp: str) -> subprocess.Popen:
+    env = {**os.environ, "DEVICE_SHARED_TOKEN": TOKEN,
+           "CMD_DB_PATH": os.path.join(tmp, "commands.db"),
+           "DEVICE_REGISTRY_PATH": os.path.join(tmp, "devices.db"),
+           "DEVICE_ROUTER_DIR": os.path.join(tmp, "router")}
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "scripts.load_agents:app", "--port", str(port),
+                             "--log-level", "warning", "--backlog", "4096"], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+async def wait_port(port: int, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, w = await asyncio.open_connection("127.0.0.1", port)
+            w.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError("server did not start")
+
+def histogram(times, t0: float, until: float, bucket: float):
+    c = Counter(int((t - t0) // bucket) for t in times if t0 <= t <= until)
+    return [c.get(b, 0) for b in range(int((until - t0) // bucket) + 1)]
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--agents", type=int, default=2000)
+    ap.add_argument("--downtime", type=float, default=5.0)
+    ap.add_argument("--strategy", choices=("jitter", "fixed"), default="jitter")
+    ap.add_argument("--fixed-delay", type=float, default=15.0)
+    ap.add_argument("--base", type=float, default=1.0)
+    ap.add_argument("--cap", type=float, default=30.0)
+    ap.add_argument("--ping", type=float, default=20.0)
+    ap.add_argument("--port", type=int, default=8765)
+    args = ap.parse_args()
+
+    # كل وكيل = مقبس عند العميل وآخر عند الخادم
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    if hard < args.agents * 2 + 100:
+        print(f"⚠️ open-file limit {hard} is low for {args.agents} agents")
+
+    url = f"ws://127.0.0.1:{args.port}/ws/device"
+    with tempfile.TemporaryDirectory() as tmp:
+        srv = start_server(args.port, tmp)
+        try:
+            await wait_port(args.port)
+            st = Stats(args.agents)
+            t0 = time.monotonic()
+            agents = [asyncio.create_task(sim_agent(i, url, st, args)) for i in range(args.agents)]
+            await asyncio.wait_for(st.all_up.wait(), 300)
+            print(f"cold start: {args.agents} agents registered in {time.monotonic() - t0:.2f}s "
+                  f"({len(st.attempts)} attempts, {st.failures} failed)")
+
+            # إعادة تشغيل الخادم: الأسطول كله يفقد الاتصال في نفس اللحظة
+            n_attempts, n_fail = len(st.attempts), st.failures
+            srv.kill()
+            srv.wait()
+            killed = time.monotonic()
+            await asyncio.sleep(args.downtime)
+            srv = start_server(args.port, tmp)
+            await wait_port(args.port)
+            back = time.monotonic()
+            await asyncio.wait_for(st.all_up.wait(), 600)
+            done = time.monotonic()
+            after = histogram(st.attempts[n_attempts:], back, done, 1.0)
+            print(f"restart ({args.strategy}, downtime {args.downtime:.0f}s): all {args.agents} back "
+                  f"{done - back:.2f}s after the server returned ({done - killed:.2f}s after the crash)")
+            print(f"  reconnect attempts: {len(st.attempts) - n_attempts} "
+                  f"({st.failures - n_fail} failed), during downtime: "
+                  f"{sum(1 for t in st.attempts[n_attempts:] if t < back)}")
+            print(f"  peak attempts/s after restart: {max(after) if after else 0}")
+            print(f"  attempts per second after restart: {after[:30]}")
+        finally:
+            st.stop = True
+            srv.kill()
+            for a in agents:
+                a.cancel()
+            await asyncio.gather(*agents, return_exceptions=True)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,7 +1,11 @@
 from typing import List, Dict
+import os
 import requests
 from bs4 import BeautifulSoup
 
+# التلخيص يقطّع النص الطويل بنفسه (map-reduce)، فالحد هنا للحماية فقط
+FETCH_MAX_CHARS = int(os.environ.get("FETCH_MAX_CHARS", "200000"))
+
 HEADERS = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124 Safari/537.36"}
 
 def ddg_search(query: str, max_results: int = 5) -> List[Dict]:
@@ -18,7 +22,7 @@ def ddg_search(query: str, max_results: int = 5) -> List[Dict]:
         results.append({"title": title, "url": href})
     return results
 
-def fetch_page(url: str, max_len: int = 20000) -> str:
+def fetch_page(url: str, max_len: int = FETCH_MAX_CHARS) -> str:
     r = requests.get(url, headers=HEADERS, timeout=25)
     r.raise_for_status()
     soup = BeautifulSoup(r.text, "html.parser")
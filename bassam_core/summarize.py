@@ -1,34 +1,160 @@
-import os
-from typing import List
-from textwrap import shorten
+import os, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from utils.textnorm import clip_sentences, split_sentences
+from utils.textrank import summarize_sentences
+from utils.llm_client import LLM_MODEL, llm, llm_available
 
-# اختياري: استخدام OpenAI لو توفر المفتاح
-USE_OPENAI = bool(os.environ.get("OPENAI_API_KEY"))
-MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+# اختياري: استخدام نموذج لغة لو توفر المفتاح (أو خادم محلي عبر LLM_BACKEND=local)
+USE_OPENAI = llm_available()
+MODEL = LLM_MODEL
+SYSTEM_PROMPT = "لخّص المحتوى بإيجاز مع نقاط مرقمة ومصادر عند توفرها."
+
+# ==== map-reduce ====
+CHUNK_CHARS = int(os.environ.get("SUMMARY_CHUNK_CHARS", "6000"))     # ميزانية كل مقطع في مرحلة map
+REDUCE_CHARS = int(os.environ.get("SUMMARY_REDUCE_CHARS", "12000"))  # ميزانية مدخلات مرحلة reduce
+MAP_CONCURRENCY = int(os.environ.get("SUMMARY_CONCURRENCY", "4"))
+CACHE_DIR = Path(os.environ.get("PERSIST_DIR") or os.path.join(os.path.dirname(__file__), "data")).resolve() / "summary_cache"
+
+def _messages(prompt: str) -> List[Dict]:
+    return [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
 
 def _openai_summarize(prompt: str) -> str:
-    from openai import OpenAI
-    client = OpenAI()
-    resp = client.chat.completions.create(
-        model=MODEL,
-        messages=[{"role": "system", "content": "لخّص المحتوى بإيجاز مع نقاط مرقمة ومصادر عند توفرها."},
-                  {"role": "user", "content": prompt}],
-        temperature=0.2,
-        max_tokens=600,
-    )
-    return resp.choices[0].message.content.strip()
+    # عميل مشترك طويل العمر (مهلة، إعادة محاولة، حد توازي، كاش حسب بصمة الطلب)
+    return llm().complete(_messages(prompt))
 
 def _simple_extract(texts: List[str], max_chars: int = 1200) -> str:
-    joined = "\n\n".join(shorten(t.replace("\r", " ").replace("\n", " "), width=600, placeholder="...") for t in texts)
+    # TextRank محلي على كل النصوص معاً؛ إن لم تتوفر جمل كافية نرجع للقص البسيط
+    top = summarize_sentences(texts, n=8)
+    if top:
+        joined = "\n".join(f"- {clip_sentences(s, width=300)}" for s in top)
+    else:
+        joined = "\n\n".join(clip_sentences(t, width=600) for t in texts)
     return joined[:max_chars]
 
-def summarize_chunks(query: str, chunks: List[str]) -> str:
+def split_budget(text: str, budget: int = CHUNK_CHARS) -> List[str]:
+    """تقطيع النص إلى مقاطع لا تتجاوز الميزانية، على حدود الجمل قدر الإمكان"""
+    pieces: List[str] = []
+    cur: List[str] = []
+    size = 0
+    for s in split_sentences(text):
+        if len(s) > budget and cur:       # نُخرج ما قبلها أولاً كي يبقى الترتيب
+            pieces.append(" ".join(cur))
+            cur, size = [], 0
+        while len(s) > budget:            # جملة أطول من الميزانية وحدها
+            pieces.append(s[:budget])
+            s = s[budget:]
+        if size + len(s) + 1 > budget and cur:
+            pieces.append(" ".join(cur))
+            cur, size = [], 0
+        cur.append(s)
+        size += len(s) + 1
+    if cur:
+        pieces.append(" ".join(cur))
+    return pieces
+
+# ==== كاش الملخصات الوسيطة (حسب بصمة المحتوى) ====
+_cache: Dict[str, str] = {}
+_cache_lock = threading.Lock()
+
+def _key(kind: str, text: str) -> str:
+    # المحتوى + النموذج + ميزانية المقطع: نفس الصفحة تحت سؤال آخر لا تُدفع مرتين
+    return hashlib.sha256(f"{kind}|{MODEL if USE_OPENAI else 'local'}|{CHUNK_CHARS}|{text}".encode("utf-8")).hexdigest()
+
+def _cache_get(key: str) -> Optional[str]:
+    with _cache_lock:
+        if key in _cache:
+            return _cache[key]
+    path = CACHE_DIR / key[:2] / f"{key}.txt"
+    if not path.exists():
+        return None
+    out = path.read_text(encoding="utf-8")
+    with _cache_lock:
+        _cache[key] = out
+    return out
+
+def _cache_put(key: str, out: str) -> None:
+    path = CACHE_DIR / key[:2] / f"{key}.txt"
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp.write_text(out, encoding="utf-8")
+        tmp.replace(path)
+    except Exception:
+        pass
+    with _cache_lock:
+        if len(_cache) > 4096:
+            _cache.clear()
+        _cache[key] = out
+
+def _cached(kind: str, text: str, fn: Callable[[], str]) -> str:
+    key = _key(kind, text)
+    out = _cache_get(key)
+    if out is None:
+        out = fn()
+        _cache_put(key, out)
+    return out
+
+def _map_prompt(piece: str) -> str:
+    # بلا السؤال: ملخص المقطع يصلح لأي سؤال لاحق (السؤال يدخل في reduce)
+    return ("استخرج من هذا المقطع أهم المعلومات والحقائق في نقاط قصيرة، بدون مقدمات.\n\n"
+            f"المقطع:\n{piece}")
+
+def _map_one(piece: str) -> str:
+    if USE_OPENAI:
+        return _cached("map", piece, lambda: _openai_summarize(_map_prompt(piece)))
+    return _cached("map", piece, lambda: "\n".join(summarize_sentences([piece], n=5)))
+
+def _map_all(pieces: List[str]) -> List[str]:
+    if USE_OPENAI:
+        # المقاطع غير المخزنة فقط تذهب للعميل دفعة واحدة (يرسلها بالتوازي ويزيل المكرر)
+        keys = [_key("map", p) for p in pieces]
+        out: List[Optional[str]] = [_cache_get(k) for k in keys]
+        miss = [i for i, o in enumerate(out) if o is None]
+        if miss:
+            done = llm().complete_many([_messages(_map_prompt(pieces[i])) for i in miss])
+            for i, text in zip(miss, done):
+                _cache_put(keys[i], text)
+                out[i] = text
+        return out
+    if len(pieces) == 1:
+        return [_map_one(pieces[0])]
+    with ThreadPoolExecutor(max_workers=max(1, MAP_CONCURRENCY)) as ex:
+        return list(ex.map(_map_one, pieces))
+
+def map_reduce(query: str, chunks: List[str]) -> str:
+    """كل المصادر بكامل طولها: map على مقاطع بحجم الميزانية بالتوازي ثم reduce
+    (ويتكرر reduce على مستويات إن بقيت الملخصات الوسيطة أكبر من الميزانية)"""
+    chunks = [c for c in chunks if c and c.strip()] or chunks
+    if sum(len(c) + 7 for c in chunks) <= REDUCE_CHARS:
+        partials = chunks                      # مدخلات صغيرة: reduce مباشرة بلا map
+    else:
+        pieces = [p for c in chunks for p in split_budget(c, CHUNK_CHARS)]
+        partials = _map_all(pieces)
+    while len(partials) > 1 and sum(len(p) + 7 for p in partials) > REDUCE_CHARS:
+        groups: List[List[str]] = [[]]
+        size = 0
+        for p in partials:
+            if size + len(p) > CHUNK_CHARS and groups[-1]:
+                groups.append([])
+                size = 0
+            groups[-1].append(p)
+            size += len(p) + 7
+        if len(groups) == len(partials):      # لا يوجد تقليص ممكن → نكمل بما لدينا
+            break
+        partials = _map_all(["\n\n---\n\n".join(g) for g in groups])
     if USE_OPENAI:
         prompt = f"الموضوع: {query}\n\nلخّص النقاط الأهم بإيجاز (٥-٨ نقاط) ثم اختم بفقرة 'الخلاصة'."
-        prompt += "\n\nالنصوص:\n" + "\n\n---\n\n".join(chunks[:5])
+        prompt += "\n\nالنصوص:\n" + "\n\n---\n\n".join(partials)
+        return _openai_summarize(prompt)
+    return _simple_extract(partials)
+
+def summarize_chunks(query: str, chunks: List[str]) -> str:
+    if USE_OPENAI:
         try:
-            return _openai_summarize(prompt)
+            return map_reduce(query, chunks)
         except Exception as e:
             return f"تلخيص بسيط (سقوط نموذج):\n{_simple_extract(chunks)}\n\n[خطأ النموذج: {e}]"
     else:
-        return "تلخيص سريع (محلي):\n" + _simple_extract(chunks)
+        return "تلخيص سريع (محلي):\n" + map_reduce(query, chunks)
@@ -1,31 +1,153 @@
-import os, json
-from cryptography.fernet import Fernet, InvalidToken
+# bassam_core/utils/crypto.py
+# تشفير متماثل بـ Fernet مع سياق مخزّن وتدوير المفاتيح:
+#   FERNET_KEY       = المفتاح الأساسي (يُشفَّر به كل جديد)؛ يقبل أيضاً قائمة مفصولة بفواصل
+#   FERNET_OLD_KEYS  = مفاتيح سابقة مفصولة بفواصل (فك التشفير فقط حتى تنتهي موجة التدوير)
+#   keys/fernet.key  = بديل عند غياب FERNET_KEY: مفتاح في كل سطر، الأول هو الأساسي
+# السياق (MultiFernet) يُبنى مرة واحدة؛ reload_keys() بعد تغيير المفاتيح.
+import os, json, threading, time
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.asymmetric import padding
 from dotenv import load_dotenv
 load_dotenv()
 FERNET_KEY = os.getenv("FERNET_KEY")
+FERNET_OLD_KEYS = os.getenv("FERNET_OLD_KEYS", "")
+FERNET_KEY_PATH = os.getenv("FERNET_KEY_PATH", "keys/fernet.key")
 RSA_PRIVATE_PATH = os.getenv("RSA_PRIVATE_PATH", "keys/rsa_private.pem")
 RSA_PUBLIC_PATH  = os.getenv("RSA_PUBLIC_PATH",  "keys/rsa_public.pem")
-def _get_fernet():
-    global FERNET_KEY
-    if not FERNET_KEY:
+
+# (السياق، مفاتيحه بالترتيب) معاً كي لا يُقرن سياق جديد بقائمة مفاتيح قديمة
+_state: Optional[Tuple[MultiFernet, List[Fernet]]] = None
+_ctx_lock = threading.Lock()
+
+def _split(value: str) -> List[str]:
+    return [k.strip() for k in value.replace("\n", ",").split(",") if k.strip()]
+
+def _load_keys() -> List[str]:
+    keys = _split(FERNET_KEY or "")
+    if not keys:
+        try:
+            with open(FERNET_KEY_PATH, "r", encoding="utf-8") as f:
+                keys = _split(f.read())
+        except OSError:
+            pass
+    if not keys:
+        raise RuntimeError("FERNET_KEY not set. Run scripts/generate_keys.py and set FERNET_KEY.")
+    # الأساسي أولاً ثم القديمة بلا تكرار
+    return list(dict.fromkeys(keys + _split(FERNET_OLD_KEYS)))
+
+def _snapshot() -> Tuple[MultiFernet, List[Fernet]]:
+    global _state
+    with _ctx_lock:
+        if _state is None:
+            fernets = [Fernet(k.encode()) for k in _load_keys()]
+            _state = (MultiFernet(fernets), fernets)
+        return _state
+
+def context() -> MultiFernet:
+    """سياق التشفير المخزّن: يشفّر بالأساسي ويفك بأي مفتاح معروف"""
+    return _snapshot()[0]
+
+def context_for(proof: str, expected: bytes) -> Optional[MultiFernet]:
+    """سياق يشفّر بالمفتاح الذي أثبت الطرف الآخر امتلاكه (proof = expected مشفراً به).
+    أثناء التدوير يبقى وكيل على المفتاح القديم قادراً على فك ما نرسله؛ None إن لم يطابق أي مفتاح."""
+    ctx, fernets = _snapshot()
+    token = proof.encode() if isinstance(proof, str) else proof
+    for i, f in enumerate(fernets):
         try:
-            with open("keys/fernet.key","rb") as f:
-                FERNET_KEY = f.read().strip().decode()
-        except:
-            raise RuntimeError("FERNET_KEY not set. Run scripts/generate_keys.py and set FERNET_KEY.")
-    key = FERNET_KEY.encode() if isinstance(FERNET_KEY, str) else FERNET_KEY
-    return Fernet(key)
+            if f.decrypt(token) != expected:
+                continue
+        except InvalidToken:
+            continue
+        return ctx if i == 0 else MultiFernet([f] + fernets[:i] + fernets[i + 1:])
+    return None
+
+def reload_keys() -> None:
+    """إعادة قراءة المفاتيح (بعد تعديل المتغيرات أو الملف)"""
+    global _state, FERNET_KEY, FERNET_OLD_KEYS
+    with _ctx_lock:
+        FERNET_KEY = os.getenv("FERNET_KEY")
+        FERNET_OLD_KEYS = os.getenv("FERNET_OLD_KEYS", "")
+        _state = None
+
+def key_count() -> int:
+    return len(_snapshot()[1])
+
+# توافق مع الاستدعاءات القديمة (قناة الأجهزة): نفس الواجهة encrypt/decrypt
+def _get_fernet():
+    return context()
+
+def _dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
 def encrypt_json(obj: dict) -> str:
-    f = _get_fernet()
-    raw = json.dumps(obj, ensure_ascii=False).encode()
-    token = f.encrypt(raw)
-    return token.decode()
+    return context().encrypt(_dumps(obj)).decode()
+
 def decrypt_json(token: str) -> dict:
-    f = _get_fernet()
     try:
-        raw = f.decrypt(token.encode())
+        raw = context().decrypt(token.encode())
         return json.loads(raw.decode())
     except InvalidToken as e:
         raise RuntimeError("Invalid token or wrong key.") from e
+
+# ==== دفعات ====
+def encrypt_many(objs: Iterable[Any]) -> List[str]:
+    """تشفير دفعة بسياق واحد وطابع زمني واحد"""
+    f, now = context(), int(time.time())
+    return [f.encrypt_at_time(_dumps(o), now).decode() for o in objs]
+
+def decrypt_many(tokens: Iterable[str], strict: bool = True) -> List[Any]:
+    """فك دفعة؛ strict=False يعيد None للرمز غير الصالح بدل إيقاف الدفعة كلها"""
+    f = context()
+    out: List[Any] = []
+    for t in tokens:
+        try:
+            out.append(json.loads(f.decrypt(t.encode() if isinstance(t, str) else t)))
+        except (InvalidToken, ValueError) as e:
+            if strict:
+                raise RuntimeError("Invalid token or wrong key.") from e
+            out.append(None)
+    return out
+
+# ==== تدوير المفاتيح ====
+def rotate_many(tokens: Iterable[str]) -> List[Optional[str]]:
+    """إعادة تشفير رموز قديمة بالمفتاح الأساسي (المحتوى وتاريخه الأصلي كما هما)؛ None لغير الصالح"""
+    f = context()
+    out: List[Optional[str]] = []
+    for t in tokens:
+        try:
+            out.append(f.rotate(t.encode() if isinstance(t, str) else t).decode())
+        except InvalidToken:
+            out.append(None)
+    return out
+
+def sweep(rows: Iterable[Tuple[Any, str]], save: Callable[[List[Tuple[Any, str]]], None],
+          batch: int = 500) -> dict:
+    """موجة تدوير على سجلات مخزنة: rows = (معرّف، رمز)، وsave يكتب كل دفعة (معرّف، رمز جديد).
+    بعد انتهائها بلا فشل يمكن حذف المفاتيح القديمة من FERNET_OLD_KEYS."""
+    stats = {"rotated": 0, "failed": 0, "failed_ids": []}
+    buf: List[Tuple[Any, str]] = []
+
+    def flush():
+        ids = [r[0] for r in buf]
+        done = []
+        for rid, new in zip(ids, rotate_many(r[1] for r in buf)):
+            if new is None:
+                stats["failed"] += 1
+                if len(stats["failed_ids"]) < 100:
+                    stats["failed_ids"].append(rid)
+            else:
+                done.append((rid, new))
+        if done:
+            save(done)
+            stats["rotated"] += len(done)
+        buf.clear()
+
+    for row in rows:
+        buf.append(row)
+        if len(buf) >= batch:
+            flush()
+    if buf:
+        flush()
+    return stats
@@ -0,0 +1,126 @@
+# bassam_core/utils/llm_client.py
+# عميل نماذج اللغة المشترك: اتصال واحد طويل العمر، مهلة وإعادة محاولة، حد للتوازي،
+# كاش على القرص حسب بصمة الطلب، وإرسال دفعات بالتوازي.
+#   LLM_BACKEND=openai  → خدمة OpenAI (يتطلب OPENAI_API_KEY)
+#   LLM_BACKEND=local   → خادم محلي يحاكي chat-completions (scripts/fake_llm_server.py)
+import os, json, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "openai").lower()
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL") or ("http://127.0.0.1:8089/v1" if LLM_BACKEND == "local" else None)
+LLM_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "4"))
+LLM_CACHE = os.environ.get("LLM_CACHE", "1") == "1"
+CACHE_DIR = Path(os.environ.get("PERSIST_DIR") or os.path.join(os.path.dirname(__file__), "..", "data")).resolve() / "llm_cache"
+
+def llm_available() -> bool:
+    return LLM_BACKEND == "local" or bool(os.environ.get("OPENAI_API_KEY"))
+
+class LLMClient:
+    def __init__(self, model: str = LLM_MODEL, base_url: Optional[str] = LLM_BASE_URL,
+                 timeout: float = LLM_TIMEOUT, max_retries: int = LLM_MAX_RETRIES,
+                 concurrency: int = LLM_CONCURRENCY, cache_dir: Optional[Path] = CACHE_DIR if LLM_CACHE else None):
+        self.model = model
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.concurrency = max(1, concurrency)
+        self.cache_dir = cache_dir
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self.calls = 0
+        self.cache_hits = 0
+
+    def _get_client(self):
+        with self._client_lock:
+            if self._client is None:
+                from openai import OpenAI
+                kw = {"timeout": self.timeout, "max_retries": self.max_retries}
+                if self.base_url:
+                    kw["base_url"] = self.base_url
+                    kw["api_key"] = os.environ.get("OPENAI_API_KEY") or "local"
+                self._client = OpenAI(**kw)
+            return self._client
+
+    # ---- الكاش ----
+    def _key(self, messages: List[Dict], temperature: float, max_tokens: int) -> str:
+        raw = json.dumps([self.model, self.base_url, messages, temperature, max_tokens],
+                         ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        p = self.cache_dir / key[:2] / f"{key}.txt"
+        try:
+            return p.read_text(encoding="utf-8")
+        except (FileNotFoundError, OSError):
+            return None
+
+    def _cache_put(self, key: str, text: str) -> None:
+        if not self.cache_dir:
+            return
+        p = self.cache_dir / key[:2] / f"{key}.txt"
+        try:
+            p.parent.mkdir(parents=True, exist_ok=True)
+            tmp = p.with_suffix(f".{threading.get_ident()}.tmp")
+            tmp.write_text(text, encoding="utf-8")
+            tmp.replace(p)
+        except OSError:
+            pass
+
+    # ---- الطلبات ----
+    def complete(self, messages: List[Dict], temperature: float = 0.2, max_tokens: int = 600) -> str:
+        key = self._key(messages, temperature, max_tokens)
+        hit = self._cache_get(key)
+        if hit is not None:
+            self.cache_hits += 1
+            return hit
+        with self._slots:
+            resp = self._get_client().chat.completions.create(
+                model=self.model, messages=messages,
+                temperature=temperature, max_tokens=max_tokens,
+            )
+        self.calls += 1
+        text = (resp.choices[0].message.content or "").strip()
+        self._cache_put(key, text)
+        return text
+
+    def complete_many(self, batch: List[List[Dict]], temperature: float = 0.2,
+                      max_tokens: int = 600) -> List[str]:
+        """عدة طلبات بالتوازي (بحدود concurrency)؛ الطلبات المتطابقة تُرسل مرة واحدة"""
+        unique: Dict[str, List[Dict]] = {}
+        keys = []
+        for messages in batch:
+            k = self._key(messages, temperature, max_tokens)
+            keys.append(k)
+            unique.setdefault(k, messages)
+        if len(unique) == 1:
+            out = {k: self.complete(m, temperature, max_tokens) for k, m in unique.items()}
+        else:
+            with self._client_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="llm")
+            futs = {k: self._pool.submit(self.complete, m, temperature, max_tokens) for k, m in unique.items()}
+            out = {k: f.result() for k, f in futs.items()}
+        return [out[k] for k in keys]
+
+    def stats(self) -> Dict:
+        return {"backend": LLM_BACKEND, "base_url": self.base_url, "model": self.model,
+                "calls": self.calls, "cache_hits": self.cache_hits}
+
+_LLM: Optional[LLMClient] = None
+_LLM_LOCK = threading.Lock()
+
+def llm() -> LLMClient:
+    global _LLM
+    with _LLM_LOCK:
+        if _LLM is None:
+            _LLM = LLMClient()
+        return _LLM
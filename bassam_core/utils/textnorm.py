@@ -0,0 +1,151 @@
+# bassam_core/utils/textnorm.py
+# توحيد النص العربي/اللاتيني وتقطيعه + مصنّف النبرة — وحدة مشتركة
+# (مفاتيح الكاش، الفهرسة، التلخيص، وتحليل النبرة كلها تمر من هنا)
+import re, unicodedata
+from functools import lru_cache
+from typing import Dict, Iterable, List, Sequence
+
+# ==== الحروف ====
+_DIACRITICS = re.compile("[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")  # تشكيل + تطويل
+_FOLD = (("أ", "ا"), ("إ", "ا"), ("آ", "ا"), ("ٱ", "ا"), ("ى", "ي"), ("ئ", "ي"),
+         ("ؤ", "و"), ("ة", "ه"), ("٠", "0"), ("١", "1"), ("٢", "2"), ("٣", "3"), ("٤", "4"),
+         ("٥", "5"), ("٦", "6"), ("٧", "7"), ("٨", "8"), ("٩", "9"))
+_NON_WORD = re.compile(r"[^\w]+", re.UNICODE)
+_WORD = re.compile(r"\w+", re.UNICODE)
+_SENT_END = re.compile(r"(?<=[.!?؟؛])\s+|[\r\n]+")
+
+def strip_diacritics(text: str) -> str:
+    return _DIACRITICS.sub("", text or "")
+
+def fold_arabic(text: str) -> str:
+    """توحيد أشكال الألف والهمزة والتاء المربوطة والأرقام الهندية"""
+    # سلسلة replace أسرع بكثير من str.translate على نص غير ASCII
+    text = text or ""
+    for src, dst in _FOLD:
+        if src in text:
+            text = text.replace(src, dst)
+    return text
+
+def normalize(text: str) -> str:
+    """شكل موحّد للمقارنة: بدون تشكيل، حروف موحّدة، أحرف صغيرة، بدون ترقيم"""
+    text = unicodedata.normalize("NFKC", text or "")
+    text = fold_arabic(strip_diacritics(text)).lower()
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+# ==== الكلمات ====
+STOPWORDS = frozenset(normalize(w) for w in """
+من الى إلى عن على في مع هل ما ماذا متى اين أين كيف لماذا كم هو هي هم هذا هذه ذلك تلك
+التي الذي الذين و او أو ثم لا لم لن ان أن إن كان كانت يكون قد كل بعض عند بين حتى
+the a an of to in on for and or is are was were be it this that with as by at from
+what how why when where which who do does
+""".split())
+
+def words(text: str) -> List[str]:
+    """كل كلمات النص بعد التوحيد"""
+    return _WORD.findall(normalize(text))
+
+def tokens(text: str) -> List[str]:
+    """كلمات المحتوى فقط (بدون كلمات الوقف)"""
+    return [w for w in words(text) if w not in STOPWORDS]
+
+# ==== الجمل ====
+def split_sentences(text: str, min_len: int = 0) -> List[str]:
+    """تقسيم على . ! ? ؟ ؛ ونهايات الأسطر مع إبقاء النص الأصلي"""
+    out = []
+    for s in _SENT_END.split(text or ""):
+        s = s.strip()
+        if len(s) > min_len:
+            out.append(s)
+    return out
+
+def clip_sentences(text: str, width: int, placeholder: str = "...") -> str:
+    """أول الجمل حتى الطول المطلوب (بديل textwrap.shorten يحترم حدود الجمل)"""
+    text = " ".join((text or "").split())
+    if len(text) <= width:
+        return text
+    out, n = [], 0
+    for s in split_sentences(text):
+        if n + len(s) + 1 > width - len(placeholder):
+            break
+        out.append(s)
+        n += len(s) + 1
+    if not out:  # جملة أولى أطول من الحد → قص على حدود الكلمات
+        cut = text[:width - len(placeholder)]
+        return cut[:cut.rfind(" ")].rstrip() + placeholder if " " in cut else cut + placeholder
+    return " ".join(out) + " " + placeholder
+
+# ==== مصنّف النبرة ====
+def _trie_pattern(words: Iterable[str]) -> str:
+    """نمط regex على شكل شجرة بادئات: عند كل موضع يتقدّم المحرك حرفاً حرفاً
+    في الشجرة بدل تجربة كل كلمة على حدة (أوتوماتون فعلي بدل بدائل منفصلة)."""
+    trie: Dict = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node: Dict) -> str:
+        end = "" in node
+        alts = [re.escape(ch) + build(child) for ch, child in node.items() if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        # الأطول أولاً: نحاول الإكمال ثم نقبل نهاية الكلمة هنا
+        return ("(?:" + body + ")?") if end else body
+
+    return build(trie)
+
+TONE_LEXICONS: Dict[str, List[str]] = {
+    "supportive": ["حزين","حزن","تعبان","محبط","فشلت","كسرت خاطري","متضايق"],
+    "calm": ["غاضب","زعلان","مستفز","عصّبت","ليش","خطأ","سيء"],
+    "excited": ["رائع","متحمس","فرحان","نجحت","جميل","ممتاز","واو"],
+}
+TONE_PRIORITY = ("supportive", "calm", "excited")
+
+class ToneClassifier:
+    """كل القوائم مُجمّعة في شجرة بادئات واحدة مُترجمة مسبقاً؛ مسح واحد للنص يجد
+    كل التطابقات (بما فيها المتداخلة) ثم تُختار النبرة حسب الأولوية."""
+
+    def __init__(self, lexicons: Dict[str, Sequence[str]], priority: Sequence[str],
+                 default: str = "friendly"):
+        self.priority = {tone: i for i, tone in enumerate(priority)}
+        self.default = default
+        self._tone_of: Dict[str, str] = {}
+        for tone in sorted(lexicons, key=lambda t: -self.priority.get(t, len(priority))):
+            for w in lexicons[tone]:
+                self._tone_of[normalize(w)] = tone   # الأعلى أولوية يكتب أخيراً
+        # وجود كلمة يعني وجود كل كلمة محتواة فيها → تأخذ الأعلى أولوية بينها
+        # (لأن النمط يلتقط أطول بديل فقط عند كل موضع)
+        for w in self._tone_of:
+            for sub, tone in list(self._tone_of.items()):
+                if sub != w and sub in w and self._rank(tone) < self._rank(self._tone_of[w]):
+                    self._tone_of[w] = tone
+        self._pattern = re.compile("(?=(" + _trie_pattern(self._tone_of) + "))")
+        self._top = priority[0] if priority else None
+
+    def classify(self, msg: str) -> str:
+        best, rank = self.default, len(self.priority)
+        for m in self._pattern.finditer(normalize(msg)):
+            tone = self._tone_of[m.group(1)]
+            r = self._rank(tone)
+            if r < rank:
+                best, rank = tone, r
+                if tone == self._top:
+                    break
+        return best
+
+    def _rank(self, tone: str) -> int:
+        return self.priority.get(tone, len(self.priority))
+
+    def classify_many(self, msgs: Iterable[str]) -> List[str]:
+        return [self.classify(m) for m in msgs]
+
+_TONES = ToneClassifier(TONE_LEXICONS, TONE_PRIORITY)
+
+@lru_cache(maxsize=4096)
+def classify_tone(msg: str) -> str:
+    return _TONES.classify(msg)
+
+def classify_tones(msgs: Iterable[str]) -> List[str]:
+    return _TONES.classify_many(msgs)
@@ -0,0 +1,127 @@
+# bassam_core/utils/textrank.py
+# تلخيص استخراجي محلي: TF-IDF + مصفوفة تشابه + PageRank + اختيار MMR (كله بـ NumPy)
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.textnorm import STOPWORDS, normalize, split_sentences
+
+MAX_SENTENCES = 1200   # حد أعلى لعدد الجمل المُرتّبة (ذاكرة مصفوفة التشابه N×N)
+MAX_TERMS = 4096       # حد أعلى للكلمات الشائعة في المسار الكثيف
+HEAVY_DF = 32          # كلمة تظهر في أكثر من هذا العدد من الجمل تُعالج كثيفاً
+
+def _collect(texts: Sequence[str], min_len: int) -> Tuple[List[str], List[str]]:
+    """جمل كل النصوص بالترتيب مع حذف المكرر، بحصة متساوية لكل نص عند تجاوز الحد
+    (تُعاد الصيغة الموحّدة أيضاً كي لا تُوحّد كل جملة مرتين)"""
+    per_text = max(1, MAX_SENTENCES // max(1, len(texts)))
+    seen, out, norm = set(), [], []
+    for t in texts:
+        for s in split_sentences(t, min_len=min_len)[:per_text]:
+            key = normalize(s)
+            if key and key not in seen:
+                seen.add(key)
+                out.append(s)
+                norm.append(key)
+    return out, norm
+
+def _sparse_gram(r: np.ndarray, c: np.ndarray, w: np.ndarray, sizes: np.ndarray, n: int) -> np.ndarray:
+    """X·Xᵀ من المدخلات غير الصفرية مباشرة: لكل كلمة كل أزواج الجمل التي تحتويها"""
+    order = np.argsort(c, kind="stable")
+    r, w = r[order], w[order]
+    d = sizes[sizes > 0].astype(np.int64)
+    if not len(d):
+        return np.zeros((n, n), dtype=np.float32)
+    starts = np.concatenate([[0], np.cumsum(d)[:-1]])
+    sq = d * d
+    g = np.repeat(np.arange(len(d)), sq)
+    k = np.arange(int(sq.sum())) - np.repeat(np.cumsum(sq) - sq, sq)
+    a = starts[g] + k // d[g]
+    b = starts[g] + k % d[g]
+    flat = np.bincount(r[a] * n + r[b], weights=w[a] * w[b], minlength=n * n)
+    return flat.reshape(n, n).astype(np.float32)
+
+def similarity_matrix(sentences: Sequence[str], normalized: Optional[Sequence[str]] = None) -> np.ndarray:
+    """تشابه cosine بين الجمل على أوزان TF-IDF"""
+    n = len(sentences)
+    normalized = normalized if normalized is not None else [normalize(s) for s in sentences]
+    vocab: dict = {}
+    rows, cols = [], []
+    for i, s in enumerate(normalized):
+        for tok in s.split():
+            if tok not in STOPWORDS:
+                rows.append(i)
+                cols.append(vocab.setdefault(tok, len(vocab)))
+    if not rows:
+        return np.zeros((n, n), dtype=np.float32)
+    v = len(vocab)
+    # تكرار كل (جملة، كلمة) مرة واحدة مع عدّاده
+    codes, tf = np.unique(np.asarray(rows, dtype=np.int64) * v + np.asarray(cols, dtype=np.int64),
+                          return_counts=True)
+    r, c = codes // v, codes % v
+    df = np.bincount(c, minlength=v)
+    idf = np.log((1 + n) / (1 + df)) + 1.0
+    w = tf.astype(np.float32) * idf[c].astype(np.float32)
+    # الطول يُحسب من كل الكلمات، لكن التشابه يحتاج فقط الكلمات المشتركة بين جملتين على الأقل
+    norms = np.sqrt(np.bincount(r, weights=w * w, minlength=n)).astype(np.float32)
+    norms[norms == 0] = 1.0
+    w /= norms[r]
+    keep = df[c] >= 2
+    r, c, w = r[keep], c[keep], w[keep]
+    sizes = np.bincount(c, minlength=v)
+    # الكلمات الشائعة (في جمل كثيرة) → ضرب مصفوفات كثيف؛ البقية → أزواج متفرقة
+    heavy = sizes > HEAVY_DF
+    light = ~heavy[c]
+    sim = _sparse_gram(r[light], c[light], w[light], np.where(heavy, 0, sizes), n)
+    if heavy.any():
+        cols_h = np.flatnonzero(heavy)
+        cols_h = cols_h[np.argsort(-sizes[cols_h], kind="stable")[:MAX_TERMS]]
+        col_of = np.full(v, -1, dtype=np.int64)
+        col_of[cols_h] = np.arange(len(cols_h))
+        sel = col_of[c] >= 0
+        x = np.zeros((n, len(cols_h)), dtype=np.float32)
+        x[r[sel], col_of[c[sel]]] = w[sel]
+        sim += x @ x.T
+    np.fill_diagonal(sim, 0.0)
+    return sim
+
+def pagerank(sim: np.ndarray, damping: float = 0.85, iters: int = 100, tol: float = 1e-6) -> np.ndarray:
+    n = sim.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=np.float32)
+    out = sim.sum(axis=1, keepdims=True)
+    # جملة بلا روابط توزّع وزنها بالتساوي
+    trans = np.where(out > 0, sim / np.where(out > 0, out, 1), 1.0 / n).astype(np.float32)
+    rank = np.full(n, 1.0 / n, dtype=np.float32)
+    for _ in range(iters):
+        new = (1 - damping) / n + damping * (trans.T @ rank)
+        if np.abs(new - rank).sum() < tol:
+            return new
+        rank = new
+    return rank
+
+def mmr_select(scores: np.ndarray, sim: np.ndarray, k: int, lam: float = 0.7) -> List[int]:
+    """Maximal Marginal Relevance: أهمية عالية مع تقليل التكرار مع ما اختير"""
+    n = len(scores)
+    if n == 0 or k <= 0:
+        return []
+    rel = scores / (scores.max() or 1.0)
+    max_sim = np.zeros(n, dtype=np.float32)
+    chosen = np.zeros(n, dtype=bool)
+    picked: List[int] = []
+    for _ in range(min(k, n)):
+        gain = lam * rel - (1 - lam) * max_sim
+        gain[chosen] = -np.inf
+        i = int(np.argmax(gain))
+        picked.append(i)
+        chosen[i] = True
+        max_sim = np.maximum(max_sim, sim[:, i])
+    return picked
+
+def summarize_sentences(texts: Sequence[str], n: int = 6, lam: float = 0.7, min_len: int = 20) -> List[str]:
+    """أهم n جمل من مجموعة نصوص، بترتيب ظهورها الأصلي"""
+    sentences, normalized = _collect([t for t in texts if t], min_len)
+    if len(sentences) <= n:
+        return sentences
+    sim = similarity_matrix(sentences, normalized)
+    picked = mmr_select(pagerank(sim), sim, n, lam)
+    return [sentences[i] for i in sorted(picked)]
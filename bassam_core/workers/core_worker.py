@@ -11,17 +11,26 @@ import os
 import json
 import time
 import threading
+import uuid
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Optional
 from duckduckgo_search import DDGS
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - ويندوز: عملية واحدة
+    fcntl = None
+
+from .events import publish
+
 # ==== إعداد المسارات ====
 ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
 DATA_DIR = os.path.join(ROOT_DIR, "data")
 os.makedirs(DATA_DIR, exist_ok=True)
 
 NEWS_PATH = os.path.join(DATA_DIR, "news.jsonl")
-QUEUE_PATH = os.path.join(DATA_DIR, "queue.jsonl")
+QUEUE_PATH = os.path.join(DATA_DIR, "queue.jsonl")            # سجل كل ما طُلب
+PENDING_PATH = os.path.join(DATA_DIR, "queue.pending.jsonl")  # ما لم يتعلّمه القائد بعد
 KNOW_PATH = os.path.join(DATA_DIR, "knowledge.jsonl")
 
 # ==== إعداد الجدولة ====
@@ -52,31 +61,70 @@ def _read_jsonl(path: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
     return [json.loads(x) for x in lines]
 
 # ==== صفّ الطلبات ====
+# الصف مشترك بين عمّال uvicorn: ملف تحت flock؛ أي عامل يضيف والقائد وحده يفرّغ
 _queue_lock = threading.Lock()
-_queue: List[Dict[str, Any]] = []
-_running = threading.Event()
+_cycling = threading.Event()   # دورة تعلّم قيد التنفيذ الآن (في هذه العملية)
+
+def _with_pending(fn: Callable[[Any], Any]) -> Any:
+    with _queue_lock:
+        fd = os.open(PENDING_PATH, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            with os.fdopen(fd, "r+", encoding="utf-8", closefd=False) as f:
+                return fn(f)
+        finally:
+            os.close(fd)   # الإغلاق يحرر القفل
+
+def _pending_items(f) -> List[Dict[str, Any]]:
+    f.seek(0)
+    out = []
+    for line in f.read().splitlines():
+        try:
+            out.append(json.loads(line))
+        except ValueError:
+            continue   # سطر مبتور من عملية ماتت أثناء الكتابة
+    return out
+
+def _push(f, item: Dict[str, Any]) -> None:
+    f.seek(0, os.SEEK_END)
+    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+def _take_all(f) -> List[Dict[str, Any]]:
+    items = _pending_items(f)
+    f.seek(0)
+    f.truncate()
+    return items
 
 def enqueue_task(q: str) -> None:
     item = {"q": q.strip(), "ts": datetime.utcnow().isoformat()}
     if not item["q"]:
         return
-    with _queue_lock:
-        _queue.append(item)
+    _with_pending(lambda f: _push(f, item))
     _append_jsonl(QUEUE_PATH, item)
+    publish("state", get_status())
 
 def query_index() -> List[str]:
-    with _queue_lock:
-        return [x["q"] for x in _queue[-15:]]
+    return [x["q"] for x in _with_pending(_pending_items)[-15:]]
 
 def get_status() -> Dict[str, Any]:
+    # running/cycling من القيادة المشتركة لا من أعلام هذه العملية: أي عامل يجيب نفس الجواب
+    lease = _LEADER.status() if _LEADER else None
+    running = bool(lease and lease["running"])
     return {
-        "running": _running.is_set(),
+        "running": running,
+        "cycling": _cycling.is_set() or bool(running and lease["holder"].get("cycling")),
         "interval_min": INTERVAL_MIN,
         "interval_sec": INTERVAL_SEC,
-        "queue_size": len(_queue),
+        "queue_size": len(_with_pending(_pending_items)),
         "topics": TOPICS,
+        "leader": lease,
     }
 
+def lease_held() -> bool:
+    """هل يعمل قائد الآن في أي عامل (فحص قفل خفيف بلا قراءة الصف)"""
+    return bool(_LEADER and _LEADER.lease_held())
+
 def get_latest_results(limit: int = 10) -> List[Dict[str, Any]]:
     docs = _read_jsonl(NEWS_PATH, limit=limit)
     return list(reversed(docs))
@@ -136,11 +184,15 @@ def do_search(q: str, source: str = "auto", max_results: int = 8) -> List[Dict[s
     return results
 
 # ==== دالة التعلّم الفوري (المطلوبة من api.py) ====
-def learn_from_query(q: str, source: str = "auto") -> Dict[str, Any]:
+def learn_from_query(q: str, source: str = "auto",
+                     progress: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+    if progress:
+        progress("search", query=q, source=source)
     docs = do_search(q, source=source, max_results=10)
     summary = "📘 ملخص حول «{}»:\n".format(q)
     summary += "\n".join([f"- {d['title']}: {d.get('snippet','')[:150]}" for d in docs[:5]])
     record = {
+        "id": f"{int(time.time())}-{uuid.uuid4().hex[:8]}",
         "query": q,
         "summary": summary,
         "timestamp": datetime.utcnow().isoformat(),
@@ -148,30 +200,60 @@ def learn_from_query(q: str, source: str = "auto") -> Dict[str, Any]:
     }
     _append_jsonl(NEWS_PATH, record)
     _append_jsonl(KNOW_PATH, record)
+    _index_record(record)
+    # دفع السجل الجديد للوحات المفتوحة (بدل استطلاع news.jsonl)
+    publish("doc", {**record, "results": docs[:3]})
+    if progress:
+        progress("learned", query=q, count=len(docs))
     return {"learned": len(docs), "docs": docs[:5]}
 
+# ==== فهرسة المعرفة (متجهات) ====
+def _index_record(record: Dict[str, Any]) -> None:
+    try:
+        from .vector_store import knowledge_store, embed_text
+        knowledge_store().add(record["id"], embed_text(record["query"] + "\n" + record["summary"]),
+                              {"query": record["query"], "timestamp": record["timestamp"]})
+    except Exception as e:
+        print("⚠️ Vector index error:", e)
+
+def search_knowledge(q: str, k: int = 5) -> List[Dict[str, Any]]:
+    from .vector_store import knowledge_store, embed_text
+    hits = knowledge_store().search(embed_text(q), k=k)
+    return [{"id": rid, "score": round(score, 4), **meta} for rid, score, meta in hits]
+
 # ==== دورة التعلّم ====
-def _drain_queue() -> int:
+def _drain_queue(progress: Optional[Callable[..., None]] = None) -> int:
     count = 0
-    global _queue
-    with _queue_lock:
-        if not _queue:
-            return 0
-        batch = _queue[:]
-        _queue = []
+    batch = _with_pending(_take_all)
     for item in batch:
         learn_from_query(item["q"])
         count += 1
+        if progress:
+            progress("queue", done=count, total=len(batch), query=item["q"])
     return count
 
-def run_cycle_once(custom_topics: Optional[List[str]] = None) -> Dict[str, Any]:
+def run_cycle_once(custom_topics: Optional[List[str]] = None,
+                   progress: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+    """دورة كاملة؛ progress(stage, **data) اختياري لمتابعة التقدّم (المهام الخلفية)"""
     print(f"🔁 Auto-learning cycle @ {datetime.utcnow().isoformat()}")
-    done_from_queue = _drain_queue()
-    topics = custom_topics if custom_topics else TOPICS
-    done_from_topics = 0
-    for topic in topics:
-        learn_from_query(topic)
-        done_from_topics += 1
+    _cycling.set()
+    if _LEADER:
+        _LEADER.update(cycling=True)
+    publish("state", get_status())
+    try:
+        done_from_queue = _drain_queue(progress)
+        topics = custom_topics if custom_topics else TOPICS
+        done_from_topics = 0
+        for topic in topics:
+            learn_from_query(topic)
+            done_from_topics += 1
+            if progress:
+                progress("topic", done=done_from_topics, total=len(topics), query=topic)
+    finally:
+        _cycling.clear()
+        if _LEADER:
+            _LEADER.update(cycling=False)
+        publish("state", get_status())
     msg = f"✅ Cycle complete — queue:{done_from_queue}, topics:{done_from_topics}"
     print(msg)
     return {"queue": done_from_queue, "topics": done_from_topics, "message": msg}
@@ -211,12 +293,22 @@ class Scheduler:
         run_cycle_once()
 
 _SCHED: Optional[Scheduler] = None
+_LEADER = None
+LEADER_LOCK = os.path.join(DATA_DIR, "scheduler.lock")
 
-def start_scheduler() -> None:
+def _become_leader() -> None:
     global _SCHED
-    if _SCHED:
-        return
-    _running.set()
     _SCHED = Scheduler()
     _SCHED.start()
+    publish("state", get_status())
     print("🔥 Worker linked to Scheduler and running.")
+
+def start_scheduler() -> None:
+    """مع --workers N: عملية واحدة فقط تشغّل الدورات (قفل flock)؛
+    البقية تخدم القراءات وتعيد المحاولة لتتولى عند سقوط القائد"""
+    global _LEADER
+    if _LEADER:
+        return
+    from .leader import Leader
+    _LEADER = Leader(LEADER_LOCK, on_elected=_become_leader)
+    _LEADER.start()
@@ -0,0 +1,89 @@
+# bassam_core/workers/events.py
+# -*- coding: utf-8 -*-
+"""
+📣 ناقل أحداث داخل العملية
+- العمّال (خيوط عادية) ينشرون: publish("doc", {...}) أو publish("state", {...}).
+- كل مشترك (اتصال SSE) له طابور asyncio محدود على حلقته الخاصة؛
+  التسليم عبر loop.call_soon_threadsafe فلا يتوقف الناشر أبداً.
+- مشترك بطيء يمتلئ طابوره: نفرغه ونضع حدث resync واحد → يعيد العميل
+  تحميل اللقطة بدل تراكم الرسائل في الذاكرة.
+"""
+
+import os
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional
+
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+
+class Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int = EVENTS_QUEUE_SIZE):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def _offer(self, event: Dict[str, Any]) -> None:
+        # يعمل على حلقة المشترك
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"topic": "resync", "data": {"dropped": self.dropped}})
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """الحدث التالي، أو None عند انتهاء المهلة (للنبض)"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+class EventBus:
+    def __init__(self):
+        self._subs: List[Subscriber] = []
+        self._lock = threading.Lock()
+        self._versions: Dict[str, int] = {}
+        self.published = 0
+
+    def subscribe(self, maxsize: int = EVENTS_QUEUE_SIZE) -> Subscriber:
+        """يُستدعى من داخل حلقة asyncio (مسار SSE)"""
+        sub = Subscriber(asyncio.get_running_loop(), maxsize)
+        with self._lock:
+            self._subs.append(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        with self._lock:
+            if sub in self._subs:
+                self._subs.remove(sub)
+
+    def publish(self, topic: str, data: Any) -> int:
+        """آمن من أي خيط؛ يعيد عدد المشتركين الذين وُجّه لهم الحدث"""
+        event = {"topic": topic, "data": data}
+        with self._lock:
+            subs = list(self._subs)
+            self.published += 1
+            self._versions[topic] = self._versions.get(topic, 0) + 1
+        sent = 0
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._offer, event)
+                sent += 1
+            except RuntimeError:      # الحلقة أُغلقت → اشتراك ميت
+                self.unsubscribe(sub)
+        return sent
+
+    def version(self, topic: str) -> int:
+        """عدد مرات النشر على الموضوع: يتغير مع كل تعديل (يُستخدم في ETag)"""
+        return self._versions.get(topic, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"subscribers": len(self._subs), "published": self.published,
+                    "dropped": sum(s.dropped for s in self._subs)}
+
+BUS = EventBus()
+
+def publish(topic: str, data: Any) -> int:
+    return BUS.publish(topic, data)
@@ -0,0 +1,250 @@
+# bassam_core/workers/jobs.py
+# -*- coding: utf-8 -*-
+"""
+🧵 المهام الخلفية (jobs)
+- الطلب الطويل (دورة تعلّم، بحث + تلخيص) يُسلَّم لمنفّذ محدود ويعود فوراً بمعرّف.
+- كل مهمة تسجّل أحداث تقدّم مرقّمة يمكن متابعتها (GET /jobs/{id} أو SSE).
+- الحالة والأحداث في SQLite مشترك (data/jobs.db): أي عامل uvicorn يجيب عن أي مهمة.
+- المهام المنتهية تُحذف بعد JOBS_RETENTION_SEC أو عند تجاوز JOBS_MAX_KEPT.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))            # مهام تعمل بالتوازي
+JOBS_MAX_PENDING = int(os.getenv("JOBS_MAX_PENDING", "32"))   # حد المهام المنتظرة + العاملة (لكل عامل)
+JOBS_RETENTION_SEC = int(os.getenv("JOBS_RETENTION_SEC", "3600"))
+JOBS_MAX_KEPT = int(os.getenv("JOBS_MAX_KEPT", "200"))
+JOBS_MAX_EVENTS = 200                                           # أحداث التقدّم المحفوظة لكل مهمة
+
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+DATA_DIR = os.path.join(ROOT_DIR, "data")
+os.makedirs(DATA_DIR, exist_ok=True)
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(DATA_DIR, "jobs.db"))
+
+FINAL = ("done", "error")
+_HOST = socket.gethostname()
+
+class JobsBusy(RuntimeError):
+    """المنفّذ ممتلئ: على العميل المحاولة لاحقاً"""
+
+# ==== المخزن ====
+_local = threading.local()
+_init_lock = threading.Lock()
+_ready = False
+
+def _conn() -> sqlite3.Connection:
+    # اتصال لكل خيط (WAL: قراءات المتابعين لا تنتظر كاتب التقدّم)
+    c = getattr(_local, "conn", None)
+    if c is None:
+        c = sqlite3.connect(JOBS_DB_PATH, timeout=10, isolation_level=None)
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("PRAGMA synchronous=NORMAL")
+        c.row_factory = sqlite3.Row
+        _local.conn = c
+    if not _ready:
+        _init(c)
+    return c
+
+def _init(c: sqlite3.Connection) -> None:
+    global _ready
+    with _init_lock:
+        if _ready:
+            return
+        c.execute("""CREATE TABLE IF NOT EXISTS jobs(
+            id TEXT PRIMARY KEY, kind TEXT NOT NULL, params TEXT, status TEXT NOT NULL,
+            result TEXT, error TEXT, created REAL NOT NULL, started REAL, finished REAL,
+            pid INTEGER, host TEXT)""")
+        c.execute("""CREATE TABLE IF NOT EXISTS job_events(
+            job_id TEXT NOT NULL, seq INTEGER NOT NULL, event TEXT NOT NULL,
+            PRIMARY KEY(job_id, seq))""")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs(created)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(finished) WHERE finished IS NOT NULL")
+        _ready = True
+
+def _dump(v: Any) -> Optional[str]:
+    return None if v is None else json.dumps(v, ensure_ascii=False, default=str)
+
+def _load(v: Optional[str]) -> Any:
+    return None if v is None else json.loads(v)
+
+def _write(fn: Callable[[sqlite3.Connection], Any]) -> Any:
+    c = _conn()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        out = fn(c)
+        c.execute("COMMIT")
+    except Exception:
+        c.execute("ROLLBACK")
+        raise
+    return out
+
+class Job:
+    """مقبض المهمة في العملية التي تنفّذها؛ كل ما يراه الآخرون يمر عبر المخزن"""
+    def __init__(self, kind: str, params: Optional[Dict[str, Any]] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params or {}
+        self.status = "queued"
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    # ---- التقدّم ----
+    def _event(self, c: sqlite3.Connection, stage: str, **data: Any) -> None:
+        self._seq += 1
+        ev = {"seq": self._seq, "stage": stage, "ts": time.time(), **data}
+        c.execute("INSERT INTO job_events(job_id, seq, event) VALUES(?,?,?)", (self.id, self._seq, _dump(ev)))
+        if self._seq > JOBS_MAX_EVENTS:
+            c.execute("DELETE FROM job_events WHERE job_id=? AND seq<=?", (self.id, self._seq - JOBS_MAX_EVENTS))
+
+    def progress(self, stage: str, **data: Any) -> None:
+        with self._lock:
+            _write(lambda c: self._event(c, stage, **data))
+
+    def _start(self) -> None:
+        with self._lock:
+            self.status = "running"
+            _write(lambda c: (c.execute("UPDATE jobs SET status='running', started=? WHERE id=?", (time.time(), self.id)),
+                              self._event(c, "running")))
+
+    def _finish(self, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        # الحالة النهائية وحدثها في معاملة واحدة كي لا يرى المتابع نهاية بلا حدث
+        def go(c: sqlite3.Connection) -> None:
+            c.execute("UPDATE jobs SET status=?, result=?, error=?, finished=? WHERE id=?",
+                      (status, _dump(result), error, time.time(), self.id))
+            self._event(c, status, **({"error": error} if error else {}))
+        with self._lock:
+            self.status = status
+            _write(go)
+
+def _to_dict(r: sqlite3.Row, with_result: bool = True) -> Dict[str, Any]:
+    last = _conn().execute("SELECT event FROM job_events WHERE job_id=? ORDER BY seq DESC LIMIT 1",
+                           (r["id"],)).fetchone()
+    out = {
+        "id": r["id"], "kind": r["kind"], "params": _load(r["params"]), "status": r["status"],
+        "created": r["created"], "started": r["started"], "finished": r["finished"],
+        "last_event": _load(last["event"]) if last else None,
+    }
+    if with_result:
+        out["result"] = _load(r["result"])
+        out["error"] = r["error"]
+    return out
+
+def _alive(pid: Optional[int]) -> bool:
+    try:
+        os.kill(int(pid), 0)
+    except (TypeError, ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _reap(r: sqlite3.Row) -> sqlite3.Row:
+    """مهمة بلا نهاية وعمليتها ماتت (إعادة تشغيل/انهيار) → error بدل الانتظار للأبد"""
+    if r["status"] in FINAL or r["host"] != _HOST or _alive(r["pid"]):
+        return r
+    def go(c: sqlite3.Connection) -> None:
+        cur = c.execute("UPDATE jobs SET status='error', error=?, finished=? WHERE id=? AND status NOT IN ('done','error')",
+                        ("worker exited", time.time(), r["id"]))
+        if cur.rowcount:
+            seq = c.execute("SELECT COALESCE(MAX(seq), 0) FROM job_events WHERE job_id=?", (r["id"],)).fetchone()[0] + 1
+            c.execute("INSERT INTO job_events(job_id, seq, event) VALUES(?,?,?)",
+                      (r["id"], seq, _dump({"seq": seq, "stage": "error", "ts": time.time(), "error": "worker exited"})))
+    _write(go)
+    return _conn().execute("SELECT * FROM jobs WHERE id=?", (r["id"],)).fetchone()
+
+# ==== السجل والمنفّذ ====
+_active: Dict[str, Job] = {}     # مهام هذه العملية التي لم تنتهِ (حد JOBS_MAX_PENDING)
+_jobs_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_last_prune = 0.0
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max(1, JOBS_WORKERS), thread_name_prefix="job")
+    return _executor
+
+def _prune(now: float) -> None:
+    global _last_prune
+    if now - _last_prune < 60:
+        return
+    _last_prune = now
+    def go(c: sqlite3.Connection) -> None:
+        old = [r[0] for r in c.execute("SELECT id FROM jobs WHERE finished IS NOT NULL AND finished < ?",
+                                        (now - JOBS_RETENTION_SEC,))]
+        over = c.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] - len(old) - JOBS_MAX_KEPT
+        if over > 0:
+            old += [r[0] for r in c.execute("""SELECT id FROM jobs WHERE finished IS NOT NULL AND finished >= ?
+                                               ORDER BY finished LIMIT ?""", (now - JOBS_RETENTION_SEC, over))]
+        for job_id in old:
+            c.execute("DELETE FROM job_events WHERE job_id=?", (job_id,))
+            c.execute("DELETE FROM jobs WHERE id=?", (job_id,))
+    _write(go)
+
+def _run(job: Job, fn: Callable[..., Any], args: tuple, kwargs: Dict[str, Any],
+         on_done: Optional[Callable[[], None]]) -> None:
+    try:
+        job._start()
+        result = fn(*args, progress=job.progress, **kwargs)
+    except Exception as e:
+        print(f"⚠️ Job {job.kind}/{job.id} failed:", e)
+        try:
+            job._finish("error", error=str(e))
+        except Exception as e2:
+            print(f"⚠️ Job {job.id} state not saved:", e2)
+    else:
+        try:
+            job._finish("done", result=result)
+        except Exception as e:
+            print(f"⚠️ Job {job.id} state not saved:", e)
+    finally:
+        with _jobs_lock:
+            _active.pop(job.id, None)
+        if on_done:
+            on_done()
+
+def submit(kind: str, fn: Callable[..., Any], *args: Any,
+           params: Optional[Dict[str, Any]] = None,
+           on_done: Optional[Callable[[], None]] = None, **kwargs: Any) -> Job:
+    """يشغّل fn(*args, progress=callback, **kwargs) في الخلفية ويعيد المهمة فوراً؛
+    on_done يُستدعى عند الانتهاء (مثلاً تحرير مقعد التحكم بالقبول)"""
+    job = Job(kind, params)
+    with _jobs_lock:
+        if len(_active) >= JOBS_MAX_PENDING:
+            raise JobsBusy(f"too many active jobs ({len(_active)})")
+        _active[job.id] = job
+    try:
+        _prune(time.time())
+        with job._lock:
+            _write(lambda c: (c.execute("""INSERT INTO jobs(id, kind, params, status, created, pid, host)
+                                           VALUES(?,?,?, 'queued', ?,?,?)""",
+                                        (job.id, kind, _dump(job.params), time.time(), os.getpid(), _HOST)),
+                              job._event(c, "queued")))
+    except Exception:
+        with _jobs_lock:
+            _active.pop(job.id, None)
+        raise
+    _pool().submit(_run, job, fn, args, kwargs, on_done)
+    return job
+
+def get_job(job_id: str, with_result: bool = True) -> Optional[Dict[str, Any]]:
+    r = _conn().execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+    return _to_dict(_reap(r), with_result) if r else None
+
+def job_events(job_id: str, after: int = 0) -> List[Dict[str, Any]]:
+    """أحداث المهمة بعد الرقم after (للمتابعة بالاستطلاع من أي عامل)"""
+    rows = _conn().execute("SELECT event FROM job_events WHERE job_id=? AND seq>? ORDER BY seq",
+                           (job_id, after)).fetchall()
+    return [_load(r["event"]) for r in rows]
+
+def list_jobs(limit: int = 20) -> List[Dict[str, Any]]:
+    rows = _conn().execute("SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+    return [_to_dict(_reap(r), with_result=False) for r in rows]
@@ -0,0 +1,123 @@
+# bassam_core/workers/leader.py
+# -*- coding: utf-8 -*-
+"""
+👑 انتخاب قائد واحد بين عمّال uvicorn (--workers N) على نفس الجهاز
+- القيادة = قفل flock حصري غير حاجز على data/scheduler.lock.
+- النواة تحرر القفل تلقائياً عند موت العملية → أحد التابعين يأخذه في المحاولة التالية.
+- التابعون يعيدون المحاولة كل LEADER_RETRY_SEC ويواصلون خدمة القراءات.
+"""
+
+import os
+import json
+import time
+import socket
+import threading
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - ويندوز: عملية واحدة دائماً قائدة
+    fcntl = None
+
+LEADER_RETRY_SEC = float(os.getenv("LEADER_RETRY_SEC", "5"))
+
+class Leader:
+    def __init__(self, path: str, on_elected: Callable[[], None], retry_sec: float = LEADER_RETRY_SEC,
+                 role: str = "scheduler"):
+        self.path = path
+        self.role = role
+        self.on_elected = on_elected
+        self.retry_sec = retry_sec
+        self.is_leader = False
+        self.since: Optional[float] = None
+        self._fd: Optional[int] = None
+        self._info: Dict[str, Any] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def try_acquire(self) -> bool:
+        if self.is_leader:
+            return True
+        if fcntl is None:
+            self.is_leader, self.since = True, time.time()
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # الفاصل يبقى مفتوحاً طوال القيادة (إغلاقه يحرر القفل)
+        self._fd = fd
+        self.is_leader, self.since = True, time.time()
+        self._info = {"pid": os.getpid(), "host": socket.gethostname(), "since": self.since}
+        self._write_info()
+        return True
+
+    def _write_info(self) -> None:
+        if self._fd is None:
+            return
+        data = json.dumps(self._info).encode("utf-8")
+        os.pwrite(self._fd, data, 0)
+        os.ftruncate(self._fd, len(data))
+
+    def update(self, **fields: Any) -> None:
+        """حالة يعلنها القائد لبقية العمّال عبر ملف القفل (مثل cycling)"""
+        if self.is_leader:
+            self._info.update(fields)
+            self._write_info()
+
+    def lease_held(self) -> bool:
+        """هل يحمل أحدٌ القيادة الآن (هنا أو في عامل آخر)؟
+        فحص بقفل مشترك غير حاجز: ينجح فقط إن لم يكن هناك قفل حصري"""
+        if self.is_leader:
+            return True
+        if fcntl is None:
+            return False
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        else:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            return False
+        finally:
+            os.close(fd)
+
+    def holder(self) -> Dict[str, Any]:
+        """من يحمل القيادة الآن (كما كتبه القائد في ملف القفل)"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.loads(f.read() or "{}")
+        except (OSError, ValueError):
+            return {}
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            if self.try_acquire():
+                print(f"👑 Leader elected (pid {os.getpid()}) — running {self.role} here")
+                self.on_elected()
+                return
+            self._stop.wait(self.retry_sec)
+
+    def release(self) -> None:
+        self._stop.set()
+        if self._fd is not None:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self.is_leader = False
+
+    def status(self) -> Dict[str, Any]:
+        # ملف القفل يبقى بعد موت القائد → holder لا يُعتمد إلا والقيادة محمولة فعلاً
+        held = self.lease_held()
+        return {"leader": self.is_leader, "running": held, "pid": os.getpid(), "since": self.since,
+                "holder": self.holder() if held else {}}
@@ -1,15 +1,19 @@
-from typing import Optional, List, Dict
+from typing import Callable, Optional, List, Dict
 from bassam_core.search import ddg_search, fetch_page
 from bassam_core.summarize import summarize_chunks
-from bassam_core.storage import save_doc, save_summary, set_state, dequeue_query
+from bassam_core.storage import save_doc, save_summary, get_state, set_state, dequeue_query
 
 DEFAULT_QUERY = "الذكاء الاصطناعي"
 
-def _pipeline(query: str) -> Dict:
+Progress = Optional[Callable[..., None]]
+
+def _pipeline(query: str, progress: Progress = None) -> Dict:
+    if progress:
+        progress("search", query=query)
     results = ddg_search(query, max_results=5)
     pages: List[str] = []
     saved_items = []
-    for r in results[:3]:
+    for i, r in enumerate(results[:3], 1):
         try:
             txt = fetch_page(r["url"])
             pages.append(txt)
@@ -17,13 +21,18 @@ def _pipeline(query: str) -> Dict:
             saved_items.append({"title": r["title"], "url": r["url"], "doc_id": doc_id})
         except Exception:
             continue
+        finally:
+            if progress:
+                progress("fetch", done=i, total=min(3, len(results)), url=r.get("url"))
+    if progress:
+        progress("summarize", sources=len(pages))
     summary = summarize_chunks(query, pages if pages else ["لم يتم جلب محتوى كافٍ."])
     sum_id = save_summary(query, saved_items, summary)
-    return {"summary_id": sum_id, "query": query, "sources": saved_items}
+    return {"summary_id": sum_id, "query": query, "summary": summary, "sources": saved_items}
 
-def run_once(forced_query: Optional[str] = None) -> Dict:
+def run_once(forced_query: Optional[str] = None, progress: Progress = None) -> Dict:
     q = forced_query or dequeue_query() or DEFAULT_QUERY
     set_state(active=True, last_query=q)
-    info = _pipeline(q)
-    st = set_state(active=False, last_run=info["summary_id"], runs=get_state().get("runs",0)+1)  # type: ignore
+    info = _pipeline(q, progress)
+    st = set_state(active=False, last_run=info["summary_id"], runs=get_state().get("runs",0)+1)
     return {"ran": True, **info, "state": st}
@@ -0,0 +1,291 @@
+# bassam_core/workers/vector_store.py
+# -*- coding: utf-8 -*-
+"""
+🧲 مخزن المتجهات لمعرفة بسام
+- مصفوفة واحدة متصلة float16 على القرص (numpy.memmap) صف لكل سجل.
+- ملف جانبي JSONL يربط معرّف السجل برقم الصف (الحقل row هو المرجع لا ترتيب الأسطر).
+- بحث cosine دقيق (top-k) بضرب مصفوفة×متجه على دفعات + argpartition.
+كل عمّال uvicorn يفتحون نفس الملف للقراءة فقط، فتتشارك صفحات الذاكرة
+بدون نسخة خاصة لكل عملية.
+"""
+
+import os
+import json
+import zlib
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from utils.textnorm import tokens
+
+try:
+    import fcntl  # قفل بين العمليات (لينكس/ماك)
+except ImportError:  # pragma: no cover - ويندوز
+    fcntl = None
+
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+DATA_DIR = os.path.join(ROOT_DIR, "data")
+os.makedirs(DATA_DIR, exist_ok=True)
+
+EMBED_DIM = int(os.getenv("EMBED_DIM", "256"))
+# يتغير مع أي تعديل في embed_text أو في utils.textnorm.tokens: متجهات نسخة أخرى لا تُقارن بهذه
+EMBED_VERSION = "crc32-sign/textnorm-1"
+KNOW_PATH = os.path.join(DATA_DIR, "knowledge.jsonl")   # مصدر إعادة بناء فهرس المعرفة
+SCAN_CHUNK_ROWS = int(os.getenv("VEC_SCAN_ROWS", "65536"))  # حد الذاكرة أثناء المسح
+
+# ==== تضمين نصي خفيف (hashing trick) ====
+def embed_text(text: str, dim: int = EMBED_DIM) -> np.ndarray:
+    """متجه ثابت الطول من كلمات النص (بدون نموذج خارجي)."""
+    vec = np.zeros(dim, dtype=np.float32)
+    for tok in tokens(text):
+        h = zlib.crc32(tok.encode("utf-8"))
+        vec[h % dim] += 1.0 if (h >> 31) & 1 else -1.0
+    return vec
+
+def _normalize(vec: np.ndarray) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32).ravel()
+    n = float(np.linalg.norm(v))
+    return v / n if n > 0 else v
+
+# ==== المخزن ====
+class StaleIndex(RuntimeError):
+    """الملفات بُنيت بتضمين آخر (نسخة أو بُعد مختلف): يجب إعادة بنائها"""
+
+class VectorStore:
+    def __init__(self, prefix: str, dim: int = EMBED_DIM, version: str = EMBED_VERSION):
+        self.dim = dim
+        self.version = version
+        self.row_bytes = dim * 2  # float16
+        self.matrix_path = prefix + ".f16"
+        self.ids_path = prefix + ".ids.jsonl"
+        self.lock_path = prefix + ".lock"
+        self.marker_path = prefix + ".meta.json"
+        self._checked = False
+        self._lock = threading.Lock()
+        self._ids: List[Optional[str]] = []        # بفهرس الصف؛ None لصف بلا سطر معرّف
+        self._meta: List[Optional[Dict[str, Any]]] = []
+        self._holes = np.empty(0, dtype=np.int64)   # الصفوف الفارغة كمصفوفة (للمسح)
+        self._hole_rows: set = set()                 # ونفسها كمجموعة تُحدَّث من الأسطر الجديدة فقط
+        self._ids_offset = 0
+        self._mm: Optional[np.memmap] = None
+        self._mm_rows = 0
+
+    # ---- علامة التضمين ----
+    def _marker(self) -> Dict[str, Any]:
+        return {"embed": self.version, "dim": self.dim}
+
+    def _write_marker(self) -> None:
+        tmp = self.marker_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._marker(), f)
+        os.replace(tmp, self.marker_path)
+
+    def check(self) -> None:
+        """يرفض (StaleIndex) ملفات بُنيت بتضمين مختلف؛ مخزن جديد يأخذ علامة هذه النسخة"""
+        if self._checked:
+            return
+        try:
+            with open(self.marker_path, "r", encoding="utf-8") as f:
+                found = json.load(f)
+        except (OSError, ValueError):
+            found = None
+        if found is None:
+            if os.path.exists(self.matrix_path) and os.path.getsize(self.matrix_path):
+                raise StaleIndex(f"{self.matrix_path}: no embedding marker (built before {self.version})")
+            self._write_marker()
+        elif found != self._marker():
+            raise StaleIndex(f"{self.matrix_path}: built with {found}, expected {self._marker()}")
+        self._checked = True
+
+    def rebuild(self, records: Iterable[Tuple[str, np.ndarray, Dict[str, Any]]], batch: int = 512) -> int:
+        """يمسح الملفات ويعيد الفهرسة من المصدر تحت قفل الملف (عامل واحد يبني والبقية تجد العلامة الجديدة)"""
+        with self._lock, open(self.lock_path, "a") as lf:
+            if fcntl:
+                fcntl.flock(lf, fcntl.LOCK_EX)
+            try:
+                self._checked = False
+                try:
+                    self.check()
+                    return 0          # بناه عامل آخر بينما ننتظر القفل
+                except StaleIndex:
+                    pass
+                for path in (self.matrix_path, self.ids_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._ids, self._meta, self._ids_offset = [], [], 0
+                self._holes, self._hole_rows = np.empty(0, dtype=np.int64), set()
+                self._mm, self._mm_rows = None, 0
+                n, buf = 0, []
+                for rec in records:
+                    buf.append(rec)
+                    if len(buf) >= batch:
+                        n += self._append(buf)
+                        buf = []
+                if buf:
+                    n += self._append(buf)
+                self._write_marker()   # أخيراً: انقطاع في المنتصف يبقي المخزن مرفوضاً لا نصف مبني
+                self._checked = True
+                return n
+            finally:
+                if fcntl:
+                    fcntl.flock(lf, fcntl.LOCK_UN)
+
+    # ---- الكتابة (إلحاق فقط) ----
+    def add(self, record_id: str, vec: np.ndarray, meta: Optional[Dict[str, Any]] = None) -> int:
+        return self.add_many([record_id], [vec], [meta or {}])[0]
+
+    def add_many(self, ids: List[str], vecs: List[np.ndarray],
+                 metas: Optional[List[Dict[str, Any]]] = None) -> List[int]:
+        if not ids:
+            return []
+        metas = metas or [{} for _ in ids]
+        with self._lock, open(self.lock_path, "a") as lf:
+            if fcntl:
+                fcntl.flock(lf, fcntl.LOCK_EX)
+            try:
+                self.check()
+                return self._append_rows(ids, vecs, metas)
+            finally:
+                if fcntl:
+                    fcntl.flock(lf, fcntl.LOCK_UN)
+
+    def _append(self, recs: List[Tuple[str, np.ndarray, Dict[str, Any]]]) -> int:
+        return len(self._append_rows([r[0] for r in recs], [r[1] for r in recs], [r[2] for r in recs]))
+
+    def _append_rows(self, ids: List[str], vecs: List[np.ndarray], metas: List[Dict[str, Any]]) -> List[int]:
+        # يُستدعى تحت القفلين
+        block = np.stack([_normalize(v) for v in vecs]).astype(np.float16)
+        if block.shape[1] != self.dim:
+            raise ValueError(f"expected dim {self.dim}, got {block.shape[1]}")
+        with open(self.matrix_path, "ab") as f:
+            # صف ناقص من كتابة مقطوعة سابقة → نقصّه ليبقى الملف محاذياً للصفوف
+            size = f.seek(0, os.SEEK_END)
+            first = size // self.row_bytes
+            if size != first * self.row_bytes:
+                f.truncate(first * self.row_bytes)
+            f.write(block.tobytes())
+        rows = list(range(first, first + len(ids)))
+        lines = "".join(json.dumps({"id": rid, "row": row, **meta}, ensure_ascii=False) + "\n"
+                        for rid, row, meta in zip(ids, rows, metas))
+        with open(self.ids_path, "a+b") as f:
+            # سطر مبتور من كتابة مقطوعة سابقة → نقصّه حتى آخر سطر كامل قبل الإلحاق
+            f.truncate(self._last_newline(f))
+            f.write(lines.encode("utf-8"))
+        return rows
+
+    @staticmethod
+    def _last_newline(f) -> int:
+        """الموضع بعد آخر '\n' في الملف (0 إن لم يوجد)"""
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            step = min(4096, pos)
+            f.seek(pos - step)
+            i = f.read(step).rfind(b"\n")
+            if i >= 0:
+                return pos - step + i + 1
+            pos -= step
+        return 0
+
+    # ---- القراءة ----
+    def _refresh(self) -> None:
+        """يقرأ الأسطر الجديدة من ملف المعرّفات ويعيد ربط memmap عند النمو."""
+        self.check()
+        holes_changed = False
+        if os.path.exists(self.ids_path):
+            with open(self.ids_path, "rb") as f:
+                f.seek(self._ids_offset)
+                for raw in f:
+                    if not raw.endswith(b"\n"):
+                        break  # سطر قيد الكتابة
+                    self._ids_offset += len(raw)
+                    try:
+                        obj = json.loads(raw)
+                        row = int(obj.pop("row", len(self._ids)))
+                        rid = obj.pop("id")
+                    except (ValueError, KeyError, TypeError):
+                        continue  # سطر تالف من ملف قديم
+                    if row >= len(self._ids):
+                        if row > len(self._ids):      # قفزة: الصفوف بينهما بلا سطر
+                            self._hole_rows.update(range(len(self._ids), row))
+                            holes_changed = True
+                        self._ids.extend([None] * (row + 1 - len(self._ids)))
+                        self._meta.extend([None] * (row + 1 - len(self._meta)))
+                    elif row in self._hole_rows:
+                        self._hole_rows.discard(row)
+                        holes_changed = True
+                    self._ids[row], self._meta[row] = rid, obj
+        size = os.path.getsize(self.matrix_path) if os.path.exists(self.matrix_path) else 0
+        rows = min(size // self.row_bytes, len(self._ids))
+        if holes_changed:
+            # صفوف بلا معرّف (كُتب متجهها ولم يُكتب سطرها) لا تظهر في النتائج
+            self._holes = np.array(sorted(self._hole_rows), dtype=np.int64)
+        if rows != self._mm_rows:
+            self._mm = np.memmap(self.matrix_path, dtype=np.float16, mode="r",
+                                 shape=(rows, self.dim)) if rows else None
+            self._mm_rows = rows
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return self._mm_rows
+
+    def search(self, query_vec: np.ndarray, k: int = 5,
+               chunk_rows: int = SCAN_CHUNK_ROWS) -> List[Tuple[str, float, Dict[str, Any]]]:
+        with self._lock:
+            self._refresh()
+            mm, rows = self._mm, self._mm_rows
+            ids, metas, holes = self._ids, self._meta, self._holes
+        if mm is None or k <= 0:
+            return []
+        q = _normalize(query_vec)
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, rows, chunk_rows):
+            block = np.asarray(mm[start:start + chunk_rows], dtype=np.float32)
+            scores = block @ q
+            if len(holes):
+                h = holes[(holes >= start) & (holes < start + len(scores))]
+                scores[h - start] = -np.inf
+            if len(scores) > k:
+                top = np.argpartition(scores, -k)[-k:]
+            else:
+                top = np.arange(len(scores))
+            best_rows = np.concatenate([best_rows, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            if len(best_scores) > k:
+                keep = np.argpartition(best_scores, -k)[-k:]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+        order = np.argsort(-best_scores)
+        return [(ids[r], float(best_scores[i]), metas[r]) for i, r in ((i, int(best_rows[i])) for i in order)
+                if ids[r] is not None]
+
+# ==== مخزن المعرفة الافتراضي ====
+_KNOWLEDGE: Optional[VectorStore] = None
+
+def _knowledge_records():
+    if not os.path.exists(KNOW_PATH):
+        return
+    with open(KNOW_PATH, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            yield (rec["id"], embed_text(rec["query"] + "\n" + rec["summary"]),
+                   {"query": rec["query"], "timestamp": rec.get("timestamp")})
+
+def knowledge_store() -> VectorStore:
+    global _KNOWLEDGE
+    if _KNOWLEDGE is None:
+        store = VectorStore(os.path.join(DATA_DIR, "knowledge_vectors"))
+        try:
+            store.check()
+        except StaleIndex as e:
+            # التضمين تغيّر (مثلاً تقطيع textnorm): الفهرس القديم يعطي تشابهاً بلا معنى → نعيد البناء
+            print("⚠️ Knowledge index stale —", e)
+            n = store.rebuild(_knowledge_records())
+            print(f"🧲 Knowledge index rebuilt ({n} records)")
+        _KNOWLEDGE = store
+    return _KNOWLEDGE